@@ -0,0 +1,2 @@
+# coding=utf-8
+"""Performance benchmarks of the Bridge API client and download paths."""
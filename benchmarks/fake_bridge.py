@@ -0,0 +1,259 @@
+# coding=utf-8
+"""Local fake of the Bridge API and identity server for benchmarks.
+
+The server answers the requests the plugin sends with synthetic but
+well-formed payloads: tokens, coverage results, thumbnails and zipped
+TIFF maps of a requested size. A fixed latency can be added to every
+request to mimic the round trip to the real service.
+"""
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+def synthetic_png(width=64, height=64, seed=0):
+    """Build a valid RGB png of noise.
+
+    :param width: Image width.
+    :type width: int
+
+    :param height: Image height.
+    :type height: int
+
+    :param seed: Random seed, the same seed gives the same image.
+    :type seed: int
+
+    :return: Png file content.
+    :rtype: bytes
+    """
+    generator = random.Random(seed)
+    rows = b''.join(
+        b'\x00' + bytes(generator.getrandbits(8) for _ in range(width * 3))
+        for _ in range(height))
+
+    def chunk(kind, data):
+        return (
+            struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+        + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def synthetic_zipped_tiff(path, size):
+    """Write a zip holding a single tif member of about the given size.
+
+    The member content is random, so it does not compress and the archive
+    is about as large as the member.
+
+    :param path: Output zip path.
+    :type path: str
+
+    :param size: Size of the tif member in bytes.
+    :type size: int
+    """
+    block = os.urandom(1024 * 1024)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open('map.tif', 'w') as member:
+            written = 0
+            while written < size:
+                data = block[:size - written]
+                member.write(data)
+                written += len(data)
+
+
+def coverage_result(index, geometry_index):
+    """A synthetic coverage result.
+
+    :param index: Index of the result.
+    :type index: int
+
+    :param geometry_index: Index of the searched geometry.
+    :type geometry_index: int
+
+    :rtype: dict
+    """
+    field_id = 'fld{:04d}x{:04d}'.format(geometry_index, index)
+    date = '2018-{:02d}-{:02d}'.format(index % 12 + 1, index % 28 + 1)
+    image_id = 'sentinel-2:S2A_{}_{}'.format(date.replace('-', ''), index)
+    link = '/field-level-maps/v4/season-fields/{}/coverage/{}'.format(
+        field_id, image_id)
+    return {
+        'seasonField': {'id': field_id, 'customerExternalId': field_id},
+        'image': {
+            'id': image_id,
+            'date': date,
+            'sensor': 'SENTINEL_2',
+            'weather': 'HOT',
+            'soilMaterial': 'BARE'
+        },
+        'maps': [{
+            'type': 'INSEASON_NDVI',
+            '_links': {
+                'thumbnail': link + '/base-reference-map/INSEASON_NDVI/'
+                                    'thumbnail.png',
+                'image:image/tiff+zip': '/files/map.tiff.zip'
+            }
+        }],
+        'coverageType': 'CLEAR'
+    }
+
+
+class FakeBridgeHandler(BaseHTTPRequestHandler):
+    """Request handler of FakeBridgeServer."""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this every
+    # response waits for the delayed acknowledgement of the client.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, payload, status=200):
+        self.send_body(
+            json.dumps(payload).encode('utf-8'), 'application/json', status)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        body = self.read_body()
+        path = urlsplit(self.path).path
+        if path.endswith('/connect/token'):
+            self.send_json({
+                'access_token': 'benchmark-token',
+                'refresh_token': 'benchmark-refresh',
+                'expires_in': 3600,
+                'token_type': 'Bearer'
+            })
+        elif path.endswith('/coverage') or path.endswith(
+                '/catalog-imagery'):
+            query = parse_qs(urlsplit(self.path).query)
+            limit = int(query.get('$limit', ['100'])[0])
+            offset = int(query.get('$offset', ['0'])[0])
+            geometry = json.loads(body or b'{}').get('Geometry', '')
+            geometry_index = sum(bytearray(geometry.encode('utf-8'))) % 10000
+            count = max(
+                0, min(limit, self.server.results_per_geometry - offset))
+            self.send_json([
+                coverage_result(offset + index, geometry_index)
+                for index in range(count)])
+        else:
+            self.send_json({'message': 'Unknown endpoint'}, status=404)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        path = urlsplit(self.path).path
+        if path.endswith('thumbnail.png'):
+            self.send_body(self.server.thumbnail, 'image/png')
+        elif path.endswith('.tiff.zip'):
+            self.send_file(self.server.map_path, 'application/zip')
+        else:
+            self.send_json({'message': 'Unknown endpoint'}, status=404)
+
+    def send_file(self, path, content_type):
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.send_header('Accept-Ranges', 'none')
+        self.end_headers()
+        with open(path, 'rb') as source:
+            while True:
+                data = source.read(64 * 1024)
+                if not data:
+                    break
+                self.wfile.write(data)
+
+
+class FakeBridgeServer(object):
+    """Fake Bridge API and identity server running in a thread."""
+
+    def __init__(
+            self, work_directory, latency=0.0, results_per_geometry=10,
+            map_size=8 * 1024 * 1024):
+        """Fake Bridge API and identity server.
+
+        :param work_directory: Directory where the synthetic map is written.
+        :type work_directory: str
+
+        :param latency: Seconds added to every request.
+        :type latency: float
+
+        :param results_per_geometry: Coverage results of each geometry.
+        :type results_per_geometry: int
+
+        :param map_size: Size of the synthetic TIFF map in bytes.
+        :type map_size: int
+        """
+        self.server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), FakeBridgeHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.results_per_geometry = results_per_geometry
+        self.server.thumbnail = synthetic_png()
+        self.server.map_path = os.path.join(work_directory, 'map.tiff.zip')
+        self.set_map_size(map_size)
+        self.thread = None
+
+    @property
+    def url(self):
+        """Base url of the server.
+
+        :rtype: str
+        """
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def configure(self, latency=None, results_per_geometry=None):
+        """Change the server behaviour, None keeps the current value."""
+        if latency is not None:
+            self.server.latency = latency
+        if results_per_geometry is not None:
+            self.server.results_per_geometry = results_per_geometry
+
+    def set_map_size(self, size):
+        """Regenerate the synthetic zipped TIFF map.
+
+        :param size: Size of the TIFF in bytes.
+        :type size: int
+        """
+        synthetic_zipped_tiff(self.server.map_path, size)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,471 @@
+# coding=utf-8
+"""Run the performance benchmarks and write their results as JSON.
+
+Every benchmark runs against a local FakeBridgeServer, so results only
+depend on the machine and the plugin code. Benchmarks needing QGIS are
+reported as skipped when QGIS can not be imported.
+
+Usage::
+
+    python -m benchmarks.run_benchmarks --output benchmark_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.fake_bridge import FakeBridgeServer
+from geosys.bridge_api.api_abstract import ApiClient, close_sessions
+from geosys.bridge_api.cache import COVERAGE_CACHE
+from geosys.bridge_api.connection import ConnectionAPIClient
+from geosys.bridge_api.coverage_engine import CoverageEngine, RateLimiter
+from geosys.bridge_api.field_level_maps import FieldLevelMapsAPIClient
+from geosys.bridge_api.metrics import METRICS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+MEGABYTE = 1024 * 1024
+GEOMETRY = (
+    'POLYGON(({x} 41.33, {x_end} 41.33, {x_end} 41.32, {x} 41.32, '
+    '{x} 41.33))')
+
+# Benchmark parameters, the quick values are used with --quick.
+PARAMETERS = {
+    'full': {
+        'geometries': [1, 10, 50],
+        'results': [10, 200],
+        'thumbnails': 200,
+        'thumbnail_workers': [1, 8],
+        'map_sizes': [8, 64],
+        'zones': [10, 100, 1000],
+        'polygons': [1000, 10000, 50000],
+        'repeat': 3
+    },
+    'quick': {
+        'geometries': [1, 10],
+        'results': [10],
+        'thumbnails': 40,
+        'thumbnail_workers': [1, 8],
+        'map_sizes': [4],
+        'zones': [10, 100],
+        'polygons': [1000, 5000],
+        'repeat': 1
+    }
+}
+
+# Largest layer merged with the former pairwise combine, which takes
+# minutes on larger layers.
+PAIRWISE_MAX_POLYGONS = 5000
+
+BENCHMARKS = []
+
+
+def benchmark(name, requires_qgis=False):
+    """Register a benchmark function.
+
+    The function is called with the BenchmarkContext and returns a list
+    of (params, metrics) tuples, one per measured configuration.
+
+    :param name: Name of the benchmark.
+    :type name: str
+
+    :param requires_qgis: Whether the benchmark needs a QGIS application.
+    :type requires_qgis: bool
+    """
+    def register(function):
+        BENCHMARKS.append((name, function, requires_qgis))
+        return function
+    return register
+
+
+class BenchmarkContext(object):
+    """State shared by the benchmarks of a run."""
+
+    def __init__(self, server, work_directory, parameters, latency):
+        self.server = server
+        self.work_directory = work_directory
+        self.parameters = parameters
+        self.latency = latency
+
+
+def peak_rss():
+    """Peak resident memory of the process in megabytes.
+
+    :return: Peak RSS, None when it can not be measured.
+    :rtype: float
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    if sys.platform == 'darwin':
+        return peak / float(MEGABYTE)
+    return peak / 1024.0
+
+
+def best_of(repeat, function):
+    """Smallest duration of several runs of a function.
+
+    :param repeat: Number of runs.
+    :type repeat: int
+
+    :param function: Function to time, called without arguments.
+    :type function: callable
+
+    :return: Seconds of the fastest run.
+    :rtype: float
+    """
+    durations = []
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def geometries(count):
+    """Distinct square geometries in WKT format.
+
+    :param count: Number of geometries.
+    :type count: int
+
+    :rtype: list
+    """
+    return [
+        GEOMETRY.format(x=-86.87 + index * 0.01, x_end=-86.86 + index * 0.01)
+        for index in range(count)]
+
+
+@benchmark('identity_login')
+def bench_identity_login(context):
+    client = ConnectionAPIClient(endpoint_url=context.server.url)
+    count = 20
+
+    def login():
+        for _ in range(count):
+            client.get_access_token('user', 'password', 'id', 'secret')
+
+    seconds = best_of(context.parameters['repeat'], login)
+    return [({'logins': count}, {
+        'seconds': round(seconds, 4),
+        'mean_ms': round(seconds * 1000 / count, 2)
+    })]
+
+
+@benchmark('coverage_search')
+def bench_coverage_search(context):
+    client = FieldLevelMapsAPIClient(
+        'benchmark-token', endpoint_url=context.server.url)
+
+    def search(geometry, filters):
+        # Measure the requests, not the response cache.
+        return client.get_coverage(
+            {'Geometry': geometry}, filters, force_refresh=True)
+
+    engine = CoverageEngine(search, rate_limiter=RateLimiter(0))
+    runs = []
+    for count in context.parameters['geometries']:
+        for results in context.parameters['results']:
+            context.server.configure(results_per_geometry=results)
+            wkt = geometries(count)
+            found = []
+
+            def run():
+                del found[:]
+                for _, page, error in engine.iter_results(wkt):
+                    if error:
+                        raise error
+                    found.extend(page)
+
+            METRICS.reset()
+            seconds = best_of(context.parameters['repeat'], run)
+            requests = sum(row['requests'] for row in METRICS.summary())
+            runs.append(({'geometries': count, 'results': results}, {
+                'seconds': round(seconds, 4),
+                'results': len(found),
+                'requests': requests // max(context.parameters['repeat'], 1),
+                'results_per_second': round(len(found) / seconds, 1)
+            }))
+    return runs
+
+
+@benchmark('thumbnail_throughput')
+def bench_thumbnail_throughput(context):
+    client = ApiClient('benchmark-token', endpoint_url=context.server.url)
+    url = '{}/field-level-maps/v4/season-fields/fld/coverage/img/' \
+          'base-reference-map/INSEASON_NDVI/thumbnail.png'.format(
+              context.server.url)
+    count = context.parameters['thumbnails']
+    runs = []
+    for workers in context.parameters['thumbnail_workers']:
+        sizes = []
+
+        def run():
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                sizes[:] = executor.map(
+                    lambda _: len(client.get_content(url)), range(count))
+
+        seconds = best_of(context.parameters['repeat'], run)
+        runs.append(({'thumbnails': count, 'workers': workers}, {
+            'seconds': round(seconds, 4),
+            'thumbnails_per_second': round(count / seconds, 1),
+            'megabytes_per_second': round(
+                sum(sizes) / float(MEGABYTE) / seconds, 2)
+        }))
+    return runs
+
+
+@benchmark('file_downloader', requires_qgis=True)
+def bench_file_downloader(context):
+    from geosys.utilities.downloader import fetch_data
+
+    url = '{}/files/map.tiff.zip'.format(context.server.url)
+    output_path = os.path.join(context.work_directory, 'download.zip')
+    runs = []
+    for size in context.parameters['map_sizes']:
+        context.server.set_map_size(size * MEGABYTE)
+        before = peak_rss()
+        seconds = best_of(
+            context.parameters['repeat'],
+            lambda: fetch_data(url, output_path))
+        after = peak_rss()
+        megabytes = os.path.getsize(output_path) / float(MEGABYTE)
+        metrics = {
+            'seconds': round(seconds, 4),
+            'megabytes_per_second': round(megabytes / seconds, 2)
+        }
+        if before is not None:
+            metrics['peak_rss_mb'] = round(after, 1)
+            metrics['rss_growth_mb'] = round(after - before, 1)
+        runs.append(({'megabytes': size}, metrics))
+    return runs
+
+
+@benchmark('extract_zip', requires_qgis=True)
+def bench_extract_zip(context):
+    from geosys.utilities.downloader import extract_zip
+
+    runs = []
+    for size in context.parameters['map_sizes']:
+        context.server.set_map_size(size * MEGABYTE)
+        destination = os.path.join(context.work_directory, 'extracted')
+        seconds = best_of(
+            context.parameters['repeat'],
+            lambda: extract_zip(context.server.server.map_path, destination))
+        runs.append(({'megabytes': size}, {
+            'seconds': round(seconds, 4),
+            'megabytes_per_second': round(size / seconds, 2)
+        }))
+    return runs
+
+
+@benchmark('create_hotspot_layer', requires_qgis=True)
+def bench_create_hotspot_layer(context):
+    from geosys.utilities.gui_utilities import create_hotspot_layer
+    from geosys.utilities.settings import setting, set_setting
+
+    output_directory = setting('output_directory', expected_type=str)
+    set_setting('output_directory', context.work_directory)
+    runs = []
+    try:
+        for count in context.parameters['zones']:
+            segments = [{
+                'id': index,
+                'geometry': GEOMETRY.format(
+                    x=-86.87 + index * 0.001, x_end=-86.869 + index * 0.001),
+                'stats': {
+                    'mean': 70.5, 'max': 95.4, 'min': 68.2, 'area': 2020.1,
+                    'std': 6.5
+                }
+            } for index in range(count)]
+            created_layers = []
+            seconds = best_of(
+                context.parameters['repeat'],
+                lambda: create_hotspot_layer(
+                    [{'id': 1, 'segments': segments}], 'zones',
+                    'zones_{}'.format(count), created_layers))
+            runs.append(({'zones': count}, {
+                'seconds': round(seconds, 4),
+                'zones_per_second': round(count / seconds, 1)
+            }))
+    finally:
+        set_setting('output_directory', output_directory)
+    return runs
+
+
+@benchmark('merge_geometries', requires_qgis=True)
+def bench_merge_geometries(context):
+    from qgis.core import QgsGeometry
+    from geosys.utilities.gui_utilities import merge_geometries
+
+    runs = []
+    for count in context.parameters['polygons']:
+        # A farm of adjacent fields with digitized, 32 vertex boundaries.
+        columns = int(count ** 0.5) + 1
+        polygons = []
+        for index in range(count):
+            x = -86.87 + (index % columns) * 0.001
+            y = 41.33 + (index // columns) * 0.001
+            side = [(x + 0.001 * step / 8, y) for step in range(8)]
+            side += [(x + 0.001, y + 0.001 * step / 8) for step in range(8)]
+            side += [
+                (x + 0.001 - 0.001 * step / 8, y + 0.001)
+                for step in range(8)]
+            side += [(x, y + 0.001 - 0.001 * step / 8) for step in range(8)]
+            polygons.append(QgsGeometry.fromWkt('POLYGON(({}))'.format(
+                ', '.join('{} {}'.format(*point) for point in (
+                    side + side[:1])))))
+
+        seconds = best_of(
+            context.parameters['repeat'],
+            lambda: merge_geometries(polygons))
+        metrics = {
+            'seconds': round(seconds, 4),
+            'polygons_per_second': round(count / seconds, 1)
+        }
+        if count <= PAIRWISE_MAX_POLYGONS:
+            def combine():
+                merged = polygons[0]
+                for polygon in polygons[1:]:
+                    merged = merged.combine(polygon)
+
+            metrics['pairwise_seconds'] = round(best_of(1, combine), 4)
+        runs.append(({'polygons': count}, metrics))
+    return runs
+
+
+def git_revision():
+    """Revision of the working tree, None outside a git checkout.
+
+    :rtype: str
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def qgis_version():
+    """Start a QGIS application for the benchmarks needing it.
+
+    :return: QGIS version, None when QGIS is not available.
+    :rtype: str
+    """
+    from geosys.test.utilities import get_qgis_app
+    if get_qgis_app()[0] is None:
+        return None
+    from qgis.core import Qgis
+    return Qgis.QGIS_VERSION
+
+
+def run(output_path, quick=False, latency=0.0, only=None):
+    """Run the benchmarks and write their results.
+
+    :param output_path: Path of the JSON results file.
+    :type output_path: str
+
+    :param quick: Use smaller benchmark parameters.
+    :type quick: bool
+
+    :param latency: Seconds added by the fake server to every request.
+    :type latency: float
+
+    :param only: Names of the benchmarks to run, None runs all of them.
+    :type only: list
+
+    :return: The results.
+    :rtype: dict
+    """
+    version = qgis_version()
+    report = OrderedDict([
+        ('meta', OrderedDict([
+            ('timestamp', datetime.now(timezone.utc).isoformat()),
+            ('revision', git_revision()),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('qgis', version),
+            ('quick', quick),
+            ('latency', latency)
+        ])),
+        ('results', []),
+        ('skipped', [])
+    ])
+
+    work_directory = tempfile.mkdtemp(prefix='geosys-benchmark-')
+    cache_directory = COVERAGE_CACHE.directory
+    COVERAGE_CACHE.configure(
+        directory=os.path.join(work_directory, 'cache'))
+    parameters = PARAMETERS['quick' if quick else 'full']
+    try:
+        with FakeBridgeServer(work_directory, latency=latency) as server:
+            context = BenchmarkContext(
+                server, work_directory, parameters, latency)
+            for name, function, requires_qgis in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                if requires_qgis and version is None:
+                    report['skipped'].append(OrderedDict([
+                        ('name', name),
+                        ('reason', 'QGIS is not available.')
+                    ]))
+                    print('{}: skipped, QGIS is not available'.format(name))
+                    continue
+                for params, metrics in function(context):
+                    report['results'].append(OrderedDict([
+                        ('name', name),
+                        ('params', params),
+                        ('metrics', metrics)
+                    ]))
+                    print('{} {}: {}'.format(
+                        name, json.dumps(params), json.dumps(metrics)))
+    finally:
+        close_sessions()
+        COVERAGE_CACHE.configure(directory=cache_directory)
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    with open(output_path, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--output', default='benchmark_results.json',
+        help='Path of the JSON results file.')
+    parser.add_argument(
+        '--quick', action='store_true',
+        help='Use smaller parameters, e.g. for a smoke test.')
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds added by the fake server to every request.')
+    parser.add_argument(
+        '--only', nargs='+', metavar='NAME',
+        choices=[name for name, _, _ in BENCHMARKS],
+        help='Benchmarks to run, all of them by default.')
+    arguments = parser.parse_args(argv)
+    run(arguments.output, arguments.quick, arguments.latency, arguments.only)
+    print('Results written to {}'.format(arguments.output))
+
+
+if __name__ == '__main__':
+    main()
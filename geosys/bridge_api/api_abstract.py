@@ -2,14 +2,132 @@
 """Abstract class implementation of Bridge API Interface.
 """
 import os
+import threading
+import time
+from urllib.parse import urlsplit
 
-from requests import get, post
+import requests
+from requests.adapters import HTTPAdapter
+
+from geosys.bridge_api.default import (
+    HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE)
+from geosys.bridge_api.metrics import METRICS
+from geosys.bridge_api.retry import IDEMPOTENT_METHODS, RETRY_POLICY
+from geosys.bridge_api.transport import current_transport
 
 __copyright__ = "Copyright 2019, Kartoza"
 __license__ = "GPL version 3"
 __email__ = "rohmat@kartoza.com"
 __revision__ = "$Format:%H$"
 
+# Keep-alive sessions shared by every API client, keyed by scheme and host.
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _host_of(url):
+    """Scheme and network location of an url, e.g. https://api.host:443.
+
+    :param url: An url.
+    :type url: str
+
+    :return: Host key of the url.
+    :rtype: str
+    """
+    parts = urlsplit(url)
+    return '{}://{}'.format(parts.scheme, parts.netloc)
+
+
+def session_for_url(url):
+    """Get the shared keep-alive session of the host of an url.
+
+    Sessions keep their TCP/TLS connections open in a connection pool so
+    consecutive requests to the same host do not have to handshake again.
+
+    :param url: Request url.
+    :type url: str
+
+    :return: Shared session for the url host.
+    :rtype: requests.Session
+    """
+    host = _host_of(url)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSIONS[host] = session
+    return session
+
+
+def connection_pool_stats():
+    """Connection reuse counters of the shared sessions.
+
+    :return: Counters per host. example: {
+            "https://api.geosys-na.net": {
+                "requests": 52,
+                "new_connections": 4,
+                "reused_connections": 48
+            }
+        }
+    :rtype: dict
+    """
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.items())
+
+    stats = {}
+    for host, session in sessions:
+        num_requests = 0
+        num_connections = 0
+        for adapter in set(session.adapters.values()):
+            managers = [adapter.poolmanager] + list(
+                adapter.proxy_manager.values())
+            for manager in managers:
+                for pool_key in list(manager.pools.keys()):
+                    pool = manager.pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    num_requests += pool.num_requests
+                    num_connections += pool.num_connections
+        stats[host] = {
+            'requests': num_requests,
+            'new_connections': num_connections,
+            'reused_connections': max(num_requests - num_connections, 0)
+        }
+    return stats
+
+
+def _body_size(body):
+    """Size of a request body in bytes.
+
+    :param body: Prepared request body.
+    :type body: str, bytes
+
+    :rtype: int
+    """
+    if not body:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    try:
+        return len(body)
+    except TypeError:
+        # Streamed body of unknown size.
+        return 0
+
+
+def close_sessions():
+    """Close the shared sessions and their pooled connections."""
+    with _SESSIONS_LOCK:
+        sessions = list(_SESSIONS.values())
+        _SESSIONS.clear()
+    for session in sessions:
+        session.close()
+
 
 class ApiClient(object):
     """Abstract class for API Client."""
@@ -31,6 +149,9 @@ class ApiClient(object):
             'authorization': 'Bearer %s' % self.access_token
         }
         self.proxy = {}
+        self.retry_policy = RETRY_POLICY
+        # None uses the process-wide transport, see current_transport.
+        self.transport = None
 
     def set_proxy(self, proxy_host, proxy_port, proxy_user, proxy_password):
         """Set proxy server.
@@ -84,12 +205,72 @@ class ApiClient(object):
             full_url = os.path.join(full_url, item)
         return full_url
 
-    def get(self, url, **kwargs):
+    def request(
+            self, method, url, idempotent=None, retry_policy=None,
+            **kwargs):
+        """Send a request to the API, retrying it on transient failures.
+
+        :param method: HTTP method.
+        :type method: str
+
+        :param url: API url.
+        :type url: str
+
+        :param idempotent: Whether the request can be sent more than once.
+            Defaults to True for GET and other idempotent methods.
+        :type idempotent: bool
+
+        :param retry_policy: Retry policy of this call, defaults to the
+            policy of the client.
+        :type retry_policy: RetryPolicy
+
+        :param kwargs: requests.request parameters
+        :type kwargs: dict
+
+        :return: The API response.
+        :rtype: response object
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_policy = retry_policy or self.retry_policy
+        transport = self.transport or current_transport()
+        session = session_for_url(url)
+        attempts = []
+
+        def send():
+            # Every attempt is recorded in the request metrics.
+            attempts.append(True)
+            started = time.monotonic()
+            try:
+                response = transport.send(
+                    session, method, url, proxies=self.proxy, **kwargs)
+            except requests.RequestException:
+                METRICS.record(
+                    method, url, None, time.monotonic() - started,
+                    retry=len(attempts) > 1)
+                raise
+            METRICS.record(
+                method, url, response.status_code,
+                time.monotonic() - started,
+                bytes_in=len(response.content),
+                bytes_out=_body_size(response.request.body),
+                retry=len(attempts) > 1)
+            return response
+
+        return retry_policy.call(send, idempotent=idempotent)
+
+    def get(self, url, idempotent=True, retry_policy=None, **kwargs):
         """Fetch JSON response from get request to the API.
 
         :param url: API url.
         :type url: str
 
+        :param idempotent: Whether the request can be sent more than once.
+        :type idempotent: bool
+
+        :param retry_policy: Retry policy of this call.
+        :type retry_policy: RetryPolicy
+
         :param kwargs: requests.get parameters
         :type kwargs: dict
 
@@ -99,15 +280,24 @@ class ApiClient(object):
         if kwargs.get('headers'):
             kwargs['headers'].update(self.headers)
 
-        response = get(url, proxies=self.proxy, **kwargs)
+        response = self.request(
+            'GET', url, idempotent=idempotent, retry_policy=retry_policy,
+            **kwargs)
         return response
 
-    def post(self, url, **kwargs):
+    def post(self, url, idempotent=False, retry_policy=None, **kwargs):
         """Fetch JSON response from post request to the API.
 
         :param url: API url.
         :type url: str
 
+        :param idempotent: Whether the request can be sent more than once,
+            e.g. a search. POST requests are not by default.
+        :type idempotent: bool
+
+        :param retry_policy: Retry policy of this call.
+        :type retry_policy: RetryPolicy
+
         :param kwargs: requests.post parameters
         :type kwargs: dict
 
@@ -117,7 +307,9 @@ class ApiClient(object):
         if kwargs.get('headers'):
             kwargs['headers'].update(self.headers)
 
-        response = post(url, proxies=self.proxy, **kwargs)
+        response = self.request(
+            'POST', url, idempotent=idempotent, retry_policy=retry_policy,
+            **kwargs)
         return response
 
     def get_content(self, url, params=None):
@@ -132,7 +324,6 @@ class ApiClient(object):
         :return: Response content.
         :rtype: bytes
         """
-        response = get(
-            url, headers=self.headers, params=params, proxies=self.proxy,
-            stream=True)
+        response = self.request(
+            'GET', url, headers=self.headers, params=params)
         return response.content
@@ -0,0 +1,268 @@
+# coding=utf-8
+"""On-disk cache of Bridge API responses.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from geosys.bridge_api.default import (
+    DEFAULT_COVERAGE_CACHE_TTL, DEFAULT_COVERAGE_CACHE_SIZE)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+
+def request_key(*parts):
+    """Canonical hash of a request.
+
+    Dictionaries are serialized with sorted keys, so two requests built
+    with their keys in a different order share the same key.
+
+    :param parts: JSON serializable parts of the request, e.g. the url,
+        the request body and the query parameters.
+
+    :return: Hex digest of the request.
+    :rtype: str
+    """
+    canonical = json.dumps(
+        parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class DiskCache(object):
+    """Directory of JSON responses with a TTL and a size bound.
+
+    Each entry is a file named after its key. Reading an entry touches the
+    file, so when the cache grows over its size bound the least recently
+    used entries (oldest modification time) are evicted first.
+    """
+
+    extension = '.json'
+
+    def __init__(
+            self,
+            directory=None,
+            ttl=DEFAULT_COVERAGE_CACHE_TTL,
+            max_size=DEFAULT_COVERAGE_CACHE_SIZE):
+        """Directory of JSON responses with a TTL and a size bound.
+
+        :param directory: Cache directory, created on first write.
+        :type directory: str
+
+        :param ttl: Seconds an entry stays valid. Zero or less disables the
+            cache, None keeps entries until they are evicted.
+        :type ttl: int
+
+        :param max_size: Maximum total size of the entries in bytes.
+        :type max_size: int
+        """
+        self.directory = directory or os.path.join(
+            tempfile.gettempdir(), 'geosys', 'cache')
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """Whether entries are read and stored.
+
+        :rtype: bool
+        """
+        return bool(self.directory) and (self.ttl is None or self.ttl > 0)
+
+    def configure(self, directory=None, ttl=None, max_size=None):
+        """Update the cache location and limits.
+
+        :param directory: Cache directory.
+        :type directory: str
+
+        :param ttl: Seconds an entry stays valid.
+        :type ttl: int
+
+        :param max_size: Maximum total size of the entries in bytes.
+        :type max_size: int
+        """
+        with self._lock:
+            if directory is not None:
+                self.directory = directory
+            if ttl is not None:
+                self.ttl = ttl
+            if max_size is not None:
+                self.max_size = max_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def _read(self, path):
+        """Read an entry file.
+
+        :return: The cached value, or None when expired.
+        :rtype: object
+        """
+        with open(path) as cache_file:
+            entry = json.load(cache_file)
+        if self.ttl is not None and time.time() - entry['created'] > self.ttl:
+            os.remove(path)
+            return None
+        return entry['value']
+
+    def _write(self, handle, value):
+        """Write an entry to an open file descriptor."""
+        with os.fdopen(handle, 'w') as cache_file:
+            json.dump({'created': time.time(), 'value': value}, cache_file)
+
+    def get(self, key):
+        """Get a cached value.
+
+        :param key: Cache key, see request_key.
+        :type key: str
+
+        :return: The cached value, or None when missing or expired.
+        :rtype: object
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            value = self._read(path)
+            if value is not None:
+                # Mark the entry as recently used.
+                os.utime(path, None)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return value
+
+    def contains(self, key):
+        """Whether a key has a stored entry, expired or not.
+
+        :param key: Cache key, see request_key.
+        :type key: str
+
+        :rtype: bool
+        """
+        return self.enabled and os.path.exists(self._path(key))
+
+    def set(self, key, value):
+        """Store a value.
+
+        :param key: Cache key, see request_key.
+        :type key: str
+
+        :param value: JSON serializable value.
+        :type value: object
+        """
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(
+                dir=self.directory, suffix='.tmp')
+            self._write(handle, value)
+            # Readers never see a partially written entry.
+            os.replace(temp_path, self._path(key))
+        except (OSError, TypeError, ValueError) as e:
+            LOGGER.debug('Could not write cache entry: %s' % e)
+            return
+        self.evict()
+
+    def invalidate(self, key):
+        """Remove a cached value.
+
+        :param key: Cache key, see request_key.
+        :type key: str
+        """
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _entries(self):
+        """List the (path, size, modification time) of every entry."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(self.extension):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def size(self):
+        """Total size of the entries in bytes.
+
+        :rtype: int
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove the least recently used entries over the size bound."""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_size:
+                return
+            for path, size, _ in sorted(entries, key=lambda e: e[2]):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_size:
+                    break
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            for path, _, _ in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+class BlobCache(DiskCache):
+    """Directory of binary entries bounded by size only.
+
+    Meant for content fully determined by its key, e.g. thumbnails keyed by
+    their url, so entries do not expire and are only evicted when the cache
+    grows over its size bound.
+    """
+
+    extension = '.bin'
+
+    def __init__(self, directory=None, max_size=DEFAULT_COVERAGE_CACHE_SIZE):
+        """Directory of binary entries bounded by size only.
+
+        :param directory: Cache directory, created on first write.
+        :type directory: str
+
+        :param max_size: Maximum total size of the entries in bytes.
+        :type max_size: int
+        """
+        super(BlobCache, self).__init__(directory, None, max_size)
+
+    def _read(self, path):
+        with open(path, 'rb') as cache_file:
+            return cache_file.read()
+
+    def _write(self, handle, value):
+        with os.fdopen(handle, 'wb') as cache_file:
+            cache_file.write(value)
+
+
+COVERAGE_CACHE = DiskCache()
@@ -0,0 +1,56 @@
+# coding=utf-8
+"""Shared worker pools for concurrent Bridge API requests.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+# (pool name, number of workers) -> executor.
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def shared_executor(name, max_workers):
+    """Get a process-wide worker pool, creating it on first use.
+
+    Pools are kept alive between searches so their worker threads (and the
+    keep-alive connections they use) are reused. Each number of workers
+    has its own pool, so callers asking for different sizes, e.g. a dock
+    search and a processing run, or a search started after the setting
+    changed, never resize or shut down a pool another caller is using.
+
+    :param name: Name of the pool, e.g. 'coverage' or 'thumbnail'.
+    :type name: str
+
+    :param max_workers: Maximum number of concurrent workers.
+    :type max_workers: int
+
+    :return: The worker pool.
+    :rtype: ThreadPoolExecutor
+    """
+    key = (name, max(int(max_workers), 1))
+    with _EXECUTORS_LOCK:
+        executor = _EXECUTORS.get(key)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=key[1],
+                thread_name_prefix='geosys-{}-{}'.format(*key))
+            _EXECUTORS[key] = executor
+    return executor
+
+
+def shutdown_executors(wait=False):
+    """Shut down every shared worker pool.
+
+    :param wait: Whether to wait for running jobs to finish.
+    :type wait: bool
+    """
+    with _EXECUTORS_LOCK:
+        executors = list(_EXECUTORS.values())
+        _EXECUTORS.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
@@ -2,7 +2,8 @@
 """Implementation of Bridge API connection.
 """
 from geosys.bridge_api.api_abstract import ApiClient
-from geosys.bridge_api.default import IDENTITY_URLS, GRANT_TYPE, SCOPE
+from geosys.bridge_api.default import (
+    IDENTITY_URLS, GRANT_TYPE, REFRESH_GRANT_TYPE, SCOPE)
 
 __copyright__ = "Copyright 2019, Kartoza"
 __license__ = "GPL version 3"
@@ -69,3 +70,40 @@ class ConnectionAPIClient(ApiClient):
             headers=headers, data=data, timeout=10)
 
         return response.json()
+
+    def refresh_access_token(self, refresh_token, client_id, client_secret):
+        """Exchange a refresh token for a new access token.
+
+        The refresh token is issued by the identity server along with the
+        access token because the requested scope contains offline_access.
+
+        :param refresh_token: Refresh token from a previous token response.
+        :type refresh_token: str
+
+        :param client_id: Client ID
+        :type client_id: str
+
+        :param client_secret: Client Secret
+        :type client_secret: str
+
+        :return: JSON response
+        :rtype: dict
+        """
+        data = {
+            'refresh_token': refresh_token,
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'grant_type': REFRESH_GRANT_TYPE
+        }
+
+        headers = {
+            'content-type': 'application/x-www-form-urlencoded'
+        }
+
+        url = '{}{}/{}'.format(self.base_url, 'connect', 'token')
+
+        response = self.post(
+            url,
+            headers=headers, data=data, timeout=10)
+
+        return response.json()
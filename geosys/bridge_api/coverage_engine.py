@@ -0,0 +1,228 @@
+# coding=utf-8
+"""Batched and paginated coverage search over many geometries.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from urllib.parse import urlsplit
+
+from geosys.bridge_api.concurrency import shared_executor
+from geosys.bridge_api.default import (
+    MAP_LIMIT,
+    MAP_OFFSET,
+    DEFAULT_COVERAGE_PAGE_SIZE,
+    DEFAULT_COVERAGE_WORKERS,
+    DEFAULT_COVERAGE_REQUESTS_PER_SECOND)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+class CoverageSearchError(Exception):
+    """Error returned by the coverage API for a single geometry."""
+
+
+class RateLimiter(object):
+    """Token bucket limiting how many requests are sent per second."""
+
+    def __init__(self, requests_per_second, burst=None):
+        """Token bucket limiting how many requests are sent per second.
+
+        :param requests_per_second: Sustained request rate. Zero or less
+            disables the limit.
+        :type requests_per_second: float
+
+        :param burst: Number of requests which can be sent at once.
+            Defaults to one second worth of requests.
+        :type burst: int
+        """
+        self.rate = float(requests_per_second)
+        self.capacity = float(burst or max(self.rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def rate_limiter_for(
+        url, requests_per_second=DEFAULT_COVERAGE_REQUESTS_PER_SECOND):
+    """Get the process-wide rate limiter of the host of an url.
+
+    The limiter is shared by every search against the same server, so the
+    request budget holds regardless of how many searches run at once.
+
+    :param url: Server url.
+    :type url: str
+
+    :param requests_per_second: Sustained request rate.
+    :type requests_per_second: float
+
+    :return: Rate limiter of the host.
+    :rtype: RateLimiter
+    """
+    host = urlsplit(url).netloc
+    with _RATE_LIMITERS_LOCK:
+        limiter = _RATE_LIMITERS.get(host)
+        if limiter is None or limiter.rate != float(requests_per_second):
+            limiter = RateLimiter(requests_per_second)
+            _RATE_LIMITERS[host] = limiter
+    return limiter
+
+
+class CoverageEngine(object):
+    """Coverage search for an arbitrary number of geometries.
+
+    Geometries are searched concurrently in a sliding window, so only a
+    bounded number of requests is in flight at any time. Results of each
+    geometry are paged through with $limit/$offset and yielded in the
+    order of the geometries as soon as they are complete.
+    """
+
+    def __init__(
+            self,
+            search,
+            page_size=DEFAULT_COVERAGE_PAGE_SIZE,
+            max_workers=DEFAULT_COVERAGE_WORKERS,
+            rate_limiter=None,
+            executor=None):
+        """Coverage search for an arbitrary number of geometries.
+
+        :param search: Callable doing a single coverage request, called as
+            search(geometry, filters).
+        :type search: callable
+
+        :param page_size: Number of results requested per page.
+        :type page_size: int
+
+        :param max_workers: Number of concurrent geometry searches.
+        :type max_workers: int
+
+        :param rate_limiter: Limiter applied before each request.
+        :type rate_limiter: RateLimiter
+
+        :param executor: Worker pool running the searches. Defaults to the
+            process-wide coverage pool of max_workers workers.
+        :type executor: concurrent.futures.Executor
+        """
+        self.search = search
+        self.page_size = max(int(page_size), 1)
+        self.max_workers = max(int(max_workers), 1)
+        self.rate_limiter = rate_limiter
+        self.executor = executor
+
+    def search_geometry(self, geometry, filters=None):
+        """Get every coverage result of a single geometry.
+
+        When filters already contain a $limit, that single page is returned
+        as is.
+
+        :param geometry: A geometry in WKT format.
+        :type geometry: str
+
+        :param filters: Filter coverage results.
+        :type filters: dict
+
+        :return: Coverage results.
+        :rtype: list
+
+        :raises: CoverageSearchError - when the API returns an error.
+        """
+        filters = dict(filters) if filters else {}
+        paginate = MAP_LIMIT not in filters
+        results = []
+        offset = 0
+        while True:
+            page_filters = dict(filters)
+            if paginate:
+                page_filters.update({
+                    MAP_LIMIT: self.page_size,
+                    MAP_OFFSET: offset
+                })
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            page = self.search(geometry, page_filters)
+
+            if isinstance(page, dict):
+                raise CoverageSearchError(
+                    page.get('message') or 'Unexpected coverage response.')
+            results.extend(page)
+            if not paginate or len(page) < self.page_size:
+                return results
+            offset += len(page)
+
+    def iter_results(self, geometries, filters=None, should_stop=None):
+        """Search the coverage of every geometry.
+
+        :param geometries: Geometries in WKT format.
+        :type geometries: list
+
+        :param filters: Filter coverage results.
+        :type filters: dict
+
+        :param should_stop: Callable returning True when the search should
+            be abandoned. Requests which have not started yet are cancelled.
+        :type should_stop: callable
+
+        :return: Generator of (geometry index, results, error) tuples in
+            the order of the geometries. Either results or error is None.
+        :rtype: generator
+        """
+        should_stop = should_stop or (lambda: False)
+        executor = self.executor or shared_executor(
+            'coverage', self.max_workers)
+        geometries = iter(enumerate(geometries))
+        window = deque()
+
+        def fill_window():
+            while len(window) < self.max_workers * 2:
+                try:
+                    index, geometry = next(geometries)
+                except StopIteration:
+                    return
+                window.append((index, executor.submit(
+                    self.search_geometry, geometry, filters)))
+
+        try:
+            fill_window()
+            while window:
+                index, future = window.popleft()
+                while True:
+                    if should_stop():
+                        return
+                    try:
+                        results = future.result(timeout=0.5)
+                        error = None
+                        break
+                    except FutureTimeoutError:
+                        continue
+                    except Exception as e:
+                        results = None
+                        error = e
+                        break
+                fill_window()
+                yield index, results, error
+        finally:
+            for _, future in window:
+                future.cancel()
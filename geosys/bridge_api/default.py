@@ -43,11 +43,61 @@ BRIDGE_URLS = {
     }
 }
 
+# Keep-alive connection pool of the shared HTTP sessions.
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+
 CLIENT_ID = 'mapproduct_api'
 CLIENT_SECRET = 'mapproduct_api.secret'
 GRANT_TYPE = 'password'
+REFRESH_GRANT_TYPE = 'refresh_token'
 SCOPE = 'openid offline_access'
-MAX_FEATURE_NUMBERS = 10
+# Access tokens are refreshed this many seconds before they expire.
+TOKEN_REFRESH_MARGIN = 300
+# Minimum seconds between two background refreshes of an access token.
+TOKEN_MIN_REFRESH_DELAY = 30
+# Token lifetime (seconds) assumed when the identity server omits expires_in.
+DEFAULT_TOKEN_LIFETIME = 3600
+# Maximum number of features sent in a coverage search, None for no limit.
+MAX_FEATURE_NUMBERS = None
+# Number of coverage thumbnails downloaded concurrently.
+DEFAULT_THUMBNAIL_WORKERS = 8
+# Number of geometries searched concurrently for coverage.
+DEFAULT_COVERAGE_WORKERS = 10
+# Number of coverage results requested per page.
+DEFAULT_COVERAGE_PAGE_SIZE = 100
+# Coverage requests sent per second to a Bridge server, 0 for no limit.
+DEFAULT_COVERAGE_REQUESTS_PER_SECOND = 10
+# Seconds a cached coverage response stays valid, 0 disables the cache.
+DEFAULT_COVERAGE_CACHE_TTL = 6 * 60 * 60
+# Maximum size of the coverage response cache in bytes.
+DEFAULT_COVERAGE_CACHE_SIZE = 50 * 1024 * 1024
+# Maximum size of the thumbnail store on disk in bytes.
+DEFAULT_THUMBNAIL_CACHE_SIZE = 100 * 1024 * 1024
+# Number of decoded thumbnails kept in memory.
+DEFAULT_THUMBNAIL_MEMORY_ITEMS = 200
+# Number of maps created concurrently.
+DEFAULT_MAP_CREATION_JOBS = 4
+# Number of times a failed map creation is retried.
+DEFAULT_MAP_CREATION_RETRIES = 1
+# Whether the dock is opened when QGIS starts, it remembers the last state.
+# Off by default so the dock is only loaded on first use.
+DEFAULT_SHOW_DOCK = False
+# Number of times a failed request is retried.
+DEFAULT_RETRY_ATTEMPTS = 3
+# Seconds of the first retry backoff, doubled after each retry.
+DEFAULT_RETRY_BASE_DELAY = 0.5
+# Maximum seconds of a single retry backoff.
+DEFAULT_RETRY_MAX_DELAY = 30
+# Maximum seconds a single call may spend, retries included.
+DEFAULT_RETRY_BUDGET = 120
+# Decimals of the coordinates sent in a coverage search, about 0.1 m in
+# degrees. A negative value sends geometries at full precision.
+DEFAULT_PAYLOAD_PRECISION = 6
+# Simplification tolerance of coverage geometries, about 1 m in degrees.
+DEFAULT_PAYLOAD_TOLERANCE = 0.00001
+# Maximum relative area change allowed by the payload simplification.
+DEFAULT_PAYLOAD_MAX_AREA_CHANGE = 0.01
 DEFAULT_N_PLANNED = 0.01
 
 # Default parameters for map creation
@@ -93,6 +143,7 @@ IMAGE_SOIL_MATERIAL = 'Image.SoilMaterial'
 IMAGE_WEATHER = 'Image.Weather'
 MAPS_TYPE = 'Maps.Type'
 MAP_LIMIT = '$limit'
+MAP_OFFSET = '$offset'
 
 # map creation parameters
 YIELD_AVERAGE = 'HistoricalYieldAverage'
@@ -118,6 +169,9 @@ TIFF_EXT = '.tif'
 SHP_EXT = '.shp'
 KMZ_EXT = '.kmz'
 LEGEND_EXT = '.legend.png'
+ZIP_EXT = '.zip'
+VRT_EXT = '.vrt'
+CSV_EXT = '.csv'
 
 # API key
 PNG_KMZ_KEY = 'image:application/vnd.google-earth.kmz+png'
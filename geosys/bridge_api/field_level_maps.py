@@ -2,21 +2,15 @@
 """Implementation of Bridge API field-level-maps endpoint.
 """
 from geosys.bridge_api.api_abstract import ApiClient
+from geosys.bridge_api.cache import COVERAGE_CACHE, request_key
 from geosys.bridge_api.default import BRIDGE_URLS
 from geosys.bridge_api.definitions import (
     COLOR_COMPOSITION,
-    REFLECTANCE,
     SOIL,
-    INSEASONFIELD_AVERAGE_NDVI,
-    INSEASONFIELD_AVERAGE_LAI,
-    INSEASONFIELD_AVERAGE_REVERSE_NDVI,
-    INSEASONFIELD_AVERAGE_REVERSE_LAI,
-    INSEASON_S2REP,
     SAMZ,
-    YVM,
-    YGM,
     SAMPLE_MAP
 )
+from geosys.bridge_api.registry import COVERAGE_MAP_PATHS, MAP_ENDPOINT_NAMES
 from geosys.bridge_api.utilities import get_definition
 
 __copyright__ = "Copyright 2019, Kartoza"
@@ -33,7 +27,9 @@ class FieldLevelMapsAPIClient(ApiClient):
     """
     VERSION = 4
 
-    def __init__(self, access_token, endpoint_url=BRIDGE_URLS['na']['prod']):
+    def __init__(
+            self, access_token, endpoint_url=BRIDGE_URLS['na']['prod'],
+            identity=None):
         """Implementation of field-level-maps API client.
 
         This API call requires access_token from identity server.
@@ -43,9 +39,15 @@ class FieldLevelMapsAPIClient(ApiClient):
 
         :param endpoint_url: The API base url.
         :type endpoint_url: str
+
+        :param identity: Account the token belongs to, e.g. a digest of the
+            username and client id. Cached responses are only served to
+            the same account.
+        :type identity: str
         """
         super(FieldLevelMapsAPIClient, self).__init__(
                 access_token, endpoint_url)
+        self.identity = identity
 
     @property
     def base_url(self):
@@ -56,7 +58,47 @@ class FieldLevelMapsAPIClient(ApiClient):
         """
         return '%s/field-level-maps/v%s/' % (self.endpoint_url, self.VERSION)
 
-    def get_coverage(self, data, filters=None):
+    def _cached_post(self, endpoint, data, filters, force_refresh=False):
+        """Post a search request, serving it from the response cache.
+
+        Only successful (list) responses are cached.
+
+        :param endpoint: Endpoint relative to the base url.
+        :type endpoint: str
+
+        :param data: Request body.
+        :type data: dict
+
+        :param filters: Query parameters.
+        :type filters: dict
+
+        :param force_refresh: Skip the cached response, if any.
+        :type force_refresh: bool
+
+        :return: JSON response.
+        :rtype: list, dict
+        """
+        url = self.full_url(endpoint)
+        # Results depend on the account, e.g. its season fields.
+        key = request_key(self.identity, url, data, filters)
+        if not force_refresh:
+            cached = COVERAGE_CACHE.get(key)
+            if cached is not None:
+                return cached
+
+        headers = {
+            'accept': 'application/json',
+            'content-type': 'application/json'
+        }
+        # Searches do not change anything, they are safe to send again.
+        response = self.post(
+            url, idempotent=True, headers=headers, params=filters, json=data)
+        response_json = response.json()
+        if isinstance(response_json, list):
+            COVERAGE_CACHE.set(key, response_json)
+        return response_json
+
+    def get_coverage(self, data, filters=None, force_refresh=False):
         """Get coverage based on given parameters.
 
         :param data: Data passed to the API to get specific coverage.
@@ -81,25 +123,17 @@ class FieldLevelMapsAPIClient(ApiClient):
             }
         :type filters: dict
 
+        :param force_refresh: Skip the cached response, if any.
+        :type force_refresh: bool
+
         :return: JSON response.
             List of maps data specification based on given criteria.
         :rtype: list
         """
         filters = filters if filters else {}
-        headers = {
-            'accept': 'application/json',
-            'content-type': 'application/json'
-        }
-
-        response = self.post(
-            self.full_url('coverage'),
-            headers=headers,
-            params=filters,
-            json=data)
+        return self._cached_post('coverage', data, filters, force_refresh)
 
-        return response.json()
-
-    def get_catalog_imagery(self, data, filters=None):
+    def get_catalog_imagery(self, data, filters=None, force_refresh=False):
         """Get catalog-imagery based on given parameters.
 
         :param data: Data passed to the API to get specific coverage.
@@ -124,24 +158,16 @@ class FieldLevelMapsAPIClient(ApiClient):
             }
         :type filters: dict
 
+        :param force_refresh: Skip the cached response, if any.
+        :type force_refresh: bool
+
         :return: JSON response.
             List of maps data specification based on given criteria.
         :rtype: list
         """
-
         filters = filters if filters else {}
-        headers = {
-            'accept': 'application/json',
-            'content-type': 'application/json'
-        }
-
-        response = self.post(
-            self.full_url('catalog-imagery'),
-            headers=headers,
-            params=filters,
-            json=data)
-
-        return response.json()
+        return self._cached_post(
+            'catalog-imagery', data, filters, force_refresh)
 
     def get_field_map(
             self,
@@ -200,12 +226,6 @@ class FieldLevelMapsAPIClient(ApiClient):
                 'mapType': COLOR_COMPOSITION['name']
             })
             map_family = map_type['map_family']
-            nitrogen_maps = [
-                INSEASONFIELD_AVERAGE_NDVI['key'],
-                INSEASONFIELD_AVERAGE_LAI['key'],
-                INSEASONFIELD_AVERAGE_REVERSE_NDVI['key'],
-                INSEASONFIELD_AVERAGE_REVERSE_LAI['key']
-            ]
 
             if data:
                 image_id = data['Image']['Id'] if data.get('Image', None) else None
@@ -214,25 +234,10 @@ class FieldLevelMapsAPIClient(ApiClient):
                 image_id = None
                 seasonfield_id = None
 
-            if (map_type['key'] == REFLECTANCE['key'] or
-                    map_type['key'] == INSEASON_S2REP['key']):
-                # Reflectance and S2REP maps needs to make use of the catalog-imagery API
-                full_url = self.full_url(
-                    'season-fields',
-                    seasonfield_id,
-                    'coverage',
-                    image_id,
-                    map_family['endpoint'],
-                    map_type['key']
-                )
-
-                response = self.get(
-                    full_url,
-                    headers=headers,
-                    params=params,
-                    json=data
-                )
-            elif map_type['key'] in nitrogen_maps:
+            path = COVERAGE_MAP_PATHS.get(map_type['key'])
+            if path is not None:
+                # These maps are created from the coverage result, e.g.
+                # reflectance, S2REP, nitrogen and yield maps.
                 full_url = self.full_url(
                     'season-fields',
                     seasonfield_id,
@@ -240,8 +245,11 @@ class FieldLevelMapsAPIClient(ApiClient):
                     image_id,
                     map_family['endpoint'],
                     map_type['key'],
-                    'n-planned',
-                    str(n_planned)
+                    *[part.format(
+                        n_planned=n_planned,
+                        yield_val=yield_val,
+                        max_yield_val=max_yield_val,
+                        min_yield_val=min_yield_val) for part in path]
                 )
 
                 response = self.get(
@@ -250,59 +258,17 @@ class FieldLevelMapsAPIClient(ApiClient):
                     params=params,
                     json=data
                 )
-            elif map_type['key'] == YVM['key']:
-                full_url = self.full_url(
-                    'season-fields',
-                    seasonfield_id,
-                    'coverage',
-                    image_id,
-                    map_family['endpoint'],
-                    map_type['key'],
-                    'historical-yield-average',
-                    str(yield_val)
-                )
+                return response.json()
 
-                response = self.get(
-                    full_url,
-                    headers=headers,
-                    params=params,
-                    json=data
-                )
-            elif map_type['key'] == YGM['key']:
-                full_url = self.full_url(
-                    'season-fields',
-                    seasonfield_id,
-                    'coverage',
-                    image_id,
-                    map_family['endpoint'],
-                    map_type['key'],
-                    'historical-yield-average',
-                    str(yield_val),
-                    'max-yield-Goal',
-                    str(max_yield_val),
-                    'min-yield-Goal',
-                    str(min_yield_val)
-                )
-
-                response = self.get(
-                    full_url,
-                    headers=headers,
-                    params=params,
-                    json=data
-                )
-            elif map_type['key'] == SAMZ['key']:
-                full_url = self.full_url(
-                    'maps',
-                    'management-zones-map',
-                    'SAMZ'
-                )
+            if (map_type['key'] == SAMPLE_MAP['key']
+                    and sample_field_id is not None):
+                # This returns an empty json object
+                # This step is required to set up the headers for Sample map
+                # creation, which is required by the downloading step which follows
+                return {}
 
-                response = self.post(
-                    full_url,
-                    headers=headers,
-                    # params=params,
-                    json=data
-                )
+            if map_type['key'] == SAMZ['key']:
+                params = None
             elif map_type['key'] == SOIL['key']:
                 # Body required by soilmap
                 # This is a workaround provided by GeoSys
@@ -314,50 +280,17 @@ class FieldLevelMapsAPIClient(ApiClient):
                     }
                 }
 
-                full_url = self.full_url(
-                    'maps',
-                    map_family['endpoint'],
-                    map_type['key']
-                )
-                response = self.post(
-                    full_url,
-                    headers=headers,
-                    params=params,
-                    json=data
-                )
-            elif map_type['key'] == SAMPLE_MAP['key']:
-                if sample_field_id is None:
-                    full_url = self.full_url(
-                        'maps',
-                        map_family['endpoint'],
-                        map_type['key']
-                    )
-
-                    response = self.post(
-                        full_url,
-                        headers=headers,
-                        params=params,
-                        json=data
-                    )
-                else:
-                    # This returns an empty json object
-                    # This step is required to set up the headers for Sample map
-                    # creation, which is required by the downloading step which follows
-                    return {}
-            else:
-                full_url = self.full_url(
-                    'maps',
-                    map_family['endpoint'],
-                    map_type['name']
-                )
-
-                response = self.post(
-                     full_url,
-                     headers=headers,
-                     params=params,
-                     json=data
-                )
-
+            full_url = self.full_url(
+                'maps',
+                map_family['endpoint'],
+                MAP_ENDPOINT_NAMES.get(map_type['key'], map_type['name'])
+            )
+            response = self.post(
+                full_url,
+                headers=headers,
+                params=params,
+                json=data
+            )
             return response.json()
 
         return {}
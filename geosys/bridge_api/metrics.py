@@ -0,0 +1,253 @@
+# coding=utf-8
+"""In-process metrics of the requests sent by the plugin.
+"""
+import csv
+import json
+import re
+import threading
+from collections import Counter, OrderedDict
+from urllib.parse import urlsplit
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+ID_PLACEHOLDER = '{id}'
+# Path segments always followed by an id.
+ID_PARENTS = frozenset(['season-fields', 'coverage'])
+# Numbers and dates, e.g. 80, 0.5 or 2018-10-18.
+NUMBER_PATTERN = re.compile(r'^\d+([.:-]\d+)*$')
+# Hexadecimal ids and uuids.
+HEX_PATTERN = re.compile(r'^[0-9a-fA-F-]{16,}$')
+# Generated ids mixing lower case letters and digits.
+MIXED_ID_PATTERN = re.compile(r'^(?=.*\d)(?=.*[a-z])[A-Za-z0-9]{6,}$')
+# Latency samples kept per endpoint to compute percentiles.
+MAX_SAMPLES = 1000
+
+METRIC_FIELDS = [
+    'method', 'endpoint', 'requests', 'errors', 'retries', 'total_ms',
+    'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', 'bytes_in', 'bytes_out',
+    'statuses'
+]
+
+
+def endpoint_template(url):
+    """Endpoint of an url with its ids replaced by a placeholder.
+
+    Query parameters are dropped, so every request to the same endpoint
+    gets the same template.
+
+    :param url: Request url.
+    :type url: str
+
+    :return: Endpoint template, e.g.
+        https://api.geosys-na.net/field-level-maps/v4/season-fields/{id}
+    :rtype: str
+    """
+    parts = urlsplit(url)
+    segments = []
+    previous = None
+    for segment in parts.path.split('/'):
+        if segment and (
+                previous in ID_PARENTS
+                or NUMBER_PATTERN.match(segment)
+                or HEX_PATTERN.match(segment)
+                or MIXED_ID_PATTERN.match(segment)):
+            segments.append(ID_PLACEHOLDER)
+        else:
+            segments.append(segment)
+        previous = segment
+    netloc = parts.netloc.rsplit('@', 1)[-1]
+    if not netloc:
+        return '/'.join(segments)
+    return '{}://{}{}'.format(parts.scheme, netloc, '/'.join(segments))
+
+
+def _percentile(values, percent):
+    """Percentile of sorted values, nearest rank.
+
+    :param values: Sorted values.
+    :type values: list
+
+    :param percent: Percentile between 0 and 100.
+    :type percent: float
+
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    rank = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+class EndpointMetrics(object):
+    """Counters of the requests sent to one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.statuses = Counter()
+        self.samples = []
+
+    def add(self, status, latency, bytes_in, bytes_out, retry):
+        self.requests += 1
+        if status is None or status >= 400:
+            self.errors += 1
+        if retry:
+            self.retries += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.statuses[status or 'error'] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(latency)
+        else:
+            # Keep the most recent samples.
+            self.samples[self.requests % MAX_SAMPLES] = latency
+
+
+class MetricsRegistry(object):
+    """Thread-safe registry of request metrics, grouped by endpoint."""
+
+    def __init__(self, enabled=True):
+        """Metrics registry.
+
+        :param enabled: Whether requests are recorded.
+        :type enabled: bool
+        """
+        self.enabled = enabled
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(
+            self, method, url, status, latency, bytes_in=0, bytes_out=0,
+            retry=False):
+        """Record a request.
+
+        :param method: HTTP method.
+        :type method: str
+
+        :param url: Request url, ids are stripped from it.
+        :type url: str
+
+        :param status: HTTP status code, None when no response was received.
+        :type status: int
+
+        :param latency: Seconds between sending the request and receiving
+            the whole response.
+        :type latency: float
+
+        :param bytes_in: Size of the response body.
+        :type bytes_in: int
+
+        :param bytes_out: Size of the request body.
+        :type bytes_out: int
+
+        :param retry: Whether the request is a retry of a failed one.
+        :type retry: bool
+        """
+        if not self.enabled:
+            return
+        key = (method.upper(), endpoint_template(url))
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = EndpointMetrics()
+            metrics.add(status, latency, bytes_in, bytes_out, retry)
+
+    def reset(self):
+        """Forget every recorded request."""
+        with self._lock:
+            self._metrics.clear()
+
+    def summary(self):
+        """Metrics of every endpoint, slowest in total first.
+
+        :return: List of dictionaries with METRIC_FIELDS keys.
+        :rtype: list
+        """
+        with self._lock:
+            items = [
+                (key, metrics, sorted(metrics.samples))
+                for key, metrics in self._metrics.items()]
+
+        rows = []
+        for (method, endpoint), metrics, samples in items:
+            rows.append(OrderedDict([
+                ('method', method),
+                ('endpoint', endpoint),
+                ('requests', metrics.requests),
+                ('errors', metrics.errors),
+                ('retries', metrics.retries),
+                ('total_ms', round(metrics.total_latency * 1000, 1)),
+                ('mean_ms', round(
+                    metrics.total_latency * 1000 / metrics.requests, 1)),
+                ('p50_ms', round(_percentile(samples, 50) * 1000, 1)),
+                ('p95_ms', round(_percentile(samples, 95) * 1000, 1)),
+                ('max_ms', round(metrics.max_latency * 1000, 1)),
+                ('bytes_in', metrics.bytes_in),
+                ('bytes_out', metrics.bytes_out),
+                ('statuses', ' '.join(
+                    '{}:{}'.format(status, count) for status, count in
+                    sorted(metrics.statuses.items(), key=str)))
+            ]))
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return rows
+
+    def format_summary(self):
+        """Human readable summary, one line per endpoint.
+
+        :rtype: str
+        """
+        rows = self.summary()
+        if not rows:
+            return 'No request recorded.'
+        lines = []
+        for row in rows:
+            lines.append(
+                '{method} {endpoint}: {requests} requests, {errors} errors, '
+                '{retries} retries, mean {mean_ms} ms, p95 {p95_ms} ms, '
+                'max {max_ms} ms, {bytes_in} bytes in, {bytes_out} bytes '
+                'out ({statuses})'.format(**row))
+        return '\n'.join(lines)
+
+    def to_csv(self, path):
+        """Write the summary to a CSV file.
+
+        :param path: Output path.
+        :type path: str
+        """
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=METRIC_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.summary())
+
+    def to_json(self, path):
+        """Write the summary to a JSON file.
+
+        :param path: Output path.
+        :type path: str
+        """
+        with open(path, 'w') as json_file:
+            json.dump(self.summary(), json_file, indent=2)
+
+    def dump(self, path):
+        """Write the summary to a CSV or JSON file, based on its extension.
+
+        :param path: Output path ending with .csv or .json.
+        :type path: str
+        """
+        if path.lower().endswith('.json'):
+            self.to_json(path)
+        else:
+            self.to_csv(path)
+
+
+METRICS = MetricsRegistry()
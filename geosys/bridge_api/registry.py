@@ -0,0 +1,202 @@
+# coding=utf-8
+"""Read-only indexes of the Bridge API definitions.
+
+The indexes are built once, when the module is imported, so looking up a
+definition does not scan the definitions module anymore.
+"""
+from types import MappingProxyType
+
+from geosys.bridge_api import definitions
+from geosys.bridge_api.default import (
+    NDVI_THUMBNAIL_URL,
+    NITROGEN_THUMBNAIL_URL,
+    S2REP_THUMBNAIL_URL,
+    CVIN_THUMBNAIL_URL,
+    YGM_THUMBNAIL_URL,
+    YPM_THUMBNAIL_URL,
+    SAMPLEMAP_THUMBNAIL_URL)
+from geosys.bridge_api.definitions import (
+    ARCHIVE_MAP_PRODUCTS,
+    DIFFERENCE_MAPS,
+    INSEASON_CVIN,
+    INSEASON_NITROGEN,
+    INSEASON_S2REP,
+    REFLECTANCE,
+    SAMPLE_MAP,
+    SAMZ,
+    YGM,
+    YVM)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+# Definition fields indexed besides 'key'.
+SECONDARY_KEYS = ('name',)
+
+
+def _definitions():
+    """Dictionaries of the definitions module, in dir() order.
+
+    :rtype: tuple
+    """
+    items = []
+    for name in dir(definitions):
+        if name.startswith('__'):
+            continue
+        value = getattr(definitions, name)
+        if isinstance(value, dict):
+            items.append(value)
+    return tuple(items)
+
+
+def _index(items, field):
+    """Read-only index of definitions by one of their fields.
+
+    When several definitions share a value, the first one wins.
+
+    :param items: Definitions.
+    :type items: tuple
+
+    :param field: Indexed field.
+    :type field: str
+
+    :return: Mapping of the field value to the position of the definition.
+    :rtype: MappingProxyType
+    """
+    index = {}
+    for position, item in enumerate(items):
+        value = item.get(field)
+        if isinstance(value, str):
+            index.setdefault(value, position)
+    return MappingProxyType(index)
+
+
+DEFINITIONS = _definitions()
+DEFINITIONS_BY_KEY = _index(DEFINITIONS, 'key')
+DEFINITION_INDEXES = MappingProxyType(dict(
+    (field, _index(DEFINITIONS, field)) for field in SECONDARY_KEYS))
+
+# Map family of each map type, e.g. INSEASON_NDVI: base_reference_map.
+MAP_FAMILIES = MappingProxyType(dict(
+    (key, DEFINITIONS[position]['map_family'])
+    for key, position in DEFINITIONS_BY_KEY.items()
+    if 'map_family' in DEFINITIONS[position]))
+
+# Difference map of each map type having one.
+DIFFERENCE_MAP_PAIRS = MappingProxyType(dict(
+    (item['key'], item['difference_map']) for item in DEFINITIONS
+    if 'difference_map' in item))
+DIFFERENCE_MAP_KEYS = frozenset(item['key'] for item in DIFFERENCE_MAPS)
+
+# Nitrogen maps, created for a planned nitrogen value.
+NITROGEN_MAP_KEYS = frozenset(item['key'] for item in INSEASON_NITROGEN)
+
+# Products searched with the catalog-imagery API instead of the coverage
+# API.
+CATALOG_IMAGERY_MAP_KEYS = frozenset([
+    INSEASON_S2REP['key'],
+    REFLECTANCE['key'],
+    INSEASON_CVIN['key'],
+    YGM['key'],
+    YVM['key'],
+    SAMZ['key'],
+    SAMPLE_MAP['key']
+]) | NITROGEN_MAP_KEYS
+
+# Path of the maps created from a coverage result, after
+# season-fields/{id}/coverage/{image}/{map family}/{map type}. The parts
+# are formatted with the map creation values.
+COVERAGE_MAP_PATHS = MappingProxyType(dict(
+    [
+        (REFLECTANCE['key'], ()),
+        (INSEASON_S2REP['key'], ()),
+        (YVM['key'], ('historical-yield-average', '{yield_val}')),
+        (YGM['key'], (
+            'historical-yield-average', '{yield_val}',
+            'max-yield-Goal', '{max_yield_val}',
+            'min-yield-Goal', '{min_yield_val}'))
+    ] + [
+        (key, ('n-planned', '{n_planned}')) for key in NITROGEN_MAP_KEYS
+    ]))
+
+# Name of the other map types in the maps/{map family}/{name} endpoint.
+# Maps of the sample family are addressed by their key.
+MAP_ENDPOINT_NAMES = MappingProxyType(dict(
+    (item['key'], item['key'] if item['map_family'] is definitions.sample
+        else item['name'])
+    for item in ARCHIVE_MAP_PRODUCTS + DIFFERENCE_MAPS))
+
+# Thumbnail url template of the map products not using the thumbnail link
+# of their coverage result. Templates are formatted with bridge_url, id,
+# date, image, nitrogen_map_type and n_value.
+THUMBNAIL_URL_TEMPLATES = MappingProxyType(dict(
+    [
+        # Reflectance and SaMZ maps show the INSEASON_NDVI thumbnail.
+        (REFLECTANCE['key'], NDVI_THUMBNAIL_URL),
+        (SAMZ['key'], NDVI_THUMBNAIL_URL),
+        (INSEASON_CVIN['key'], CVIN_THUMBNAIL_URL),
+        (INSEASON_S2REP['key'], S2REP_THUMBNAIL_URL),
+        (YGM['key'], YGM_THUMBNAIL_URL),
+        (YVM['key'], YPM_THUMBNAIL_URL),
+        (SAMPLE_MAP['key'], SAMPLEMAP_THUMBNAIL_URL)
+    ] + [
+        (key, NITROGEN_THUMBNAIL_URL) for key in NITROGEN_MAP_KEYS
+    ]))
+
+
+def lookup(keyword, key=None):
+    """Get the definition with a key, or with a secondary key.
+
+    :param keyword: A keyword key.
+    :type keyword: str
+
+    :param key: A secondary field to match the keyword with, e.g. 'name'.
+    :type key: str
+
+    :returns: The first matching definition, otherwise None.
+    :rtype: dict, None
+    """
+    positions = []
+    position = DEFINITIONS_BY_KEY.get(keyword)
+    if position is not None:
+        positions.append(position)
+    if key:
+        index = DEFINITION_INDEXES.get(key)
+        if index is not None:
+            position = index.get(keyword)
+            if position is not None:
+                positions.append(position)
+        else:
+            positions.extend(
+                position for position, item in enumerate(DEFINITIONS)
+                if item.get(key) == keyword)
+    if not positions:
+        return None
+    return DEFINITIONS[min(positions)]
+
+
+def map_family(map_type_key):
+    """Map family of a map type.
+
+    :param map_type_key: Map type key.
+    :type map_type_key: str
+
+    :return: The map family definition, None for an unknown map type.
+    :rtype: dict
+    """
+    return MAP_FAMILIES.get(map_type_key)
+
+
+def difference_map(map_type_key):
+    """Difference map of a map type.
+
+    :param map_type_key: Map type key, e.g. INSEASON_NDVI.
+    :type map_type_key: str
+
+    :return: The difference map definition, None when the map type has no
+        difference map.
+    :rtype: dict
+    """
+    return DIFFERENCE_MAP_PAIRS.get(map_type_key)
@@ -0,0 +1,242 @@
+# coding=utf-8
+"""Retry policy of the requests sent to the Bridge API.
+"""
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from geosys.bridge_api.default import (
+    DEFAULT_RETRY_ATTEMPTS,
+    DEFAULT_RETRY_BASE_DELAY,
+    DEFAULT_RETRY_MAX_DELAY,
+    DEFAULT_RETRY_BUDGET)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+# Responses telling the server could not handle the request for now.
+RETRY_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504, 509])
+# Responses telling the request has not been processed at all, so even a
+# non-idempotent request can be sent again.
+UNPROCESSED_STATUSES = frozenset([425, 429, 503])
+# Requests which have the same effect when they are sent more than once.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait according to a Retry-After header.
+
+    :param value: Header value, either seconds or an HTTP date.
+    :type value: str
+
+    :param now: Current time, defaults to now.
+    :type now: datetime
+
+    :return: Seconds to wait, or None when the value is missing or invalid.
+    :rtype: float
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (date - now).total_seconds())
+
+
+class RetryPolicy(object):
+    """Capped exponential backoff with full jitter and a per-call budget.
+
+    A failed call is retried when the failure is transient: a connection
+    error, a timeout or a response status from RETRY_STATUSES. A
+    non-idempotent call (e.g. a POST creating something) is only retried
+    when the request surely has not been processed. The delay before a
+    retry is the Retry-After of the response when there is one, otherwise
+    a random delay between zero and base_delay * 2 ** retry, capped to
+    max_delay. A call gives up after max_attempts retries or once its
+    budget (in seconds, retries included) would be exceeded.
+    """
+
+    def __init__(
+            self,
+            max_attempts=DEFAULT_RETRY_ATTEMPTS,
+            base_delay=DEFAULT_RETRY_BASE_DELAY,
+            max_delay=DEFAULT_RETRY_MAX_DELAY,
+            budget=DEFAULT_RETRY_BUDGET,
+            sleep=time.sleep,
+            random_value=random.random):
+        """Retry policy.
+
+        :param max_attempts: Number of retries of a call, 0 disables them.
+        :type max_attempts: int
+
+        :param base_delay: Backoff of the first retry in seconds.
+        :type base_delay: float
+
+        :param max_delay: Maximum backoff of a retry in seconds.
+        :type max_delay: float
+
+        :param budget: Maximum seconds spent on a call, retries included.
+            None for no limit.
+        :type budget: float
+
+        :param sleep: Function waiting a number of seconds.
+        :type sleep: callable
+
+        :param random_value: Function returning a random float in [0, 1).
+        :type random_value: callable
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.sleep = sleep
+        self.random_value = random_value
+
+    def configure(self, max_attempts=None, budget=None):
+        """Change the policy settings, None keeps the current value.
+
+        :param max_attempts: Number of retries of a call.
+        :type max_attempts: int
+
+        :param budget: Maximum seconds spent on a call, retries included.
+        :type budget: float
+        """
+        if max_attempts is not None:
+            self.max_attempts = max(0, max_attempts)
+        if budget is not None:
+            self.budget = budget
+
+    def retry_status(self, status, idempotent=True):
+        """Whether a response status is worth a retry.
+
+        :param status: HTTP status code.
+        :type status: int
+
+        :param idempotent: Whether the request can be sent more than once.
+        :type idempotent: bool
+
+        :rtype: bool
+        """
+        if idempotent:
+            return status in RETRY_STATUSES
+        return status in UNPROCESSED_STATUSES
+
+    def retry_error(self, error, idempotent=True):
+        """Whether a request exception is worth a retry.
+
+        :param error: Exception raised while sending the request.
+        :type error: Exception
+
+        :param idempotent: Whether the request can be sent more than once.
+        :type idempotent: bool
+
+        :rtype: bool
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            # The connection was never established.
+            return True
+        if not idempotent:
+            return False
+        return isinstance(error, (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError))
+
+    def backoff(self, retry):
+        """Random backoff before a retry.
+
+        :param retry: Number of the retry, starting at 0.
+        :type retry: int
+
+        :return: Seconds to wait.
+        :rtype: float
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** retry))
+        return self.random_value() * ceiling
+
+    def delay(self, retry, elapsed, retry_after=None):
+        """Seconds to wait before a retry, or None to give up.
+
+        :param retry: Number of the retry, starting at 0.
+        :type retry: int
+
+        :param elapsed: Seconds already spent on the call.
+        :type elapsed: float
+
+        :param retry_after: Retry-After of the failed response in seconds.
+        :type retry_after: float
+
+        :rtype: float
+        """
+        if retry >= self.max_attempts:
+            return None
+        delay = self.backoff(retry) if retry_after is None else retry_after
+        if self.budget is not None and elapsed + delay > self.budget:
+            return None
+        return delay
+
+    def call(self, send, idempotent=True):
+        """Send a request, retrying it on transient failures.
+
+        :param send: Function sending the request and returning the
+            requests.Response.
+        :type send: callable
+
+        :param idempotent: Whether the request can be sent more than once.
+        :type idempotent: bool
+
+        :return: The last response.
+        :rtype: requests.Response
+
+        :raises: requests.RequestException - when the last attempt raised
+        """
+        started = time.monotonic()
+        retry = 0
+        while True:
+            response = None
+            try:
+                response = send()
+            except requests.RequestException as error:
+                if not self.retry_error(error, idempotent):
+                    raise
+                delay = self.delay(retry, time.monotonic() - started)
+                if delay is None:
+                    raise
+                reason = error
+            else:
+                if not self.retry_status(response.status_code, idempotent):
+                    return response
+                delay = self.delay(
+                    retry, time.monotonic() - started,
+                    parse_retry_after(response.headers.get('Retry-After')))
+                if delay is None:
+                    return response
+                reason = 'HTTP {}'.format(response.status_code)
+                response.close()
+
+            LOGGER.debug('Retrying {} in {:.1f}s ({})'.format(
+                getattr(response, 'url', 'request'), delay, reason))
+            self.sleep(delay)
+            retry += 1
+
+
+RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,76 @@
+# coding=utf-8
+"""Bridge API abstract client test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from geosys.bridge_api.api_abstract import (
+    ApiClient, connection_pool_stats, close_sessions)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 handler answering every GET with a small png body."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'\x89PNG'
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ApiClientTest(unittest.TestCase):
+    """Test API clients share keep-alive connections."""
+
+    def setUp(self):
+        """Runs before each test."""
+        close_sessions()
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%s' % self.server.server_port
+
+    def tearDown(self):
+        """Runs after each test."""
+        close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reused(self):
+        """Test consecutive requests reuse a single connection."""
+        for _ in range(5):
+            # A new client per request, as BridgeAPI does.
+            client = ApiClient(endpoint_url=self.base_url)
+            content = client.get_content(
+                '%s/thumbnail.png' % self.base_url)
+            self.assertEqual(content, b'\x89PNG')
+
+        stats = connection_pool_stats()[self.base_url]
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['new_connections'], 1)
+        self.assertEqual(stats['reused_connections'], 4)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ApiClientTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
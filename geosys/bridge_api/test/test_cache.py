@@ -0,0 +1,136 @@
+# coding=utf-8
+"""Bridge API response cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from geosys.bridge_api.cache import (
+    COVERAGE_CACHE, BlobCache, DiskCache, request_key)
+from geosys.bridge_api.field_level_maps import FieldLevelMapsAPIClient
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class DiskCacheTest(unittest.TestCase):
+    """Test the on-disk response cache."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiskCache(self.directory, ttl=60, max_size=10 ** 6)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_request_key_canonical(self):
+        """Test the key does not depend on the order of dictionary keys."""
+        first = request_key(
+            'coverage', {'Geometry': 'POINT(0 0)', 'SowingDate': '2019'},
+            {'$limit': 10, 'Maps.Type': 'NDVI'})
+        second = request_key(
+            'coverage', {'SowingDate': '2019', 'Geometry': 'POINT(0 0)'},
+            {'Maps.Type': 'NDVI', '$limit': 10})
+        self.assertEqual(first, second)
+        self.assertNotEqual(
+            first, request_key('catalog-imagery', {}, {}))
+
+    def test_get_set(self):
+        """Test a stored value is returned until it expires."""
+        key = request_key('coverage', {'Geometry': 'POINT(0 0)'})
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, [{'id': 'a'}])
+        self.assertEqual(self.cache.get(key), [{'id': 'a'}])
+
+        self.cache.configure(ttl=0.01)
+        time.sleep(0.05)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_disabled(self):
+        """Test nothing is stored when the TTL is zero."""
+        self.cache.configure(ttl=0)
+        self.cache.set('key', [1])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_lru_eviction(self):
+        """Test the least recently used entries are evicted first."""
+        value = ['x' * 100]
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, value)
+        entry_size = self.cache.size() // 3
+
+        # Mark 'a' as used after 'b' and 'c'.
+        past = time.time() - 100
+        for key in ('b', 'c'):
+            os.utime(self.cache._path(key), (past, past))
+        self.assertEqual(self.cache.get('a'), value)
+
+        self.cache.configure(max_size=entry_size * 3)
+        self.cache.set('d', value)
+        self.assertEqual(self.cache.get('a'), value)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('d'), value)
+        self.assertLessEqual(self.cache.size(), entry_size * 3)
+
+    def test_blob_cache(self):
+        """Test binary entries are stored as is and bounded by size."""
+        cache = BlobCache(self.directory, max_size=1000)
+        cache.set('png', b'\x89PNG' * 150)
+        self.assertTrue(cache.contains('png'))
+        self.assertEqual(cache.get('png'), b'\x89PNG' * 150)
+
+        cache.set('other', b'\x89PNG' * 150)
+        self.assertLessEqual(cache.size(), 1000)
+        self.assertFalse(cache.contains('png'))
+        # JSON entries in the same directory are not touched.
+        self.cache.set('json', [1])
+        self.assertEqual(self.cache.get('json'), [1])
+        self.assertEqual(cache.get('other'), b'\x89PNG' * 150)
+
+    def test_coverage_cached_per_account(self):
+        """Test cached coverage results are not served to another account."""
+        responses = []
+
+        class Response(object):
+            def json(self):
+                return list(responses)
+
+        def client(identity):
+            api_client = FieldLevelMapsAPIClient(
+                'token', 'http://bridge.invalid', identity=identity)
+            # Answer from the list instead of a Bridge server.
+            api_client.post = lambda url, **kwargs: Response()
+            return api_client
+
+        directory = COVERAGE_CACHE.directory
+        COVERAGE_CACHE.configure(directory=self.directory)
+        try:
+            responses.append({'seasonField': {'id': 'first'}})
+            data = {'Geometry': 'POINT(0 0)'}
+            first = client('first').get_coverage(data)
+
+            responses[0] = {'seasonField': {'id': 'second'}}
+            self.assertEqual(client('first').get_coverage(data), first)
+            self.assertEqual(
+                client('second').get_coverage(data),
+                [{'seasonField': {'id': 'second'}}])
+        finally:
+            COVERAGE_CACHE.configure(directory=directory)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DiskCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
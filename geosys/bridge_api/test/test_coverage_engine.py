@@ -0,0 +1,158 @@
+# coding=utf-8
+"""Bridge API coverage engine test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from geosys.bridge_api.concurrency import _EXECUTORS, shared_executor
+from geosys.bridge_api.coverage_engine import CoverageEngine, RateLimiter
+from geosys.bridge_api.default import MAP_LIMIT, MAP_OFFSET
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class FakeCoverageSearch(object):
+    """Coverage endpoint returning a fixed number of results per geometry."""
+
+    def __init__(self, results_per_geometry):
+        self.results_per_geometry = results_per_geometry
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __call__(self, geometry, filters):
+        with self._lock:
+            self.requests.append((geometry, dict(filters)))
+        if geometry == 'INVALID':
+            return {'message': 'Invalid geometry.'}
+        limit = filters.get(MAP_LIMIT, self.results_per_geometry)
+        offset = filters.get(MAP_OFFSET, 0)
+        end = min(offset + limit, self.results_per_geometry)
+        return [
+            {'geometry': geometry, 'index': index}
+            for index in range(offset, end)]
+
+
+class CoverageEngineTest(unittest.TestCase):
+    """Test the coverage engine pages and batches coverage searches."""
+
+    def test_results_paged(self):
+        """Test every page of a geometry is fetched."""
+        search = FakeCoverageSearch(25)
+        engine = CoverageEngine(search, page_size=10, max_workers=2)
+        results = engine.search_geometry('POINT(0 0)')
+        self.assertEqual([r['index'] for r in results], list(range(25)))
+        self.assertEqual(
+            [filters[MAP_OFFSET] for _, filters in search.requests],
+            [0, 10, 20])
+
+    def test_explicit_limit_not_paged(self):
+        """Test a $limit given by the caller returns a single page."""
+        search = FakeCoverageSearch(25)
+        engine = CoverageEngine(search, page_size=10)
+        results = engine.search_geometry('POINT(0 0)', {MAP_LIMIT: 1})
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(search.requests), 1)
+        self.assertNotIn(MAP_OFFSET, search.requests[0][1])
+
+    def test_results_in_geometry_order(self):
+        """Test many geometries are yielded in order with their errors."""
+        geometries = ['POINT(%s 0)' % i for i in range(50)]
+        geometries[7] = 'INVALID'
+        engine = CoverageEngine(
+            FakeCoverageSearch(3), page_size=2, max_workers=4)
+
+        yielded = list(engine.iter_results(geometries))
+        self.assertEqual([index for index, _, _ in yielded], list(range(50)))
+        _, results, error = yielded[7]
+        self.assertIsNone(results)
+        self.assertEqual(str(error), 'Invalid geometry.')
+        _, results, error = yielded[8]
+        self.assertIsNone(error)
+        self.assertEqual(len(results), 3)
+
+    def test_stop(self):
+        """Test the search ends when it should stop."""
+        engine = CoverageEngine(FakeCoverageSearch(1), max_workers=1)
+        yielded = list(engine.iter_results(
+            ['POINT(0 0)'] * 10, should_stop=lambda: True))
+        self.assertEqual(yielded, [])
+
+    def test_shared_executor_sizes(self):
+        """Test pools of different sizes are kept apart."""
+        executor = shared_executor('test', 2)
+        self.assertIs(shared_executor('test', 2), executor)
+        resized = shared_executor('test', 4)
+        self.assertIsNot(resized, executor)
+        self.assertEqual(resized._max_workers, 4)
+
+        # The first pool is still usable.
+        self.assertEqual(executor.submit(sum, [1, 2]).result(5), 3)
+
+    def test_engines_of_different_sizes(self):
+        """Test searches with different worker counts run together."""
+        geometries = ['POINT({} 0)'.format(index) for index in range(20)]
+        small = CoverageEngine(FakeCoverageSearch(3), max_workers=2)
+        large = CoverageEngine(FakeCoverageSearch(3), max_workers=4)
+
+        # A search of another size starts while the first one is running.
+        running = small.iter_results(geometries)
+        first = next(running)
+        self.assertEqual(
+            [index for index, _, _ in large.iter_results(geometries)],
+            list(range(20)))
+        rest = list(running)
+        self.assertEqual(
+            [index for index, _, _ in [first] + rest], list(range(20)))
+        self.assertTrue(all(error is None for _, _, error in rest))
+
+        # And both in their own thread at the same time.
+        outcomes = {}
+
+        def search(name, engine):
+            outcomes[name] = [
+                error for _, _, error in engine.iter_results(geometries)]
+
+        threads = [
+            threading.Thread(target=search, args=item)
+            for item in (('small', small), ('large', large))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(outcomes['small'], [None] * 20)
+        self.assertEqual(outcomes['large'], [None] * 20)
+
+    def test_own_executor(self):
+        """Test an engine given its own pool only submits to that pool."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            engine = CoverageEngine(
+                FakeCoverageSearch(1), max_workers=7, executor=executor)
+            self.assertEqual(
+                len(list(engine.iter_results(['POINT(0 0)'] * 5))), 5)
+        self.assertNotIn(('coverage', 7), _EXECUTORS)
+
+    def test_rate_limiter(self):
+        """Test the rate limiter holds the request budget."""
+        limiter = RateLimiter(20, burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+        # The first request is free, the next four wait 1/20 s each.
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(CoverageEngineTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
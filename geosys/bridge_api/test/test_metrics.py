@@ -0,0 +1,132 @@
+# coding=utf-8
+"""Request metrics test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from geosys.bridge_api.api_abstract import ApiClient, close_sessions
+from geosys.bridge_api.metrics import (
+    METRICS, MetricsRegistry, endpoint_template)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    """Handler answering every request with an empty JSON list."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'[]'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MetricsTest(unittest.TestCase):
+    """Test the request metrics registry."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_endpoint_template(self):
+        """Test ids, numbers and query parameters are stripped."""
+        self.assertEqual(
+            endpoint_template(
+                'https://api.geosys-na.net/field-level-maps/v4/'
+                'season-fields/zgzmbrm/coverage/2018-10-18/'
+                'base-reference-map/INSEASON_NDVI/thumbnail.png?token=a'),
+            'https://api.geosys-na.net/field-level-maps/v4/'
+            'season-fields/{id}/coverage/{id}/'
+            'base-reference-map/INSEASON_NDVI/thumbnail.png')
+        self.assertEqual(
+            endpoint_template(
+                'https://api.geosys-na.net/field-level-maps/v4/maps/'
+                'yield-variability-map/YPM/historical-yield-average/80'),
+            'https://api.geosys-na.net/field-level-maps/v4/maps/'
+            'yield-variability-map/YPM/historical-yield-average/{id}')
+
+    def test_summary(self):
+        """Test requests are aggregated per method and endpoint."""
+        registry = MetricsRegistry()
+        url = 'https://api.host/season-fields/{}/coverage'
+        for index, latency in enumerate([0.1, 0.2, 0.3]):
+            registry.record(
+                'get', url.format(index), 200, latency, bytes_in=10)
+        registry.record(
+            'GET', url.format('x'), 503, 0.4, bytes_in=4, retry=True)
+        registry.record('POST', 'https://api.host/coverage', None, 0.05)
+
+        rows = registry.summary()
+        self.assertEqual(len(rows), 2)
+        row = rows[0]
+        self.assertEqual(row['endpoint'],
+                         'https://api.host/season-fields/{id}/coverage')
+        self.assertEqual(row['requests'], 4)
+        self.assertEqual(row['errors'], 1)
+        self.assertEqual(row['retries'], 1)
+        self.assertEqual(row['bytes_in'], 34)
+        self.assertEqual(row['max_ms'], 400)
+        self.assertEqual(row['statuses'], '200:3 503:1')
+        self.assertEqual(rows[1]['errors'], 1)
+
+        csv_path = os.path.join(self.directory, 'metrics.csv')
+        registry.dump(csv_path)
+        with open(csv_path) as csv_file:
+            self.assertEqual(len(list(csv.DictReader(csv_file))), 2)
+        json_path = os.path.join(self.directory, 'metrics.json')
+        registry.dump(json_path)
+        with open(json_path) as json_file:
+            self.assertEqual(json.load(json_file)[0]['requests'], 4)
+
+    def test_api_client_recorded(self):
+        """Test API client requests are recorded."""
+        server = HTTPServer(('127.0.0.1', 0), JsonHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:%s/coverage' % server.server_port
+        METRICS.reset()
+        try:
+            ApiClient(endpoint_url=url).post(url, json={'a': 1})
+        finally:
+            close_sessions()
+            server.shutdown()
+            server.server_close()
+
+        row = METRICS.summary()[0]
+        self.assertEqual(row['method'], 'POST')
+        self.assertEqual(row['endpoint'], url)
+        self.assertEqual(row['bytes_in'], 2)
+        self.assertEqual(row['bytes_out'], len(b'{"a": 1}'))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(MetricsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
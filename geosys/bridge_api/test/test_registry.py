@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Bridge API definitions registry test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import unittest
+
+from geosys.bridge_api import definitions
+from geosys.bridge_api.definitions import (
+    DIFFERENCE_INSEASON_NDVI,
+    INSEASON_NDVI,
+    INSEASON_NITROGEN,
+    REFLECTANCE,
+    SAMZ,
+    YGM)
+from geosys.bridge_api.registry import (
+    COVERAGE_MAP_PATHS,
+    DEFINITIONS,
+    DEFINITIONS_BY_KEY,
+    DIFFERENCE_MAP_PAIRS,
+    NITROGEN_MAP_KEYS,
+    THUMBNAIL_URL_TEMPLATES,
+    difference_map,
+    lookup,
+    map_family)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+def scan_definitions(keyword, key=None):
+    """Definition lookup scanning the definitions module."""
+    for item in dir(definitions):
+        if not item.startswith("__"):
+            var = getattr(definitions, item)
+            if isinstance(var, dict):
+                if var.get('key') == keyword or var.get(key) == keyword:
+                    return var
+    return None
+
+
+class RegistryTest(unittest.TestCase):
+    """Test the definitions registry."""
+
+    def test_lookup(self):
+        """Test definitions are found by key and by name."""
+        self.assertIs(lookup(INSEASON_NDVI['key']), INSEASON_NDVI)
+        self.assertIs(lookup(REFLECTANCE['name'], 'name'), REFLECTANCE)
+        self.assertIsNone(lookup(REFLECTANCE['name']))
+        self.assertIsNone(lookup('unknown', 'name'))
+
+    def test_lookup_matches_scan(self):
+        """Test the registry gives the same answer as the module scan."""
+        keywords = set()
+        for item in DEFINITIONS:
+            keywords.update(
+                value for value in item.values() if isinstance(value, str))
+        for keyword in keywords:
+            for key in (None, 'name', 'endpoint', 'description'):
+                self.assertIs(
+                    lookup(keyword, key), scan_definitions(keyword, key))
+
+    def test_read_only(self):
+        """Test the indexes cannot be changed."""
+        with self.assertRaises(TypeError):
+            DEFINITIONS_BY_KEY['unknown'] = 0
+        with self.assertRaises(TypeError):
+            DIFFERENCE_MAP_PAIRS['unknown'] = DIFFERENCE_INSEASON_NDVI
+
+    def test_product_tables(self):
+        """Test the map product tables."""
+        self.assertIs(
+            difference_map(INSEASON_NDVI['key']), DIFFERENCE_INSEASON_NDVI)
+        self.assertIsNone(difference_map(SAMZ['key']))
+        self.assertIs(
+            map_family(SAMZ['key']), definitions.management_zones_map)
+        self.assertEqual(
+            NITROGEN_MAP_KEYS,
+            set(item['key'] for item in INSEASON_NITROGEN))
+        self.assertEqual(
+            COVERAGE_MAP_PATHS[YGM['key']][:2],
+            ('historical-yield-average', '{yield_val}'))
+        for key in NITROGEN_MAP_KEYS:
+            self.assertIn('{n_value}', THUMBNAIL_URL_TEMPLATES[key])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RegistryTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
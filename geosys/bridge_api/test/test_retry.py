@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Bridge API retry policy test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import threading
+import unittest
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from geosys.bridge_api.api_abstract import ApiClient, close_sessions
+from geosys.bridge_api.retry import RetryPolicy, parse_retry_after
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Handler failing the first requests of the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self):
+        self.server.requests += 1
+        failing = self.server.requests <= self.server.failures
+        body = b'busy' if failing else b'[]'
+        self.send_response(self.server.status if failing else 200)
+        if failing:
+            self.send_header('Retry-After', '2')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.answer()
+
+    def log_message(self, *args):
+        pass
+
+
+class RetryPolicyTest(unittest.TestCase):
+    """Test the retry policy of the API clients."""
+
+    def setUp(self):
+        """Runs before each test."""
+        close_sessions()
+        self.server = HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.server.requests = 0
+        self.server.failures = 2
+        self.server.status = 503
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/coverage' % self.server.server_port
+        self.delays = []
+        self.client = ApiClient(endpoint_url=self.url)
+        self.client.retry_policy = RetryPolicy(
+            max_attempts=3, sleep=self.delays.append,
+            random_value=lambda: 0.5)
+
+    def tearDown(self):
+        """Runs after each test."""
+        close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_after(self):
+        """Test transient failures are retried after Retry-After."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(self.delays, [2.0, 2.0])
+
+    def test_non_idempotent(self):
+        """Test a POST is only retried when it has not been processed."""
+        self.server.status = 500
+        response = self.client.post(self.url, json={})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.server.requests, 1)
+
+        response = self.client.post(self.url, idempotent=True, json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_budget(self):
+        """Test a call gives up once its attempts or budget are used."""
+        self.server.failures = 10
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.requests, 4)
+
+        policy = RetryPolicy(
+            max_attempts=10, budget=3, random_value=lambda: 0.5)
+        self.assertEqual(policy.delay(0, elapsed=0, retry_after=2), 2)
+        self.assertIsNone(policy.delay(1, elapsed=2, retry_after=2))
+
+    def test_backoff(self):
+        """Test the backoff doubles and is capped."""
+        policy = RetryPolicy(
+            base_delay=1, max_delay=5, random_value=lambda: 1.0)
+        self.assertEqual(
+            [policy.backoff(retry) for retry in range(5)], [1, 2, 4, 5, 5])
+
+    def test_parse_retry_after(self):
+        """Test Retry-After is read as seconds or as an HTTP date."""
+        now = datetime(2019, 3, 11, 12, 0, 0, tzinfo=timezone.utc)
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after(
+            'Mon, 11 Mar 2019 12:00:30 GMT', now=now), 30)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RetryPolicyTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
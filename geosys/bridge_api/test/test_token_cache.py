@@ -0,0 +1,140 @@
+# coding=utf-8
+"""Bridge API token cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import time
+import unittest
+
+from geosys.bridge_api.token_cache import TokenCache
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class FakeConnectionAPIClient(object):
+    """Identity server client counting the token requests."""
+
+    logins = 0
+    refreshes = 0
+    expires_in = 3600
+    refresh_fails = False
+
+    def __init__(self, endpoint_url):
+        self.endpoint_url = endpoint_url
+
+    def get_access_token(self, username, password, client_id, client_secret):
+        FakeConnectionAPIClient.logins += 1
+        if password != 'secret':
+            return {'error': 'invalid_grant'}
+        return {
+            'access_token': 'login-%s' % FakeConnectionAPIClient.logins,
+            'refresh_token': 'refresh',
+            'expires_in': FakeConnectionAPIClient.expires_in
+        }
+
+    def refresh_access_token(self, refresh_token, client_id, client_secret):
+        FakeConnectionAPIClient.refreshes += 1
+        if FakeConnectionAPIClient.refresh_fails:
+            return {'error': 'temporarily_unavailable'}
+        return {
+            'access_token': 'refresh-%s' % FakeConnectionAPIClient.refreshes,
+            'refresh_token': refresh_token,
+            'expires_in': FakeConnectionAPIClient.expires_in
+        }
+
+
+class TokenCacheTest(unittest.TestCase):
+    """Test the token cache reuses and refreshes access tokens."""
+
+    def setUp(self):
+        """Runs before each test."""
+        FakeConnectionAPIClient.logins = 0
+        FakeConnectionAPIClient.refreshes = 0
+        FakeConnectionAPIClient.expires_in = 3600
+        FakeConnectionAPIClient.refresh_fails = False
+        self.cache = TokenCache(client_class=FakeConnectionAPIClient)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.cache.clear()
+
+    def test_token_reused(self):
+        """Test the second request does not log in again."""
+        args = ('https://identity', 'user', 'secret', 'client', 'cs')
+        first = self.cache.get_token(*args)
+        second = self.cache.get_token(*args)
+        self.assertEqual(first['access_token'], second['access_token'])
+        self.assertEqual(FakeConnectionAPIClient.logins, 1)
+
+    def test_changed_password_logs_in(self):
+        """Test a different password is not served from the cache."""
+        self.cache.get_token(
+            'https://identity', 'user', 'secret', 'client', 'cs')
+        response = self.cache.get_token(
+            'https://identity', 'user', 'wrong', 'client', 'cs')
+        self.assertNotIn('access_token', response)
+        self.assertEqual(FakeConnectionAPIClient.logins, 2)
+
+    def test_expired_token_refreshed(self):
+        """Test an expired token is renewed with the refresh token."""
+        FakeConnectionAPIClient.expires_in = -1
+        args = ('https://identity', 'user', 'secret', 'client', 'cs')
+        self.cache.get_token(*args)
+        response = self.cache.get_token(*args)
+        self.assertTrue(response['access_token'].startswith('refresh-'))
+        self.assertEqual(FakeConnectionAPIClient.logins, 1)
+
+    def test_short_lived_token_refreshes_bounded(self):
+        """Test tokens shorter than the refresh margin do not refresh in
+        a loop, and idle tokens stop being refreshed."""
+        FakeConnectionAPIClient.expires_in = 1
+        cache = TokenCache(
+            client_class=FakeConnectionAPIClient, min_refresh_delay=0.1)
+        args = ('https://identity', 'user', 'secret', 'client', 'cs')
+        try:
+            cache.get_token(*args)
+            time.sleep(1.5)
+            # Refreshed halfway through the first token only, the renewed
+            # token has not been used.
+            self.assertEqual(FakeConnectionAPIClient.refreshes, 1)
+
+            # A token in use keeps being renewed, at most twice a lifetime.
+            refreshes = FakeConnectionAPIClient.refreshes
+            for _ in range(15):
+                cache.get_token(*args)
+                time.sleep(0.1)
+            self.assertGreaterEqual(
+                FakeConnectionAPIClient.refreshes - refreshes, 1)
+            self.assertLessEqual(
+                FakeConnectionAPIClient.refreshes - refreshes, 4)
+        finally:
+            cache.clear()
+
+    def test_failed_refresh_backs_off(self):
+        """Test a rejected refresh is retried with a growing delay."""
+        FakeConnectionAPIClient.expires_in = 1
+        FakeConnectionAPIClient.refresh_fails = True
+        cache = TokenCache(
+            client_class=FakeConnectionAPIClient, min_refresh_delay=0.1)
+        try:
+            cache.get_token(
+                'https://identity', 'user', 'secret', 'client', 'cs')
+            time.sleep(1.5)
+            # At 0.5 s, then retried 0.1 s and 0.2 s later, the next retry
+            # would come after the token has expired.
+            self.assertEqual(FakeConnectionAPIClient.refreshes, 3)
+        finally:
+            cache.clear()
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TokenCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
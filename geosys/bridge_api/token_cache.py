@@ -0,0 +1,277 @@
+# coding=utf-8
+"""Process-wide cache of access tokens issued by the identity server.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from geosys.bridge_api.connection import ConnectionAPIClient
+from geosys.bridge_api.default import (
+    TOKEN_REFRESH_MARGIN, TOKEN_MIN_REFRESH_DELAY, DEFAULT_TOKEN_LIFETIME)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+
+class TokenEntry(object):
+    """A cached token response of the identity server."""
+
+    def __init__(self, response, secret_digest):
+        """Cached token response.
+
+        :param response: JSON response of the identity server token request.
+        :type response: dict
+
+        :param secret_digest: Digest of the password and client secret used
+            to obtain the token.
+        :type secret_digest: str
+        """
+        self.access_token = response['access_token']
+        self.refresh_token = response.get('refresh_token')
+        expires_in = response.get('expires_in') or DEFAULT_TOKEN_LIFETIME
+        self.expires_at = time.time() + float(expires_in)
+        self.secret_digest = secret_digest
+        # Whether the access token has been handed out, a token nobody
+        # asked for is not refreshed again.
+        self.used = False
+
+    def remaining(self):
+        """Number of seconds before the access token expires.
+
+        :return: Remaining lifetime of the access token.
+        :rtype: float
+        """
+        return self.expires_at - time.time()
+
+
+class TokenCache(object):
+    """Shared store of access tokens.
+
+    Tokens are keyed by (identity server, username, client id). A cached
+    access token is reused until it is about to expire, and it is renewed
+    in the background with the refresh token shortly before that, so only
+    the very first request for a set of credentials waits on a login.
+
+    A token is only renewed in the background when it has been used since
+    it was issued, the tokens of an idle account are left to expire and
+    renewed on their next use.
+    """
+
+    def __init__(
+            self,
+            refresh_margin=TOKEN_REFRESH_MARGIN,
+            client_class=ConnectionAPIClient,
+            min_refresh_delay=TOKEN_MIN_REFRESH_DELAY):
+        """Shared store of access tokens.
+
+        :param refresh_margin: Seconds before expiry at which a token is
+            refreshed.
+        :type refresh_margin: int
+
+        :param client_class: Identity server client class.
+        :type client_class: type
+
+        :param min_refresh_delay: Minimum seconds between two background
+            refreshes, also the first delay before retrying a failed one.
+        :type min_refresh_delay: float
+        """
+        self.refresh_margin = refresh_margin
+        self.min_refresh_delay = min_refresh_delay
+        self.client_class = client_class
+        self._entries = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @staticmethod
+    def cache_key(identity_server, username, client_id):
+        """Key of a token in the cache.
+
+        :return: Cache key.
+        :rtype: tuple
+        """
+        return identity_server, username, client_id
+
+    @staticmethod
+    def secret_digest(password, client_secret):
+        """Digest of the secrets used to obtain a token.
+
+        The digest lets the cache detect a changed password without keeping
+        the password itself.
+
+        :return: Hex digest.
+        :rtype: str
+        """
+        secret = '{}\n{}'.format(password, client_secret)
+        return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+    def _key_lock(self, key):
+        """Lock serializing logins for a single cache key."""
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _valid_entry(self, key, digest):
+        """Get the cached entry of a key if it can still be used."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry.secret_digest == digest:
+            return entry
+        return None
+
+    def get_token(
+            self, identity_server, username, password,
+            client_id, client_secret):
+        """Get an access token, logging in only when needed.
+
+        :param identity_server: Identity server url.
+        :type identity_server: str
+
+        :param username: Username
+        :type username: str
+
+        :param password: Password
+        :type password: str
+
+        :param client_id: Client ID
+        :type client_id: str
+
+        :param client_secret: Client Secret
+        :type client_secret: str
+
+        :return: Token response. Contains access_token on success, otherwise
+            the error response of the identity server.
+        :rtype: dict
+        """
+        key = self.cache_key(identity_server, username, client_id)
+        digest = self.secret_digest(password, client_secret)
+
+        entry = self._valid_entry(key, digest)
+        if entry and entry.remaining() > 0:
+            entry.used = True
+            return {'access_token': entry.access_token}
+
+        with self._key_lock(key):
+            # Another thread may have logged in while we were waiting.
+            entry = self._valid_entry(key, digest)
+            if entry and entry.remaining() > 0:
+                entry.used = True
+                return {'access_token': entry.access_token}
+
+            api_client = self.client_class(identity_server)
+            response = {}
+            if entry and entry.refresh_token:
+                response = api_client.refresh_access_token(
+                    entry.refresh_token, client_id, client_secret)
+            if not response.get('access_token'):
+                response = api_client.get_access_token(
+                    username, password, client_id, client_secret)
+            if response.get('access_token'):
+                entry = TokenEntry(response, digest)
+                entry.used = True
+                self._store(
+                    key, entry, identity_server, client_id, client_secret)
+            return response
+
+    def _store(self, key, entry, identity_server, client_id, client_secret):
+        """Store a token entry and schedule its background refresh."""
+        with self._lock:
+            self._entries[key] = entry
+            timer = self._timers.pop(key, None)
+            if timer:
+                timer.cancel()
+        if not entry.refresh_token:
+            return
+        # Short-lived tokens are refreshed halfway through their lifetime,
+        # and never more often than the minimum delay.
+        remaining = entry.remaining()
+        self._schedule_refresh(
+            max(remaining - self.refresh_margin, remaining / 2.0,
+                self.min_refresh_delay),
+            key, entry, identity_server, client_id, client_secret)
+
+    def _schedule_refresh(
+            self, delay, key, entry, identity_server, client_id,
+            client_secret, failures=0):
+        """Schedule the background refresh of a token entry."""
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                return
+            timer = threading.Timer(
+                delay, self._refresh,
+                (key, entry, identity_server, client_id, client_secret,
+                 failures))
+            timer.daemon = True
+            self._timers[key] = timer
+        timer.start()
+
+    def _refresh(
+            self, key, entry, identity_server, client_id, client_secret,
+            failures=0):
+        """Renew a token entry with its refresh token.
+
+        A failed refresh is retried with an exponential backoff while the
+        access token is still valid.
+        """
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                # Entry has been replaced or invalidated in the meantime.
+                return
+            self._timers.pop(key, None)
+        if not entry.used:
+            LOGGER.debug('Token unused since its last refresh, not renewed.')
+            return
+        try:
+            api_client = self.client_class(identity_server)
+            response = api_client.refresh_access_token(
+                entry.refresh_token, client_id, client_secret)
+        except Exception as e:
+            LOGGER.debug('Token refresh failed: %s' % e)
+            response = None
+        if response and response.get('access_token'):
+            self._store(
+                key, TokenEntry(response, entry.secret_digest),
+                identity_server, client_id, client_secret)
+            return
+        if response is not None:
+            LOGGER.debug('Token refresh rejected by identity server.')
+        delay = self.min_refresh_delay * 2 ** failures
+        if delay < entry.remaining():
+            self._schedule_refresh(
+                delay, key, entry, identity_server, client_id,
+                client_secret, failures + 1)
+
+    def invalidate(self, identity_server, username, client_id):
+        """Forget the token of a set of credentials.
+
+        :param identity_server: Identity server url.
+        :type identity_server: str
+
+        :param username: Username
+        :type username: str
+
+        :param client_id: Client ID
+        :type client_id: str
+        """
+        key = self.cache_key(identity_server, username, client_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+    def clear(self):
+        """Forget every cached token."""
+        with self._lock:
+            self._entries.clear()
+            timers = list(self._timers.values())
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+
+
+TOKEN_CACHE = TokenCache()
@@ -0,0 +1,520 @@
+# coding=utf-8
+"""Pluggable transport of the requests sent to the Bridge API.
+
+The live transport sends requests over the network. The recording
+transport sends them too and stores every request/response pair in a
+cassette directory, with credentials scrubbed. The replay transport
+answers requests from a cassette without any network access, optionally
+simulating the latency and bandwidth of the real service.
+
+The transport is chosen with environment variables, e.g.::
+
+    GEOSYS_TRANSPORT=record GEOSYS_CASSETTE_DIR=/tmp/cassettes
+    GEOSYS_TRANSPORT=replay GEOSYS_CASSETTE_DIR=/tmp/cassettes \
+        GEOSYS_REPLAY_LATENCY=0.2 GEOSYS_REPLAY_BANDWIDTH=1000000
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from geosys.bridge_api.cache import request_key
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+TRANSPORT_ENV = 'GEOSYS_TRANSPORT'
+CASSETTE_DIR_ENV = 'GEOSYS_CASSETTE_DIR'
+REPLAY_LATENCY_ENV = 'GEOSYS_REPLAY_LATENCY'
+REPLAY_BANDWIDTH_ENV = 'GEOSYS_REPLAY_BANDWIDTH'
+
+LIVE = 'live'
+RECORD = 'record'
+REPLAY = 'replay'
+
+SCRUBBED = '***'
+# Request and response fields holding credentials or account names, in
+# bodies and queries.
+SECRET_FIELDS = frozenset([
+    'username', 'password', 'client_secret', 'access_token',
+    'refresh_token', 'id_token', 'token', 'apikey', 'api_key'])
+# Headers never written to a cassette.
+SECRET_HEADERS = frozenset([
+    'authorization', 'proxy-authorization', 'cookie', 'set-cookie'])
+# Parameters of requests.Request, the others only affect the sending.
+REQUEST_ARGUMENTS = ('headers', 'params', 'data', 'json', 'files')
+
+
+class CassetteMissError(requests.RequestException):
+    """No recorded response matches a replayed request."""
+
+
+def scrub(value):
+    """Replace credentials in a parsed body or query by a placeholder.
+
+    :param value: Parsed JSON body, or list of (name, value) pairs.
+    :type value: dict, list
+
+    :return: Copy of the value without credentials.
+    :rtype: dict, list
+    """
+    if isinstance(value, dict):
+        return dict(
+            (key, SCRUBBED if key.lower() in SECRET_FIELDS else scrub(item))
+            for key, item in value.items())
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    if isinstance(value, tuple) and len(value) == 2 and isinstance(
+            value[0], str) and value[0].lower() in SECRET_FIELDS:
+        return value[0], SCRUBBED
+    return value
+
+
+def scrub_url(url):
+    """Url with credentials removed from its user info and query.
+
+    The query parameters are sorted so the url does not depend on the
+    order they were given in.
+
+    :param url: Request url.
+    :type url: str
+
+    :rtype: str
+    """
+    parts = urlsplit(url)
+    query = sorted(scrub(parse_qsl(parts.query, keep_blank_values=True)))
+    netloc = parts.netloc.rsplit('@', 1)[-1]
+    return urlunsplit((
+        parts.scheme, netloc, parts.path, urlencode(query), ''))
+
+
+def scrub_body(body):
+    """Canonical form of a request body without credentials.
+
+    JSON and form bodies are parsed, so the form does not depend on the
+    order of their fields.
+
+    :param body: Request body.
+    :type body: str, bytes
+
+    :return: Parsed body, or the body text when it can not be parsed.
+    :rtype: dict, list, str
+    """
+    if not body:
+        return None
+    if isinstance(body, bytes):
+        try:
+            body = body.decode('utf-8')
+        except UnicodeDecodeError:
+            return request_key(body.hex())
+    try:
+        return scrub(json.loads(body))
+    except ValueError:
+        pass
+    fields = parse_qsl(body, keep_blank_values=True)
+    if fields and '=' in body:
+        return sorted(scrub(fields))
+    return body
+
+
+def scrub_content(content):
+    """Response body with the credentials of a JSON body replaced.
+
+    :param content: Response body.
+    :type content: bytes
+
+    :rtype: bytes
+    """
+    try:
+        value = json.loads(content.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return content
+    scrubbed = scrub(value)
+    if scrubbed == value:
+        return content
+    return json.dumps(scrubbed).encode('utf-8')
+
+
+def prepare(method, url, **kwargs):
+    """Prepare a request without sending it.
+
+    :param method: HTTP method.
+    :type method: str
+
+    :param url: Request url.
+    :type url: str
+
+    :param kwargs: requests.request parameters.
+    :type kwargs: dict
+
+    :rtype: requests.PreparedRequest
+    """
+    arguments = dict(
+        (name, kwargs[name]) for name in REQUEST_ARGUMENTS if name in kwargs)
+    return requests.Request(method.upper(), url, **arguments).prepare()
+
+
+def interaction_key(method, url, body=None):
+    """Key of a request in a cassette.
+
+    Requests differing only by their credentials share the same key.
+
+    :param method: HTTP method.
+    :type method: str
+
+    :param url: Full request url, query included.
+    :type url: str
+
+    :param body: Request body.
+    :type body: str, bytes
+
+    :rtype: str
+    """
+    return request_key(method.upper(), scrub_url(url), scrub_body(body))
+
+
+class Cassette(object):
+    """Directory of recorded request/response pairs.
+
+    Each interaction is stored as a JSON file describing the request and
+    the response, and a file holding the response body, both named after
+    the interaction key. Recording the same request again replaces it.
+    """
+
+    def __init__(self, directory=None):
+        """Directory of recorded request/response pairs.
+
+        :param directory: Cassette directory, created on first write.
+        :type directory: str
+        """
+        self.directory = directory or os.path.join(
+            tempfile.gettempdir(), 'geosys', 'cassettes')
+        self._lock = threading.Lock()
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def body_path(self, key):
+        """Path of the recorded response body of an interaction.
+
+        :param key: Interaction key.
+        :type key: str
+
+        :rtype: str
+        """
+        return self._path(key, '.body')
+
+    def load(self, key):
+        """Get a recorded interaction.
+
+        :param key: Interaction key.
+        :type key: str
+
+        :return: The interaction, None when it was not recorded.
+        :rtype: dict
+        """
+        try:
+            with open(self._path(key, '.json')) as interaction_file:
+                return json.load(interaction_file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, interaction, content=None, content_path=None):
+        """Record an interaction.
+
+        :param key: Interaction key.
+        :type key: str
+
+        :param interaction: Request and response description.
+        :type interaction: dict
+
+        :param content: Response body.
+        :type content: bytes
+
+        :param content_path: File holding the response body, copied to the
+            cassette instead of content.
+        :type content_path: str
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            body_path = self.body_path(key)
+            handle, temporary_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(handle, 'wb') as body_file:
+                if content_path:
+                    with open(content_path, 'rb') as source:
+                        shutil.copyfileobj(source, body_file)
+                else:
+                    body_file.write(content or b'')
+            os.replace(temporary_path, body_path)
+
+            handle, temporary_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(handle, 'w') as interaction_file:
+                json.dump(interaction, interaction_file, indent=2)
+            os.replace(temporary_path, self._path(key, '.json'))
+
+
+def _response_headers(headers):
+    """Response headers which can be written to a cassette.
+
+    :type headers: dict
+    :rtype: dict
+    """
+    return dict(
+        (name, value) for name, value in headers.items()
+        if name.lower() not in SECRET_HEADERS)
+
+
+class LiveTransport(object):
+    """Send requests over the network."""
+
+    name = LIVE
+
+    def send(self, session, method, url, **kwargs):
+        """Send a request.
+
+        :param session: Session sending the request.
+        :type session: requests.Session
+
+        :param method: HTTP method.
+        :type method: str
+
+        :param url: Request url.
+        :type url: str
+
+        :param kwargs: requests.request parameters.
+        :type kwargs: dict
+
+        :rtype: requests.Response
+        """
+        return session.request(method, url, **kwargs)
+
+    def download_url(self, url):
+        """Url a file download should fetch.
+
+        :param url: Url of the file.
+        :type url: str
+
+        :return: The url to fetch.
+        :rtype: str
+        """
+        return url
+
+    def download_delay(self, url):
+        """Seconds to wait before a file download starts.
+
+        :param url: Url of the file.
+        :type url: str
+
+        :rtype: float
+        """
+        return 0.0
+
+    def record_download(self, url, status, headers, path):
+        """Store a completed file download.
+
+        :param url: Url of the file.
+        :type url: str
+
+        :param status: HTTP status code.
+        :type status: int
+
+        :param headers: Response headers.
+        :type headers: dict
+
+        :param path: Path of the downloaded file.
+        :type path: str
+        """
+
+
+class RecordingTransport(LiveTransport):
+    """Send requests over the network and record them in a cassette."""
+
+    name = RECORD
+
+    def __init__(self, cassette):
+        """Send requests over the network and record them in a cassette.
+
+        :param cassette: Cassette the interactions are recorded in.
+        :type cassette: Cassette
+        """
+        self.cassette = cassette
+
+    def send(self, session, method, url, **kwargs):
+        response = session.request(method, url, **kwargs)
+        request = response.request
+        self.cassette.save(
+            interaction_key(method, request.url, request.body), {
+                'method': method.upper(),
+                'url': scrub_url(request.url),
+                'body': scrub_body(request.body),
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': _response_headers(response.headers)
+            }, content=scrub_content(response.content))
+        return response
+
+    def record_download(self, url, status, headers, path):
+        url = prepare('GET', url).url
+        self.cassette.save(interaction_key('GET', url), {
+            'method': 'GET',
+            'url': scrub_url(url),
+            'body': None,
+            'status': status or 200,
+            'reason': None,
+            'headers': _response_headers(headers)
+        }, content_path=path)
+
+
+class ReplayTransport(LiveTransport):
+    """Answer requests from a cassette, without network access.
+
+    Each response is delayed by the latency and by its size divided by the
+    bandwidth, so a replay takes about as long as the real service.
+    """
+
+    name = REPLAY
+
+    def __init__(
+            self, cassette, latency=0.0, bandwidth=None, sleep=time.sleep):
+        """Answer requests from a cassette, without network access.
+
+        :param cassette: Cassette the responses are read from.
+        :type cassette: Cassette
+
+        :param latency: Seconds added to every response.
+        :type latency: float
+
+        :param bandwidth: Simulated bandwidth in bytes per second, None
+            for no limit.
+        :type bandwidth: float
+
+        :param sleep: Function waiting a number of seconds.
+        :type sleep: callable
+        """
+        self.cassette = cassette
+        self.latency = latency or 0.0
+        self.bandwidth = bandwidth
+        self.sleep = sleep
+
+    def delay(self, size):
+        """Simulated seconds to receive a response.
+
+        :param size: Response body size in bytes.
+        :type size: int
+
+        :rtype: float
+        """
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / float(self.bandwidth)
+        return delay
+
+    def _interaction(self, method, url, body=None):
+        key = interaction_key(method, url, body)
+        interaction = self.cassette.load(key)
+        if interaction is None:
+            raise CassetteMissError(
+                'No recorded response for {} {}'.format(
+                    method.upper(), scrub_url(url)))
+        return key, interaction
+
+    def send(self, session, method, url, **kwargs):
+        request = prepare(method, url, **kwargs)
+        key, interaction = self._interaction(
+            method, request.url, request.body)
+        with open(self.cassette.body_path(key), 'rb') as body_file:
+            content = body_file.read()
+
+        delay = self.delay(len(content))
+        if delay:
+            self.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction.get('reason')
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=delay)
+        response._content = content
+        response._content_consumed = True
+        return response
+
+    def download_url(self, url):
+        key, _ = self._interaction('GET', prepare('GET', url).url)
+        return 'file:///' + self.cassette.body_path(key).replace(
+            os.sep, '/').lstrip('/')
+
+    def download_delay(self, url):
+        key, _ = self._interaction('GET', prepare('GET', url).url)
+        return self.delay(os.path.getsize(self.cassette.body_path(key)))
+
+
+def transport_from_environment(environ=None):
+    """Build the transport selected by the environment variables.
+
+    :param environ: Environment, defaults to os.environ.
+    :type environ: dict
+
+    :rtype: LiveTransport
+    """
+    environ = os.environ if environ is None else environ
+    mode = environ.get(TRANSPORT_ENV, LIVE).strip().lower() or LIVE
+    if mode == LIVE:
+        return LiveTransport()
+    cassette = Cassette(environ.get(CASSETTE_DIR_ENV) or None)
+    if mode == RECORD:
+        return RecordingTransport(cassette)
+    if mode == REPLAY:
+        bandwidth = environ.get(REPLAY_BANDWIDTH_ENV)
+        return ReplayTransport(
+            cassette,
+            latency=float(environ.get(REPLAY_LATENCY_ENV) or 0),
+            bandwidth=float(bandwidth) if bandwidth else None)
+    raise ValueError('Unknown {} value: {}'.format(TRANSPORT_ENV, mode))
+
+
+_TRANSPORT = None
+_TRANSPORT_LOCK = threading.Lock()
+
+
+def current_transport():
+    """Get the process-wide transport, built from the environment on
+    first use.
+
+    :rtype: LiveTransport
+    """
+    global _TRANSPORT
+    with _TRANSPORT_LOCK:
+        if _TRANSPORT is None:
+            _TRANSPORT = transport_from_environment()
+            if _TRANSPORT.name != LIVE:
+                LOGGER.info('Bridge API transport: {} ({})'.format(
+                    _TRANSPORT.name, _TRANSPORT.cassette.directory))
+        return _TRANSPORT
+
+
+def set_transport(transport):
+    """Replace the process-wide transport.
+
+    :param transport: The transport, None to build it from the environment
+        again on next use.
+    :type transport: LiveTransport
+    """
+    global _TRANSPORT
+    with _TRANSPORT_LOCK:
+        _TRANSPORT = transport
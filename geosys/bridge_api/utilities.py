@@ -1,7 +1,7 @@
 # coding=utf-8
 """This module contains utilities used by Bridge API Interface.
 """
-from geosys.bridge_api import definitions
+from geosys.bridge_api.registry import lookup
 
 __copyright__ = "Copyright 2019, Kartoza"
 __license__ = "GPL version 3"
@@ -23,11 +23,4 @@ def get_definition(keyword, key=None):
         from definitions, otherwise None if no match was found.
     :rtype: dict, None
     """
-
-    for item in dir(definitions):
-        if not item.startswith("__"):
-            var = getattr(definitions, item)
-            if isinstance(var, dict):
-                if var.get('key') == keyword or var.get(key) == keyword:
-                    return var
-    return None
+    return lookup(keyword, key)
@@ -2,11 +2,19 @@
 """Implementation of Bridge API Wrapper.
 """
 from geosys.bridge_api.api_abstract import ApiClient
-from geosys.bridge_api.connection import ConnectionAPIClient
-from geosys.bridge_api.default import IDENTITY_URLS, BRIDGE_URLS, ALL_REGIONS
+from geosys.bridge_api.cache import request_key
+from geosys.bridge_api.coverage_engine import CoverageEngine, rate_limiter_for
+from geosys.bridge_api.default import (
+    IDENTITY_URLS,
+    BRIDGE_URLS,
+    ALL_REGIONS,
+    DEFAULT_COVERAGE_PAGE_SIZE,
+    DEFAULT_COVERAGE_WORKERS,
+    DEFAULT_COVERAGE_REQUESTS_PER_SECOND)
 from geosys.bridge_api.definitions import CROPS, SAMZ
 from geosys.bridge_api.field_level_maps import FieldLevelMapsAPIClient
-from geosys.bridge_api.utilities import get_definition
+from geosys.bridge_api.token_cache import TOKEN_CACHE
+from geosys.bridge_api.registry import difference_map
 
 from geosys.bridge_api.definitions import SAMPLE_MAP
 
@@ -119,6 +127,9 @@ class BridgeAPI(ApiClient):
         self.bridge_server = (BRIDGE_URLS[self.region]['test']
                               if self.use_testing_service
                               else BRIDGE_URLS[self.region]['prod'])
+        # Cached coverage results are only served to the same account.
+        self.identity = request_key(
+            self.identity_server, self.username, self.client_id)
 
         # authenticate user
         self.authenticated, self.authentication_message = self.authenticate()
@@ -156,8 +167,10 @@ class BridgeAPI(ApiClient):
         :rtype: tuple
         """
         try:
-            api_client = ConnectionAPIClient(self.identity_server)
-            response = api_client.get_access_token(
+            # Tokens are shared between BridgeAPI instances, so only the
+            # first instance for a set of credentials logs in.
+            response = TOKEN_CACHE.get_token(
+                self.identity_server,
                 self.username,
                 self.password,
                 self.client_id,
@@ -176,7 +189,9 @@ class BridgeAPI(ApiClient):
             message = 'Please enter a correct region (NA or EU)'
             return False, message
 
-    def get_coverage(self, geometry, crop, sowing_date, filters=None):
+    def get_coverage(
+            self, geometry, crop, sowing_date, filters=None,
+            force_refresh=False):
         """Get fields coverage for given parameters.
 
         :param geometry: A geometry in WKT format.
@@ -195,6 +210,9 @@ class BridgeAPI(ApiClient):
             }
         :type filters: dict
 
+        :param force_refresh: Skip the cached response, if any.
+        :type force_refresh: bool
+
         :return: JSON response.
             List of maps data specification based on given criteria.
         :rtype: list
@@ -209,12 +227,15 @@ class BridgeAPI(ApiClient):
         }
 
         api_client = FieldLevelMapsAPIClient(
-            self.access_token, self.bridge_server)
-        coverages_json = api_client.get_coverage(request_data, filters=filters)
+            self.access_token, self.bridge_server, identity=self.identity)
+        coverages_json = api_client.get_coverage(
+            request_data, filters=filters, force_refresh=force_refresh)
 
         return coverages_json
 
-    def get_catalog_imagery(self, geometry, crop, sowing_date, filters=None):
+    def get_catalog_imagery(
+            self, geometry, crop, sowing_date, filters=None,
+            force_refresh=False):
         """Get catalog imagery for given parameters.
 
         :param geometry: A geometry in WKT format.
@@ -233,6 +254,9 @@ class BridgeAPI(ApiClient):
             }
         :type filters: dict
 
+        :param force_refresh: Skip the cached response, if any.
+        :type force_refresh: bool
+
         :return: JSON response.
             List of maps data specification based on given criteria.
         :rtype: list
@@ -248,11 +272,84 @@ class BridgeAPI(ApiClient):
         }
 
         api_client = FieldLevelMapsAPIClient(
-            self.access_token, self.bridge_server)
-        coverages_json = api_client.get_catalog_imagery(request_data, filters=filters)
+            self.access_token, self.bridge_server, identity=self.identity)
+        coverages_json = api_client.get_catalog_imagery(
+            request_data, filters=filters, force_refresh=force_refresh)
 
         return coverages_json
 
+    def iter_coverage(
+            self,
+            geometries,
+            crop,
+            sowing_date,
+            filters=None,
+            catalog_imagery=False,
+            page_size=DEFAULT_COVERAGE_PAGE_SIZE,
+            max_workers=DEFAULT_COVERAGE_WORKERS,
+            requests_per_second=DEFAULT_COVERAGE_REQUESTS_PER_SECOND,
+            force_refresh=False,
+            should_stop=None,
+            executor=None):
+        """Get coverage of any number of geometries.
+
+        Geometries are searched concurrently in a bounded window and the
+        results of each geometry are paged through, see CoverageEngine.
+
+        :param geometries: Geometries in WKT format.
+        :type geometries: list
+
+        :param crop: Crop type.
+        :type crop: str
+
+        :param sowing_date: Sowing date. YYYY-MM-DD
+        :type sowing_date: str
+
+        :param filters: Filter coverage results.
+        :type filters: dict
+
+        :param catalog_imagery: Search the catalog imagery instead of the
+            map coverage.
+        :type catalog_imagery: bool
+
+        :param page_size: Number of results requested per page.
+        :type page_size: int
+
+        :param max_workers: Number of concurrent geometry searches.
+        :type max_workers: int
+
+        :param requests_per_second: Request budget against the Bridge
+            server, shared by every search in the process.
+        :type requests_per_second: float
+
+        :param force_refresh: Skip cached responses.
+        :type force_refresh: bool
+
+        :param should_stop: Callable returning True to abandon the search.
+        :type should_stop: callable
+
+        :param executor: Worker pool running the searches. Defaults to the
+            process-wide coverage pool of max_workers workers.
+        :type executor: concurrent.futures.Executor
+
+        :return: Generator of (geometry index, results, error) tuples in
+            the order of the geometries.
+        :rtype: generator
+        """
+        search = (
+            self.get_catalog_imagery if catalog_imagery
+            else self.get_coverage)
+        engine = CoverageEngine(
+            lambda geometry, page_filters: search(
+                geometry, crop, sowing_date, filters=page_filters,
+                force_refresh=force_refresh),
+            page_size=page_size,
+            max_workers=max_workers,
+            rate_limiter=rate_limiter_for(
+                self.bridge_server, requests_per_second),
+            executor=executor)
+        return engine.iter_results(geometries, filters, should_stop)
+
     def _get_field_map(
             self,
             map_type_key,
@@ -283,7 +380,7 @@ class BridgeAPI(ApiClient):
         :rtype: dict
         """
         api_client = FieldLevelMapsAPIClient(
-            self.access_token, self.bridge_server)
+            self.access_token, self.bridge_server, identity=self.identity)
         field_map_json = api_client.get_field_map(
             map_type_key,
             request_data,
@@ -304,7 +401,7 @@ class BridgeAPI(ApiClient):
         :rtype: dict
         """
         api_client = FieldLevelMapsAPIClient(
-            self.access_token, self.bridge_server)
+            self.access_token, self.bridge_server, identity=self.identity)
         map_json = api_client.get_hotspot(
             url)
 
@@ -436,8 +533,7 @@ class BridgeAPI(ApiClient):
         # Get request parameters
         params = kwargs.get('params')
 
-        map_type_definition = get_definition(map_type_key)
-        difference_map_definition = map_type_definition['difference_map']
+        difference_map_definition = difference_map(map_type_key)
 
         return self._get_field_map(
             difference_map_definition['key'], request_data, params=params)
@@ -22,24 +22,28 @@
  *                                                                         *
  ***************************************************************************/
 """
+import logging
 import os.path
 
 from PyQt5.QtCore import (
     QSettings,
+    QTimer,
     QTranslator,
     qVersion,
     QCoreApplication,
     Qt
 )
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QAction
+from PyQt5.QtWidgets import QAction, QFileDialog
 
-from qgis.core import QgsApplication
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
 
-from geosys.processing.geosys_processing_provider import (
-    GeosysProcessingProvider
-)
+from geosys.bridge_api.default import DEFAULT_SHOW_DOCK
+from geosys.utilities.load_report import CONSTRUCTION, LOAD_REPORT
 from geosys.utilities.resources import resources_path
+from geosys.utilities.settings import set_setting, setting
+
+LOGGER = logging.getLogger('geosys')
 
 
 class GeosysPlugin:
@@ -129,7 +133,8 @@ class GeosysPlugin:
         self.action_dock.setWhatsThis(self.tr(
             'Show/hide GEOSYS dock widget'))
         self.action_dock.setCheckable(True)
-        self.action_dock.setChecked(True)
+        # The dock is only created when it is first shown.
+        self.action_dock.setChecked(False)
         self.action_dock.triggered.connect(self.toggle_dock_visibility)
         self.add_action(self.action_dock)
 
@@ -146,20 +151,63 @@ class GeosysPlugin:
         self.action_options.triggered.connect(self.show_options)
         self.add_action(self.action_options, add_to_toolbar=False)
 
+    def _create_metrics_action(self):
+        """Create action to export the request metrics."""
+        icon = resources_path('img', 'icons', 'icon.png')
+        self.action_metrics = QAction(
+            QIcon(icon),
+            self.tr('Request Metrics'), self.iface.mainWindow())
+        self.action_metrics.setStatusTip(self.tr(
+            'Log and export the GEOSYS request metrics'))
+        self.action_metrics.setWhatsThis(self.tr(
+            'Log and export the GEOSYS request metrics'))
+        self.action_metrics.triggered.connect(self.export_metrics)
+        self.add_action(self.action_metrics, add_to_toolbar=False)
+
+    def _create_load_report_action(self):
+        """Create action to log the plugin load report."""
+        icon = resources_path('img', 'icons', 'icon.png')
+        self.action_load_report = QAction(
+            QIcon(icon),
+            self.tr('Load Report'), self.iface.mainWindow())
+        self.action_load_report.setStatusTip(self.tr(
+            'Log the time spent loading the GEOSYS plugin'))
+        self.action_load_report.setWhatsThis(self.tr(
+            'Log the time spent loading the GEOSYS plugin'))
+        self.action_load_report.triggered.connect(self.log_load_report)
+        self.add_action(self.action_load_report, add_to_toolbar=False)
+
     def _create_dock(self):
         """Create GEOSYS dock widget."""
-        if self.dock_widget is None:
-            # Create the dockwidget (after translation) and keep reference
-            from geosys.ui.widgets.geosys_dockwidget import (
-                GeosysPluginDockWidget)
-            self.dock_widget = GeosysPluginDockWidget(self.iface)
+        # Import here only so that the dock and the Bridge API client are
+        # loaded the first time the dock is shown, not when QGIS starts.
+        dock_module = LOAD_REPORT.import_module(
+            'geosys.ui.widgets.geosys_dockwidget')
+        with LOAD_REPORT.measure(CONSTRUCTION, 'GeosysPluginDockWidget'):
+            self.dock_widget = dock_module.GeosysPluginDockWidget(self.iface)
 
         # connect to provide cleanup on closing of dock widget
         self.dock_widget.closingPlugin.connect(self.onClosePlugin)
 
-        # show the dock widget
+        # Hook up a slot for when the dock is hidden using its close button
+        # or  view-panels
+        #
+        self.dock_widget.visibilityChanged.connect(self.toggle_geosys_action)
+
         self.iface.addDockWidget(Qt.RightDockWidgetArea, self.dock_widget)
-        self.dock_widget.show()
+
+    def show_dock(self):
+        """Show the dock widget, creating it on first use."""
+        if self.dock_widget is None:
+            self._create_dock()
+        self.plugin_active = True
+        self.dock_widget.setVisible(True)
+        self.dock_widget.raise_()
+
+    def _restore_dock(self):
+        """Show the dock if it was open when QGIS was last closed."""
+        if setting('show_dock', DEFAULT_SHOW_DOCK, expected_type=bool):
+            self.show_dock()
 
     def initProcessing(self):
         """Processing initialisation procedure (for QGIS plugin api).
@@ -169,9 +217,12 @@ class GeosysPlugin:
         default (i.e. before the user performs any explicit action with the
         plugin).
         """
-        self.provider = GeosysProcessingProvider()
-        QgsApplication.processingRegistry().addProvider(
-            self.provider)
+        provider_module = LOAD_REPORT.import_module(
+            'geosys.processing.geosys_processing_provider')
+        with LOAD_REPORT.measure(CONSTRUCTION, 'GeosysProcessingProvider'):
+            self.provider = provider_module.GeosysProcessingProvider()
+            QgsApplication.processingRegistry().addProvider(
+                self.provider)
 
     def initGui(self):
         """Gui initialisation procedure (for QGIS plugin api).
@@ -182,23 +233,25 @@ class GeosysPlugin:
         any graphical user interface elements that should appear in QGIS by
         default (i.e. before the user performs any explicit action with the
         plugin).
-        """
-
-        self._create_dock()
-        self._create_dock_toggle_action()
-        self._create_options_dialog_action()
 
-        # Hook up a slot for when the dock is hidden using its close button
-        # or  view-panels
-        #
-        self.dock_widget.visibilityChanged.connect(self.toggle_geosys_action)
-        # Also deal with the fact that on start of QGIS dock may already be
-        # hidden.
-        self.action_dock.setChecked(self.dock_widget.isVisible())
+        Only the actions and the processing provider are created here, the
+        dock is created the first time it is shown.
+        """
+        with LOAD_REPORT.measure(CONSTRUCTION, 'actions'):
+            self._create_dock_toggle_action()
+            self._create_options_dialog_action()
+            self._create_metrics_action()
+            self._create_load_report_action()
 
         # Add custom processing tools
         self.initProcessing()
 
+        # Reopen the dock once QGIS has finished starting.
+        QTimer.singleShot(0, self._restore_dock)
+
+        LOAD_REPORT.startup_finished()
+        LOGGER.debug(LOAD_REPORT.message())
+
     # ---------------------------------------------------------------------
 
     def onClosePlugin(self):
@@ -206,9 +259,6 @@ class GeosysPlugin:
 
         # print "** CLOSING GeosysPlugin"
 
-        # disconnects
-        self.dock_widget.closingPlugin.disconnect(self.onClosePlugin)
-
         # remove this statement if dock widget is to remain
         # for reuse if plugin is reopened
         # Commented next statement since it causes QGIS crashes
@@ -236,26 +286,8 @@ class GeosysPlugin:
         """Run method that loads and starts the plugin"""
 
         if not self.plugin_active:
-            self.plugin_active = True
-
             # print "** STARTING GeosysPlugin"
-
-            # dock widget may not exist if:
-            #    first run of plugin
-            #    removed on close (see self.onClosePlugin method)
-            if self.dock_widget is None:
-                # Create the dock widget (after translation) and keep reference
-                from geosys.ui.widgets.geosys_dockwidget import (
-                    GeosysPluginDockWidget)
-                self.dock_widget = GeosysPluginDockWidget()
-
-            # connect to provide cleanup on closing of dock widget
-            self.dock_widget.closingPlugin.connect(self.onClosePlugin)
-
-            # show the dock widget
-            # TODO: fix to allow choice of dock location
-            self.iface.addDockWidget(Qt.RightDockWidgetArea, self.dock_widget)
-            self.dock_widget.show()
+            self.show_dock()
 
     def toggle_geosys_action(self, checked):
         """Check or un-check the toggle GEOSYS toolbar button.
@@ -267,28 +299,58 @@ class GeosysPlugin:
         :type checked: bool
         """
         self.action_dock.setChecked(checked)
+        # A dock tabbed behind another panel is not visible but still open.
+        set_setting('show_dock', not self.dock_widget.isHidden())
 
     def toggle_dock_visibility(self):
         """Show or hide the dock widget."""
-        if self.dock_widget.isVisible():
+        if self.dock_widget is not None and self.dock_widget.isVisible():
             self.dock_widget.setVisible(False)
         else:
-            self.dock_widget.setVisible(True)
-            self.dock_widget.raise_()
+            self.show_dock()
 
     def populate_map_products(self):
         """Obtain a list of map products from Bridge API definition.
         If the US zone has been selected the soil option will be included, otherwise excluded.
         """
-        self.dock_widget.populate_map_products()
+        if self.dock_widget is not None:
+            self.dock_widget.populate_map_products()
 
     def show_options(self):
         """Show the options dialog."""
         # import here only so that it is AFTER i18n set up
-        from geosys.ui.widgets.options_dialog import GeosysOptionsDialog
+        options_module = LOAD_REPORT.import_module(
+            'geosys.ui.widgets.options_dialog')
 
-        dialog = GeosysOptionsDialog(
-            self.iface, parent=self.iface.mainWindow())
+        with LOAD_REPORT.measure(CONSTRUCTION, 'GeosysOptionsDialog'):
+            dialog = options_module.GeosysOptionsDialog(
+                self.iface, parent=self.iface.mainWindow())
         if dialog.exec_():  # modal
             self.populate_map_products()  # Repopulates the maptypes combobox if the user clicked OK
             pass
+
+    def export_metrics(self):
+        """Log the request metrics and save them to a CSV or JSON file."""
+        from geosys.bridge_api.metrics import METRICS
+        from geosys.utilities.qgis import log_request_metrics
+
+        log_request_metrics()
+        path, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(),
+            self.tr('Export request metrics'),
+            'geosys_metrics.csv',
+            self.tr('CSV (*.csv);;JSON (*.json)'))
+        if not path:
+            return
+        METRICS.dump(path)
+        self.iface.messageBar().pushSuccess(
+            self.tr('Request metrics'),
+            self.tr('Request metrics saved to {}').format(path))
+
+    def log_load_report(self):
+        """Log the plugin load report to the GEOSYS message log."""
+        QgsMessageLog.logMessage(
+            LOAD_REPORT.message(), 'GEOSYS', Qgis.Info)
+        self.iface.messageBar().pushInfo(
+            self.tr('Load report'),
+            self.tr('The load report is in the GEOSYS message log.'))
@@ -22,17 +22,23 @@
  ***************************************************************************/
 """
 import os
-import tempfile
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from PyQt5.QtCore import QCoreApplication, QDate, QSettings
 from PyQt5.QtWidgets import QDateEdit
 from processing.gui.wrappers import WidgetWrapper
 from qgis.core import (
+    NULL,
     QgsProcessing,
     QgsFeatureSink,
     QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterBoolean,
     QgsProcessingParameterFeatureSource,
     QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFolderDestination,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterEnum,
     QgsProcessingParameterString,
@@ -42,15 +48,9 @@ from qgis.core import (
 from geosys.bridge_api.default import (
     ZIPPED_TIFF_KEY, TIFF_EXT, MAPS_TYPE, IMAGE_SENSOR, IMAGE_DATE, MAP_LIMIT,
     ZIPPED_TIFF, YIELD_AVERAGE, YIELD_MINIMUM, YIELD_MAXIMUM, ORGANIC_AVERAGE,
-    SAMZ_ZONE)
+    SAMZ_ZONE, DEFAULT_MAP_CREATION_JOBS, DEFAULT_N_PLANNED, VRT_EXT, CSV_EXT)
 from geosys.bridge_api.definitions import ARCHIVE_MAP_PRODUCTS, SENSORS, \
     ALL_SENSORS
-from geosys.bridge_api_wrapper import BridgeAPI
-from geosys.ui.widgets.geosys_coverage_downloader import (
-    credentials_parameters_from_settings, create_map)
-from geosys.utilities.downloader import fetch_data, extract_zip
-from geosys.utilities.gui_utilities import reproject
-from geosys.utilities.qgis_settings import QGISSettings
 from geosys.utilities.settings import setting
 
 __copyright__ = "Copyright 2019, Kartoza"
@@ -100,6 +100,15 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
     MAP_PRODUCT = 'MAP_PRODUCT'
     SENSOR = 'SENSOR'
     OUTPUT = 'OUTPUT'
+    PER_FEATURE = 'PER_FEATURE'
+    FEATURE_KEY = 'FEATURE_KEY'
+    WORKERS = 'WORKERS'
+    OUTPUT_DIRECTORY = 'OUTPUT_DIRECTORY'
+    TIME_SERIES = 'TIME_SERIES'
+    START_DATE = 'START_DATE'
+    STACK_FORMAT = 'STACK_FORMAT'
+
+    STACK_FORMAT_OPTIONS = [VRT_EXT, TIFF_EXT]
 
     SENSOR_OPTIONS = [ALL_SENSORS] + SENSORS
 
@@ -200,36 +209,76 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
             ), createOutput=True
         )
 
-    def processAlgorithm(self, parameters, context, feedback):
-        """Here is where the processing itself takes place.
-        """
-        # Retrieve the feature source.
-        source = self.parameterAsSource(parameters, self.INPUT, context)
+        # Batch mode, a coverage search and a map for each feature.
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.PER_FEATURE,
+                self.tr('Create one map per feature'),
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.FEATURE_KEY,
+                self.tr('Feature attribute naming the maps'),
+                parentLayerParameterName=self.INPUT,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.WORKERS,
+                self.tr('Number of concurrent requests'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=DEFAULT_MAP_CREATION_JOBS
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_DIRECTORY,
+                self.tr('Output directory of the maps per feature'),
+                optional=True
+            )
+        )
 
-        # Reproject layer to EPSG:4326
-        if source.sourceCrs().authid() != 'EPSG:4326':
-            source = reproject(
-                source, QgsCoordinateReferenceSystem('EPSG:4326'))
+        # Time series mode, every map of each feature between the start
+        # date and the coverage date, stacked by date.
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.TIME_SERIES,
+                self.tr('Download every map since the start date'),
+                defaultValue=False
+            )
+        )
+        start_date_param = QgsProcessingParameterString(
+            self.START_DATE, self.tr('Start date'), optional=True)
+        start_date_param.setMetadata({
+            'widget_wrapper': {
+                'class': DateWidgetWrapper
+            }
+        })
+        self.addParameter(start_date_param)
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.STACK_FORMAT,
+                self.tr('Time series stack format'),
+                options=self.STACK_FORMAT_OPTIONS,
+                defaultValue=0
+            )
+        )
 
-        # Handle multi features
-        # Merge features into multi-part polygon
-        # TODO use Collect Geometries processing algorithm
-        geom = None
-        for index, feature in enumerate(source.getFeatures()):
-            if not feature.hasGeometry() or not (
-                    feature.geometry().isGeosValid()):
-                continue
-            if not geom:
-                geom = feature.geometry()
-            else:
-                geom = geom.combine(feature.geometry())
+    def coverage_filters(self, parameters, context, time_series=False):
+        """Coverage search filters of the algorithm parameters.
 
-        if geom:
-            geom_wkt = geom.asWkt()
-        else:
-            # geometry is not valid
-            return False, 'Geometry is not valid.'
+        :param time_series: Search every map since the start date instead
+            of the most recent one.
+        :type time_series: bool
 
+        :return: Filters of the most recent map before the coverage date,
+            or of every map between the start date and the coverage date.
+        :rtype: dict
+        """
         # Retrieve the coverage date.
         coverage_date = self.parameterAsString(
             parameters, self.COVERAGE_DATE, context)
@@ -245,23 +294,91 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
         if sensor_type == ALL_SENSORS['key']:
             sensor_type = None
 
-        # Retrieve output layer destination.
-        self.output_destination = self.parameterAsOutputLayer(
-            parameters, self.OUTPUT, context)
-
-        filters = {
-            MAPS_TYPE: map_product,
-            IMAGE_DATE: '$lte:{}'.format(coverage_date),
-            MAP_LIMIT: 1  # only get the recent one
-        }
+        if time_series:
+            start_date = self.parameterAsString(
+                parameters, self.START_DATE, context)
+            # Without a limit, every page of results is fetched.
+            filters = {
+                MAPS_TYPE: map_product,
+                IMAGE_DATE: '$between:{}|{}'.format(
+                    start_date, coverage_date) if start_date else (
+                    '$lte:{}'.format(coverage_date))
+            }
+        else:
+            filters = {
+                MAPS_TYPE: map_product,
+                IMAGE_DATE: '$lte:{}'.format(coverage_date),
+                MAP_LIMIT: 1  # only get the recent one
+            }
         sensor_type and filters.update({
             IMAGE_SENSOR: sensor_type
         })
+        return filters
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """Here is where the processing itself takes place.
+        """
+        # The Bridge API client is imported when the algorithm runs, the
+        # provider is registered when QGIS starts.
+        from geosys.bridge_api_wrapper import BridgeAPI
+        from geosys.ui.widgets.geosys_coverage_downloader import (
+            credentials_parameters_from_settings)
+        from geosys.utilities.gui_utilities import (
+            geometry_request, merge_geometries)
+        from geosys.utilities.payload import (
+            optimize_geometries_from_settings)
+        from geosys.utilities.qgis import (
+            configure_coverage_cache, configure_retry_policy)
+        from geosys.utilities.qgis_settings import QGISSettings
 
-        # Start coverage search
+        # Retrieve the feature source.
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+
+        # Repeated searches are served from the coverage cache and
+        # transient failures are retried. A single authenticated client is
+        # shared by every search and download.
+        configure_coverage_cache()
+        configure_retry_policy()
         bridge_api = BridgeAPI(
             *credentials_parameters_from_settings(),
             proxies=QGISSettings.get_qgis_proxy())
+
+        # Time series are created per feature.
+        per_feature = self.parameterAsBool(
+            parameters, self.PER_FEATURE, context)
+        time_series = self.parameterAsBool(
+            parameters, self.TIME_SERIES, context)
+        if per_feature or time_series:
+            return self.process_features(
+                source, parameters, context, feedback, bridge_api)
+
+        # Geometries are reprojected to EPSG:4326 while they are read.
+        request = geometry_request(
+            QgsCoordinateReferenceSystem('EPSG:4326'),
+            transform_context=context.transformContext())
+
+        # Handle multi features
+        # Merge features into multi-part polygon
+        geom = merge_geometries([
+            feature.geometry() for feature in source.getFeatures(request)
+            if feature.hasGeometry()])
+
+        if geom:
+            # Send the smallest geometry giving the same coverage answer.
+            (geom_wkt,), payload_report = optimize_geometries_from_settings(
+                [geom])
+            feedback.pushInfo(payload_report.message())
+        else:
+            # geometry is not valid
+            return False, 'Geometry is not valid.'
+
+        filters = self.coverage_filters(parameters, context)
+
+        # Retrieve output layer destination.
+        self.output_destination = self.parameterAsOutputLayer(
+            parameters, self.OUTPUT, context)
+
+        # Start coverage search.
         results = bridge_api.get_coverage(
             geom_wkt, self.crop_type, self.sowing_date,
             filters=filters)
@@ -284,7 +401,8 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
                         index+1, len(results)))
                 feedback.setProgressText(progress_text)
 
-                downloaded_path, message = self.download_map(result)
+                downloaded_path, message = self.download_map(
+                    result, self.output_destination, bridge_api)
 
                 feedback.pushInfo(downloaded_path)
                 feedback.setProgress(int((index+1) * total))
@@ -297,7 +415,264 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
             'message': message
         }
 
-    def download_map(self, coverage_map_json):
+    def process_features(
+            self, source, parameters, context, feedback, bridge_api):
+        """Search the coverage and create a map of each feature.
+
+        Features are searched concurrently, and the map of a feature is
+        downloaded as soon as its search is done, while the other searches
+        go on. A failed feature does not stop the others.
+
+        In time series mode, every map of a feature is downloaded in a
+        folder named after the feature. The maps are then stacked by date
+        in a VRT or GeoTIFF per feature and listed in a manifest.
+
+        :param source: Coverage features.
+        :type source: QgsProcessingFeatureSource
+
+        :param bridge_api: Authenticated client shared by the workers.
+        :type bridge_api: BridgeAPI
+
+        :return: Output directory, maps (or stacks) by feature key and
+            failures.
+        :rtype: dict
+        """
+        from geosys.utilities.gui_utilities import (
+            geometry_request, merge_geometries)
+        from geosys.utilities.payload import (
+            optimize_geometries_from_settings)
+        from geosys.utilities.utilities import check_if_file_exists
+
+        time_series = self.parameterAsBool(
+            parameters, self.TIME_SERIES, context)
+        filters = self.coverage_filters(parameters, context, time_series)
+        workers = self.parameterAsInt(parameters, self.WORKERS, context)
+        output_dir = self.parameterAsString(
+            parameters, self.OUTPUT_DIRECTORY, context) or self.output_dir
+        if not output_dir:
+            raise QgsProcessingException(self.tr(
+                'An output directory is required to create a map per '
+                'feature.'))
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        key_field = self.parameterAsString(
+            parameters, self.FEATURE_KEY, context)
+        key_index = source.fields().lookupField(key_field) if (
+            key_field) else -1
+
+        # Geometries are reprojected to EPSG:4326 while they are read.
+        request = geometry_request(
+            QgsCoordinateReferenceSystem('EPSG:4326'),
+            transform_context=context.transformContext(),
+            attributes=[key_index] if key_index >= 0 else None)
+
+        keys = []
+        geometries = []
+        reserved = set()
+        for feature in source.getFeatures(request):
+            if feedback.isCanceled():
+                return {self.OUTPUT_DIRECTORY: output_dir}
+            geometry = merge_geometries([feature.geometry()]) if (
+                feature.hasGeometry()) else None
+            if not geometry:
+                feedback.reportError(self.tr(
+                    'Feature {} has no valid geometry, skipped.').format(
+                    feature.id()))
+                continue
+            value = feature.attribute(key_index) if key_index >= 0 else None
+            if value in (None, NULL, ''):
+                value = feature.id()
+            # Keys name the maps, features sharing a value are numbered.
+            key = check_if_file_exists(
+                output_dir, map_file_name(value), TIFF_EXT,
+                reserved=reserved)
+            reserved.add(key)
+            keys.append(key)
+            geometries.append(geometry)
+
+        if not keys:
+            raise QgsProcessingException(
+                self.tr('None of the features has a valid geometry.'))
+
+        # Send the smallest geometries giving the same coverage answer.
+        wkt_geometries, payload_report = optimize_geometries_from_settings(
+            geometries)
+        feedback.pushInfo(payload_report.message())
+
+        # A search per feature and a download per map. The number of maps
+        # of a time series is known once its search is done. Searches and
+        # downloads share a pool of the run, so the run never has more
+        # than WORKERS requests in flight and leaves the pools of the
+        # dock alone.
+        steps = len(keys)
+        done = 0
+        maps = {}
+        failures = {}
+        downloads = {}
+        series = {}
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='geosys-processing')
+        try:
+            coverage_results = bridge_api.iter_coverage(
+                wkt_geometries,
+                self.crop_type,
+                self.sowing_date,
+                filters=filters,
+                max_workers=workers,
+                should_stop=feedback.isCanceled,
+                executor=executor)
+            for index, results, error in coverage_results:
+                key = keys[index]
+                done += 1
+                if error or not results:
+                    # No map to download for this feature.
+                    failures[key] = str(error) if error else self.tr(
+                        'No coverage result available based on given '
+                        'parameters')
+                    feedback.reportError('{}: {}'.format(
+                        key, failures[key]))
+                elif time_series:
+                    field_dir = os.path.join(output_dir, key)
+                    if not os.path.exists(field_dir):
+                        os.makedirs(field_dir)
+                    # Images of the same date are numbered.
+                    names = set()
+                    for result in results:
+                        name = check_if_file_exists(
+                            field_dir,
+                            '{}_{}'.format(key, result['image']['date']),
+                            TIFF_EXT,
+                            reserved=names)
+                        names.add(name)
+                        destination = os.path.join(
+                            field_dir, name + TIFF_EXT)
+                        downloads[executor.submit(
+                            self.download_map, result, destination,
+                            bridge_api)] = (key, result)
+                    steps += len(results)
+                else:
+                    destination = os.path.join(output_dir, key + TIFF_EXT)
+                    downloads[executor.submit(
+                        self.download_map, results[0], destination,
+                        bridge_api)] = (key, results[0])
+                    steps += 1
+                feedback.setProgress(int(100 * done / steps))
+
+            for future in as_completed(downloads):
+                if feedback.isCanceled():
+                    for pending in downloads:
+                        pending.cancel()
+                    break
+                key, result = downloads[future]
+                done += 1
+                try:
+                    path, message = future.result()
+                except Exception as e:
+                    path, message = None, '{}: {}'.format(
+                        type(e).__name__, e)
+                if not (path and os.path.exists(path)):
+                    path = None
+                    if time_series:
+                        # A failed image does not fail its time series.
+                        message = '{} {}'.format(
+                            result['image']['date'], message)
+                    else:
+                        failures[key] = message
+                    feedback.reportError('{}: {}'.format(key, message))
+                elif time_series:
+                    feedback.pushInfo('{}: {}'.format(key, path))
+                else:
+                    maps[key] = path
+                    feedback.pushInfo('{}: {}'.format(key, path))
+                if time_series:
+                    series.setdefault(key, []).append(
+                        (result, path, message))
+                feedback.setProgressText(self.tr(
+                    '{} of {} maps downloaded').format(
+                    done - len(keys), steps - len(keys)))
+                feedback.setProgress(int(100 * done / steps))
+        finally:
+            executor.shutdown(wait=True)
+
+        if time_series and not feedback.isCanceled():
+            stack_format = self.STACK_FORMAT_OPTIONS[self.parameterAsEnum(
+                parameters, self.STACK_FORMAT, context)]
+            maps, manifest_path = self.stack_time_series(
+                series, output_dir, stack_format, failures, feedback)
+            feedback.pushInfo(self.tr('Manifest: {}').format(manifest_path))
+
+        return {
+            self.OUTPUT_DIRECTORY: output_dir,
+            'MAPS': maps,
+            'FAILURES': failures,
+            'message': self.tr(
+                '{} of {} maps created in {}').format(
+                len(maps), len(keys), output_dir)
+        }
+
+    def stack_time_series(
+            self, series, output_dir, stack_format, failures, feedback):
+        """Stack the maps of each feature by date and write the manifest.
+
+        :param series: (coverage result, path, message) of every map by
+            feature key, path is None when the download failed.
+        :type series: dict
+
+        :param output_dir: Output directory.
+        :type output_dir: str
+
+        :param stack_format: Extension of the stacks, .vrt or .tif.
+        :type stack_format: str
+
+        :param failures: Failures by feature key, updated with the stacks
+            which can not be created.
+        :type failures: dict
+
+        :return: Tuple of the stacks by feature key and the manifest path.
+        :rtype: (dict, str)
+        """
+        from geosys.utilities.time_series import build_stack, write_manifest
+        from geosys.utilities.utilities import check_if_file_exists
+
+        stacks = {}
+        rows = []
+        for key in sorted(series):
+            items = sorted(
+                series[key], key=lambda item: item[0]['image']['date'])
+            downloaded = [item for item in items if item[1]]
+            if downloaded:
+                try:
+                    stacks[key] = build_stack(
+                        [path for _, path, _ in downloaded],
+                        [result['image']['date']
+                         for result, _, _ in downloaded],
+                        os.path.join(output_dir, key + stack_format))
+                    feedback.pushInfo('{}: {} dates in {}'.format(
+                        key, len(downloaded), stacks[key]))
+                except IOError as e:
+                    failures[key] = str(e)
+                    feedback.reportError('{}: {}'.format(key, e))
+            band = 0
+            for result, path, message in items:
+                if path:
+                    band += 1
+                rows.append({
+                    'field': key,
+                    'date': result['image']['date'],
+                    'image_id': result['image'].get('id', ''),
+                    'sensor': result['image'].get('sensor', ''),
+                    'band': band if path and key in stacks else '',
+                    'path': path or '',
+                    'status': 'downloaded' if path else message
+                })
+
+        manifest_name = check_if_file_exists(output_dir, 'manifest', CSV_EXT)
+        manifest_path = os.path.join(output_dir, manifest_name + CSV_EXT)
+        write_manifest(manifest_path, rows)
+        return stacks, manifest_path
+
+    def download_map(self, coverage_map_json, destination, bridge_api):
         """Download map directly from the coverage search result.
 
         :param coverage_map_json: Result of single map coverage.
@@ -330,10 +705,20 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
                 "coverageType": "CLEAR"
             }
         :type coverage_map_json: dict
+
+        :param destination: Path of the map.
+        :type destination: str
+
+        :param bridge_api: Authenticated client, it can be shared by
+            concurrent downloads.
+        :type bridge_api: BridgeAPI
+
+        :return: Tuple of the map path and a message.
+        :rtype: (str, str)
         """
-        bridge_api = BridgeAPI(
-            *credentials_parameters_from_settings(),
-            proxies=QGISSettings.get_qgis_proxy())
+        from geosys.ui.widgets.geosys_coverage_downloader import create_map
+        from geosys.utilities.downloader import (
+            fetch_data, extract_zip, ScratchWorkspace)
 
         # Get the requested map format. For now, use Raster (.tiff)
         map_format = ZIPPED_TIFF_KEY
@@ -347,10 +732,13 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
 
         if url:
             # Download zipped map and extract it in requested format.
-            zip_path = tempfile.mktemp('{}.zip'.format(map_extension))
-
-            fetch_data(url, zip_path, headers=bridge_api.headers)
-            extract_zip(zip_path, self.output_destination)
+            with ScratchWorkspace() as workspace:
+                suffix = '{}.zip'.format(map_extension)
+                zip_path = workspace.file_path(url, suffix)
+                fetch_data(
+                    url, zip_path, headers=bridge_api.headers,
+                    partial_path=workspace.partial_path(url, suffix))
+                extract_zip(zip_path, destination, atomic=True)
         else:
             # download map using get field map request
             settings = QSettings()
@@ -368,11 +756,32 @@ class MapCoverageDownloader(QgsProcessingAlgorithm):
                     SAMZ_ZONE, expected_type=int, qsettings=settings),
             }
             is_success, message = create_map(
-                coverage_map_json,
-                os.path.dirname(self.output_destination),
-                os.path.basename(self.output_destination),
-                ZIPPED_TIFF, data)
+                map_specification=dict(coverage_map_json),
+                output_dir=os.path.dirname(destination),
+                filename=os.path.splitext(os.path.basename(destination))[0],
+                output_map_format=ZIPPED_TIFF,
+                n_planned_value=DEFAULT_N_PLANNED,
+                yield_val=data[YIELD_AVERAGE],
+                min_yield_val=data[YIELD_MINIMUM],
+                max_yield_val=data[YIELD_MAXIMUM],
+                data=data,
+                bridge_api=bridge_api,
+                # The algorithm output is always the extracted map.
+                open_in_place=False)
             if not is_success:
                 message = self.tr('Error creating map. {}').format(message)
 
-        return self.output_destination, message
+        return destination, message
+
+
+def map_file_name(value):
+    """File name of the map of a feature, from its key attribute.
+
+    :param value: Value of the key attribute, or the feature id.
+    :type value: str, int
+
+    :return: The value with the characters not allowed in file names
+        replaced.
+    :rtype: str
+    """
+    return re.sub(r'[^\w.-]+', '_', str(value)).strip('._') or '_'
@@ -0,0 +1,151 @@
+# coding=utf-8
+"""Downloader utilities test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from geosys.bridge_api.transport import (
+    Cassette, RecordingTransport, ReplayTransport, set_transport)
+from geosys.utilities.downloader import (
+    ScratchWorkspace, extract_zip, fetch_data, fetch_group)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class DownloaderTest(unittest.TestCase):
+    """Test zip extraction and the scratch workspace."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_extract_zip(self):
+        """Test every member is extracted next to the base path."""
+        zip_path = os.path.join(self.directory, 'map.zip')
+        with zipfile.ZipFile(zip_path, 'w') as zip_file:
+            zip_file.writestr('a.shp', b'shp' * 1000)
+            zip_file.writestr('a.dbf', b'dbf')
+        base_path = os.path.join(self.directory, 'field')
+
+        extract_zip(zip_path, base_path, atomic=True)
+
+        with open(base_path + '.shp', 'rb') as shp_file:
+            self.assertEqual(shp_file.read(), b'shp' * 1000)
+        self.assertTrue(os.path.exists(base_path + '.dbf'))
+        self.assertFalse(os.path.exists(base_path + '.shp.part'))
+
+    def test_workspace_cleanup(self):
+        """Test workspace files are removed on success and on failure."""
+        workspace_dir = os.path.join(self.directory, 'scratch')
+        with ScratchWorkspace(workspace_dir) as workspace:
+            path = workspace.file_path('https://bridge/map', '.tif.zip')
+            with open(path, 'wb') as archive:
+                archive.write(b'zip')
+        self.assertFalse(os.path.exists(path))
+
+        with self.assertRaises(ValueError):
+            with ScratchWorkspace(workspace_dir) as workspace:
+                path = workspace.file_path('https://bridge/map', '.tif.zip')
+                with open(path, 'wb') as archive:
+                    archive.write(b'zip')
+                raise ValueError()
+        self.assertFalse(os.path.exists(path))
+
+    def test_workspace_paths(self):
+        """Test one workspace at a time downloads to a partial file."""
+        workspace_dir = os.path.join(self.directory, 'scratch')
+        url = 'https://bridge/map'
+        with ScratchWorkspace(workspace_dir) as first, \
+                ScratchWorkspace(workspace_dir) as second:
+            self.assertNotEqual(
+                first.file_path(url, '.tif.zip'),
+                second.file_path(url, '.tif.zip'))
+            shared_path = first.partial_path(url, '.tif.zip')
+            self.assertTrue(shared_path.endswith('.tif.zip.part'))
+            self.assertEqual(first.partial_path(url, '.tif.zip'), shared_path)
+            own_path = second.partial_path(url, '.tif.zip')
+            self.assertNotEqual(own_path, shared_path)
+            with open(own_path, 'wb') as partial_file:
+                partial_file.write(b'zip')
+        self.assertFalse(os.path.exists(own_path))
+
+        # Released once the first workspace is done, to be resumed.
+        with ScratchWorkspace(workspace_dir) as third:
+            self.assertEqual(third.partial_path(url, '.tif.zip'), shared_path)
+
+    def test_workspace_size_cap(self):
+        """Test the oldest files are removed over the size cap."""
+        workspace_dir = os.path.join(self.directory, 'scratch')
+        os.makedirs(workspace_dir)
+        for index, name in enumerate(['old.part', 'new.part']):
+            path = os.path.join(workspace_dir, name)
+            with open(path, 'wb') as part_file:
+                part_file.write(b'x' * 100)
+            os.utime(path, (index, index))
+
+        with ScratchWorkspace(workspace_dir, max_size=150):
+            pass
+        self.assertEqual(os.listdir(workspace_dir), ['new.part'])
+
+    def test_fetch_group(self):
+        """Test a group is downloaded entirely or not at all."""
+        source = os.path.join(self.directory, 'map.png')
+        with open(source, 'wb') as source_file:
+            source_file.write(b'png')
+        source_url = 'file://' + source
+        png_path = os.path.join(self.directory, 'out.png')
+        pgw_path = os.path.join(self.directory, 'out.pgw')
+
+        fetch_group([(source_url, png_path), (source_url, pgw_path)])
+        self.assertTrue(os.path.exists(png_path))
+        self.assertTrue(os.path.exists(pgw_path))
+        os.remove(png_path)
+        os.remove(pgw_path)
+
+        missing_url = 'file://' + os.path.join(self.directory, 'missing')
+        with self.assertRaises(Exception):
+            fetch_group([(source_url, png_path), (missing_url, pgw_path)])
+        self.assertFalse(os.path.exists(png_path))
+        self.assertFalse(os.path.exists(pgw_path))
+
+    def test_fetch_data_replay(self):
+        """Test a recorded download is replayed without its source."""
+        source = os.path.join(self.directory, 'map.tif')
+        with open(source, 'wb') as source_file:
+            source_file.write(b'tif' * 1000)
+        source_url = 'file://' + source
+        cassette = Cassette(os.path.join(self.directory, 'cassette'))
+        try:
+            set_transport(RecordingTransport(cassette))
+            fetch_data(source_url, os.path.join(self.directory, 'a.tif'))
+            os.remove(source)
+
+            set_transport(ReplayTransport(cassette))
+            output_path = os.path.join(self.directory, 'b.tif')
+            fetch_data(source_url, output_path)
+        finally:
+            set_transport(None)
+        with open(output_path, 'rb') as output_file:
+            self.assertEqual(output_file.read(), b'tif' * 1000)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DownloaderTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
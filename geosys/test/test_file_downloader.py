@@ -0,0 +1,287 @@
+# coding=utf-8
+"""File downloader test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qgis.PyQt.QtCore import QEventLoop
+from qgis.PyQt.QtWidgets import QProgressDialog
+
+from geosys.test.utilities import get_qgis_app
+from geosys.utilities.downloader import (
+    PARTIAL_EXT, STATE_EXT, FileDownloader, ScratchWorkspace, fetch_data)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+QGIS_APP = get_qgis_app()
+
+# Size of the chunks written by the server.
+CHUNK_SIZE = 64 * 1024
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """HTTP handler serving the server body in chunks.
+
+    Range requests are honoured unless their If-Range does not match the
+    server ETag, in which case the whole body is sent.
+
+    When the server has a stall_after size, the handler stops sending
+    after that many bytes until the server release event is set. When it
+    has a barrier, requests wait for each other before sending the body.
+    """
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        body = server.body
+        requested_range = self.headers.get('Range')
+        server.ranges.append(requested_range)
+        start = 0
+        if requested_range and self.headers.get('If-Range') in (
+                None, server.etag):
+            start = int(requested_range[len('bytes='):].rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%s' % len(body))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (
+                start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        if server.barrier:
+            server.barrier.wait(10)
+        for offset in range(start, len(body), CHUNK_SIZE):
+            if server.stall_after is not None and (
+                    offset >= server.stall_after):
+                server.release.wait(10)
+                return
+            self.wfile.write(body[offset:offset + CHUNK_SIZE])
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+class FileDownloaderTest(unittest.TestCase):
+    """Test files are downloaded from a local HTTP server."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.body = os.urandom(3 * 1024 * 1024)
+        self.server.etag = '"v1"'
+        self.server.ranges = []
+        self.server.stall_after = None
+        self.server.release = threading.Event()
+        self.server.barrier = None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/map.zip' % self.server.server_port
+        self.output_path = os.path.join(self.directory, 'map.zip')
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_streamed(self):
+        """Test the file is written chunk by chunk to a partial file."""
+        downloader = FileDownloader(self.url, self.output_path)
+        self.assertEqual(downloader.download(), (True, None))
+
+        self.assertEqual(downloader.bytes_received, len(self.server.body))
+        with open(self.output_path, 'rb') as output_file:
+            self.assertEqual(output_file.read(), self.server.body)
+        self.assertFalse(os.path.exists(self.output_path + PARTIAL_EXT))
+
+    def test_failure_cleaned_up(self):
+        """Test a failed download leaves no file behind."""
+        url = 'http://127.0.0.1:%s/missing' % self.server.server_port
+        downloader = FileDownloader(url, self.output_path)
+        result = downloader.download()
+
+        self.assertIsNot(result[0], True)
+        self.assertEqual(downloader.http_code, 404)
+        self.assertFalse(os.path.exists(self.output_path))
+        self.assertFalse(os.path.exists(self.output_path + PARTIAL_EXT))
+
+    def test_timeout(self):
+        """Test a stalled download is aborted after the timeout."""
+        self.server.stall_after = CHUNK_SIZE
+        downloader = FileDownloader(self.url, self.output_path)
+        result = downloader.download(timeout=0.5)
+
+        self.assertIsNot(result[0], True)
+        self.assertIn('timed out', result[1])
+        self.assertTrue(downloader.timed_out)
+        self.assertTrue(downloader.transient_failure)
+        self.assertFalse(os.path.exists(self.output_path))
+
+    def test_start(self):
+        """Test the callback gets the result of a download."""
+        loop = QEventLoop()
+        results = []
+
+        def finished(result):
+            results.append(result)
+            loop.quit()
+
+        FileDownloader(self.url, self.output_path).start(finished)
+        if not results:
+            loop.exec_()
+
+        self.assertEqual(results, [(True, None)])
+        self.assertEqual(
+            os.path.getsize(self.output_path), len(self.server.body))
+
+    def write_partial(self, data, etag):
+        """Leave a partial download of the url, as an interrupted one."""
+        partial_path = self.output_path + PARTIAL_EXT
+        with open(partial_path, 'wb') as partial_file:
+            partial_file.write(data)
+        with open(partial_path + STATE_EXT, 'w') as state_file:
+            json.dump({
+                'url': self.url,
+                'etag': etag,
+                'last_modified': None,
+                'size': len(self.server.body)
+            }, state_file)
+
+    def check_output(self):
+        """Check the whole body has been downloaded."""
+        with open(self.output_path, 'rb') as output_file:
+            self.assertEqual(output_file.read(), self.server.body)
+        self.assertFalse(os.path.exists(self.output_path + PARTIAL_EXT))
+        self.assertFalse(os.path.exists(
+            self.output_path + PARTIAL_EXT + STATE_EXT))
+
+    def test_resumed(self):
+        """Test a partial download continues from its last byte."""
+        offset = 1000000
+        self.write_partial(self.server.body[:offset], self.server.etag)
+        downloader = FileDownloader(self.url, self.output_path)
+        self.assertEqual(downloader.download(), (True, None))
+
+        self.assertEqual(self.server.ranges, ['bytes=%s-' % offset])
+        self.assertEqual(downloader.http_code, 206)
+        self.assertEqual(
+            downloader.bytes_received, len(self.server.body) - offset)
+        self.check_output()
+
+    def test_changed_file_restarted(self):
+        """Test the partial download of a changed file is discarded."""
+        self.write_partial(b'stale' * 1000, '"v0"')
+        downloader = FileDownloader(self.url, self.output_path)
+        self.assertEqual(downloader.download(), (True, None))
+
+        self.assertEqual(self.server.ranges, ['bytes=5000-'])
+        self.assertEqual(downloader.http_code, 200)
+        self.check_output()
+
+    def test_unsatisfiable_range_restarted(self):
+        """Test a partial download longer than the file starts over."""
+        self.write_partial(
+            self.server.body + b'extra', self.server.etag)
+        fetch_data(self.url, self.output_path)
+
+        self.assertEqual(
+            self.server.ranges,
+            ['bytes=%s-' % (len(self.server.body) + 5), None])
+        self.check_output()
+
+    def test_cancel_disconnected(self):
+        """Test finished attempts no longer listen to the cancel button."""
+        dialog = QProgressDialog()
+        receivers = dialog.receivers(dialog.canceled)
+        # The 416 answer makes fetch_data start a second attempt.
+        self.write_partial(
+            self.server.body + b'extra', self.server.etag)
+        fetch_data(self.url, self.output_path, progress_dialog=dialog)
+
+        self.assertEqual(len(self.server.ranges), 2)
+        self.assertEqual(dialog.receivers(dialog.canceled), receivers)
+        self.check_output()
+
+    def test_interrupted_kept(self):
+        """Test a timed out download keeps its partial file to resume."""
+        self.server.stall_after = CHUNK_SIZE
+        downloader = FileDownloader(self.url, self.output_path)
+        downloader.download(timeout=0.5)
+        self.assertTrue(downloader.can_resume)
+        self.assertEqual(
+            os.path.getsize(self.output_path + PARTIAL_EXT), CHUNK_SIZE)
+
+        self.server.release.set()
+        self.server.stall_after = None
+        self.assertEqual(
+            FileDownloader(self.url, self.output_path).download(),
+            (True, None))
+        self.assertEqual(
+            self.server.ranges, [None, 'bytes=%s-' % CHUNK_SIZE])
+        self.check_output()
+
+    def test_concurrent_workspaces(self):
+        """Test two jobs download the same url at the same time."""
+        self.server.barrier = threading.Barrier(2)
+        workspace_dir = os.path.join(self.directory, 'scratch')
+        partial_paths = {}
+        contents = {}
+
+        def job(name):
+            with ScratchWorkspace(workspace_dir) as workspace:
+                path = workspace.file_path(self.url, '.zip')
+                partial_paths[name] = workspace.partial_path(self.url, '.zip')
+                fetch_data(
+                    self.url, path, partial_path=partial_paths[name])
+                with open(path, 'rb') as output_file:
+                    contents[name] = output_file.read()
+
+        threads = [
+            threading.Thread(target=job, args=(name,))
+            for name in ('first', 'second')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+
+        self.assertNotEqual(partial_paths['first'], partial_paths['second'])
+        self.assertEqual(contents, {
+            'first': self.server.body,
+            'second': self.server.body
+        })
+        self.assertEqual(self.server.ranges, [None, None])
+        self.assertEqual(os.listdir(workspace_dir), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(FileDownloaderTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""GUI utilities test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import unittest
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsFeature, QgsGeometry, QgsPointXY,
+    QgsVectorLayer)
+
+from geosys.test.utilities import get_qgis_app
+from geosys.utilities.gui_utilities import geometry_request, merge_geometries
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+QGIS_APP = get_qgis_app()
+
+
+def square(x, y, size=1):
+    return QgsGeometry.fromWkt(
+        'POLYGON(({x} {y}, {x2} {y}, {x2} {y2}, {x} {y2}, {x} {y}))'.format(
+            x=x, y=y, x2=x + size, y2=y + size))
+
+
+class GuiUtilitiesTest(unittest.TestCase):
+    """Test the GUI utilities."""
+
+    def test_merge_geometries(self):
+        """Test features are merged into a single valid geometry."""
+        squares = [square(x, y) for x in range(10) for y in range(10)]
+        merged = merge_geometries(squares)
+        self.assertTrue(merged.isGeosValid())
+        self.assertAlmostEqual(merged.area(), 100)
+        self.assertTrue(merged.isGeosEqual(square(0, 0, 10)))
+
+        # A self-intersecting bow tie is repaired instead of failing.
+        bow_tie = QgsGeometry.fromWkt(
+            'POLYGON((20 0, 21 1, 21 0, 20 1, 20 0))')
+        merged = merge_geometries([square(0, 0), bow_tie])
+        self.assertTrue(merged.isGeosValid())
+        self.assertAlmostEqual(merged.area(), 1.5)
+
+        self.assertIsNone(merge_geometries([]))
+        self.assertIsNone(merge_geometries([QgsGeometry()]))
+
+    def test_geometry_request(self):
+        """Test only the requested geometries are read, reprojected."""
+        layer = QgsVectorLayer(
+            'Point?crs=EPSG:3857&field=name:string', 'fields', 'memory')
+        features = []
+        for index in range(5):
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(QgsGeometry.fromPointXY(
+                QgsPointXY(index * 100000, 0)))
+            feature.setAttributes(['field {}'.format(index)])
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        ids = [feature.id() for feature in layer.getFeatures()]
+
+        request = geometry_request(
+            QgsCoordinateReferenceSystem('EPSG:4326'), ids[1:3])
+        result = list(layer.getFeatures(request))
+
+        self.assertEqual([feature.id() for feature in result], ids[1:3])
+        point = result[1].geometry().asPoint()
+        self.assertAlmostEqual(point.x(), 1.796630568, places=6)
+        self.assertAlmostEqual(point.y(), 0)
+        self.assertIsNone(result[0].attribute('name'))
+
+        # Per-feature maps are named after a requested attribute.
+        request = geometry_request(
+            QgsCoordinateReferenceSystem('EPSG:4326'), ids[1:3],
+            attributes=[layer.fields().lookupField('name')])
+        self.assertEqual(
+            [feature.attribute('name')
+             for feature in layer.getFeatures(request)],
+            ['field 1', 'field 2'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(GuiUtilitiesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
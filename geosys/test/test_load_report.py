@@ -0,0 +1,77 @@
+# coding=utf-8
+"""Plugin load report test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+from geosys.utilities.load_report import CONSTRUCTION, IMPORT, LoadReport
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+ROOT = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), os.path.pardir, os.path.pardir))
+
+
+class LoadReportTest(unittest.TestCase):
+    """Test the plugin load report."""
+
+    def test_phases(self):
+        """Test steps are reported at startup and on first use."""
+        ticks = iter([0.0, 0.25, 1.0, 1.5])
+        report = LoadReport(clock=lambda: next(ticks))
+        with report.measure(CONSTRUCTION, 'actions'):
+            pass
+        report.startup_finished()
+        with report.measure(CONSTRUCTION, 'GeosysPluginDockWidget'):
+            pass
+
+        self.assertEqual(report.total('startup'), 0.25)
+        self.assertEqual(report.total('first use'), 0.5)
+        self.assertEqual(
+            [entry['phase'] for entry in report.entries],
+            ['startup', 'first use'])
+        self.assertIn('250.0 ms at startup', report.message())
+
+    def test_import_module(self):
+        """Test modules already imported are not reported."""
+        report = LoadReport()
+        self.assertIs(report.import_module('unittest'), unittest)
+        self.assertEqual(report.entries, [])
+
+        sys.modules.pop('colorsys', None)
+        report.import_module('colorsys')
+        self.assertEqual(report.entries[0]['kind'], IMPORT)
+        self.assertEqual(report.entries[0]['name'], 'colorsys')
+        self.assertGreaterEqual(report.entries[0]['modules'], 1)
+
+    def test_lazy_startup(self):
+        """Test the plugin startup does not import the dock or the client."""
+        code = (
+            'import sys\n'
+            'import geosys.plugin\n'
+            'import geosys.processing.geosys_processing_provider\n'
+            'print(sorted(name for name in (\n'
+            '    "geosys.bridge_api_wrapper",\n'
+            '    "geosys.ui.widgets.geosys_dockwidget",\n'
+            '    "geosys.ui.widgets.message_viewer",\n'
+            '    "requests") if name in sys.modules))\n')
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], cwd=ROOT)
+        self.assertEqual(output.decode('utf-8').strip(), '[]')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LoadReportTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""Map creation queue test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import unittest
+
+from geosys.ui.widgets.geosys_map_creation_queue import (
+    MapCreationJob, MapCreationQueue)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class DeferredTaskManager(object):
+    """Task manager which runs the tasks when asked to."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def addTask(self, task):
+        self.tasks.append(task)
+
+    def run_next(self):
+        task = self.tasks.pop(0)
+        task.finished(task.run())
+
+
+class MapCreationQueueTest(unittest.TestCase):
+    """Test the map creation job queue."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.task_manager = DeferredTaskManager()
+        self.queue = MapCreationQueue(
+            max_jobs=2, retries=1, task_manager=self.task_manager)
+        self.finished_jobs = []
+        self.summary = []
+        self.queue.job_finished.connect(self.finished_jobs.append)
+        self.queue.queue_finished.connect(
+            lambda succeeded, failed: self.summary.append(
+                (succeeded, failed)))
+
+    def test_bounded_parallelism(self):
+        """Test at most max_jobs tasks are started and failures are
+        retried without stopping the other jobs."""
+        calls = []
+
+        def create(label, created_layers):
+            calls.append(label)
+            if label == 'bad':
+                raise ValueError('no map')
+            created_layers.append(('/tmp/{}.shp'.format(label), label))
+            return True, 'created'
+
+        for name in ('a', 'bad', 'c'):
+            self.queue.add(MapCreationJob(name, name, create, label=name))
+        self.assertEqual(len(self.task_manager.tasks), 2)
+        self.assertEqual(self.queue.job_names(), {'a', 'bad', 'c'})
+
+        while self.task_manager.tasks:
+            self.task_manager.run_next()
+
+        self.assertEqual(calls, ['a', 'bad', 'bad', 'c'])
+        results = dict(
+            (job.name, job.is_success) for job in self.finished_jobs)
+        self.assertEqual(results, {'a': True, 'bad': False, 'c': True})
+        self.assertEqual(self.finished_jobs[0].created_layers,
+                         [('/tmp/a.shp', 'a')])
+        self.assertEqual(self.summary, [(2, 1)])
+        self.assertFalse(self.queue.is_running())
+
+    def test_cancel(self):
+        """Test cancelling drops the pending jobs."""
+        for name in ('a', 'b', 'c'):
+            self.queue.add(MapCreationJob(
+                name, name, lambda created_layers: (True, 'created')))
+        cancelled = []
+        self.queue.queue_finished.connect(
+            lambda succeeded, failed: cancelled.append(self.queue.cancelled))
+        self.queue.cancel()
+        while self.task_manager.tasks:
+            self.task_manager.run_next()
+
+        self.assertEqual(
+            [job.is_success for job in self.finished_jobs],
+            [False, False, False])
+        self.assertEqual(self.summary, [(0, 3)])
+        self.assertEqual(cancelled, [True])
+        self.assertFalse(self.queue.cancelled)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(MapCreationQueueTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
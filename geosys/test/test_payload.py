@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Coverage payload optimization test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import math
+import unittest
+
+from qgis.core import QgsGeometry, QgsPointXY
+
+from geosys.utilities.payload import optimize_geometries, optimize_geometry
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+def field_boundary(vertices=2000):
+    """A digitized field boundary, a circle of about 200 m in degrees."""
+    points = [
+        QgsPointXY(
+            -86.8670165338669 + 0.002 * math.cos(2 * math.pi * i / vertices),
+            41.3315327563574 + 0.002 * math.sin(2 * math.pi * i / vertices))
+        for i in range(vertices)]
+    return QgsGeometry.fromPolygonXY([points + points[:1]])
+
+
+class PayloadTest(unittest.TestCase):
+    """Test the coverage geometries optimization."""
+
+    def test_optimize_polygon(self):
+        """Test a complex boundary is reduced but keeps its shape."""
+        geometry = field_boundary()
+        wkt, simplified = optimize_geometry(geometry)
+        optimized = QgsGeometry.fromWkt(wkt)
+
+        self.assertTrue(simplified)
+        self.assertTrue(optimized.isGeosValid())
+        self.assertLess(len(wkt), len(geometry.asWkt()) / 4)
+        self.assertLess(
+            abs(optimized.area() - geometry.area()) / geometry.area(), 0.01)
+        self.assertTrue(optimized.buffer(0.00002, 8).contains(geometry))
+
+    def test_report(self):
+        """Test the saved bytes are reported."""
+        geometries = [field_boundary(), QgsGeometry.fromPointXY(
+            QgsPointXY(-86.867016533866943, 41.331532756357426))]
+        wkt_geometries, report = optimize_geometries(geometries)
+
+        self.assertEqual(wkt_geometries[1], 'Point (-86.867017 41.331533)')
+        self.assertEqual(report.geometries, 2)
+        self.assertEqual(report.simplified, 1)
+        self.assertEqual(
+            report.saved_bytes,
+            sum(len(geometry.asWkt()) for geometry in geometries) -
+            sum(len(wkt) for wkt in wkt_geometries))
+
+        wkt_geometries, report = optimize_geometries(
+            geometries, precision=-1)
+        self.assertEqual(wkt_geometries[0], geometries[0].asWkt())
+        self.assertEqual(report.saved_bytes, 0)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(PayloadTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,106 @@
+# coding=utf-8
+"""Time series stack test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from osgeo import gdal, osr
+
+from geosys.utilities.time_series import (
+    MANIFEST_FIELDS, build_stack, write_manifest)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+
+class TimeSeriesTest(unittest.TestCase):
+    """Test the date-indexed map collections."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.dates = ['2019-05-01', '2019-05-11', '2019-05-21']
+        self.paths = [
+            self.create_map(date, value)
+            for value, date in enumerate(self.dates, 1)]
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def create_map(self, date, value):
+        """Create a single band map filled with a value."""
+        path = os.path.join(self.directory, 'field_{}.tif'.format(date))
+        dataset = gdal.GetDriverByName('GTiff').Create(
+            path, 4, 4, 1, gdal.GDT_Float32)
+        dataset.SetGeoTransform([-86.87, 0.0001, 0, 41.33, 0, -0.0001])
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        dataset.SetProjection(srs.ExportToWkt())
+        dataset.GetRasterBand(1).Fill(value)
+        dataset = None
+        return path
+
+    def check_stack(self, path):
+        """Check a stack has a band per date, in date order."""
+        dataset = gdal.Open(path)
+        self.assertEqual(dataset.RasterCount, len(self.dates))
+        for band_number, date in enumerate(self.dates, 1):
+            band = dataset.GetRasterBand(band_number)
+            self.assertEqual(band.GetDescription(), date)
+            self.assertEqual(band.GetMetadataItem('DATE'), date)
+            self.assertEqual(band.ReadAsArray()[0][0], band_number)
+
+    def test_build_vrt(self):
+        """Test the maps are stacked in a VRT."""
+        path = build_stack(
+            self.paths, self.dates,
+            os.path.join(self.directory, 'field.vrt'))
+        self.check_stack(path)
+
+    def test_build_geotiff(self):
+        """Test the maps are stacked in a GeoTIFF."""
+        path = build_stack(
+            self.paths, self.dates,
+            os.path.join(self.directory, 'field.tif'))
+        for map_path in self.paths:
+            os.remove(map_path)
+        self.check_stack(path)
+
+    def test_write_manifest(self):
+        """Test the manifest lists the maps."""
+        path = os.path.join(self.directory, 'manifest.csv')
+        rows = [{
+            'field': 'field',
+            'date': date,
+            'image_id': 'image {}'.format(band),
+            'sensor': 'SENTINEL_2',
+            'band': band,
+            'path': map_path,
+            'status': 'downloaded'
+        } for band, (date, map_path) in enumerate(
+            zip(self.dates, self.paths), 1)]
+        write_manifest(path, rows)
+
+        with open(path) as manifest:
+            reader = csv.DictReader(manifest)
+            self.assertEqual(reader.fieldnames, MANIFEST_FIELDS)
+            self.assertEqual(
+                [row['date'] for row in reader], self.dates)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TimeSeriesTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
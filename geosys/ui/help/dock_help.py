@@ -68,14 +68,17 @@ def content():
     ))
     message.add(paragraph)
 
-    paragraph = m.Paragraph(tr(
+    paragraph_text = tr(
         'Choose a polygon layer with one or more polygons representing '
         'the area or areas you are interested in for retrieving '
         'the sensor data. If you have a selection on that layer, '
-        'only the selected polygons will be used. If you have more than '
-        '{max_features} polygons, only the first {max_features} polygons '
-        'will be processed.'
-    ).format(max_features=MAX_FEATURE_NUMBERS))
+        'only the selected polygons will be used.')
+    if MAX_FEATURE_NUMBERS:
+        paragraph_text += ' ' + tr(
+            'If you have more than {max_features} polygons, only the first '
+            '{max_features} polygons will be processed.'
+        ).format(max_features=MAX_FEATURE_NUMBERS)
+    paragraph = m.Paragraph(paragraph_text)
     message.add(paragraph)
 
     paragraph = m.Paragraph(
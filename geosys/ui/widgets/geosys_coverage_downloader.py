@@ -1,9 +1,12 @@
 # coding=utf-8
 """Implementation of custom GEOSYS coverage downloader.
 """
+import itertools
+import logging
 import os
 import sys
-import tempfile
+from concurrent.futures import wait
+from functools import partial
 
 from PyQt5.QtCore import QThread, pyqtSignal, QByteArray, QSettings, QDate
 
@@ -19,38 +22,36 @@ from geosys.bridge_api.default import (
     PGW2,
     LEGEND,
     SHP_EXT,
+    ZIP_EXT,
     BRIDGE_URLS,
     NDVI_THUMBNAIL_URL,
-    NITROGEN_THUMBNAIL_URL,
-    S2REP_THUMBNAIL_URL,
-    CVIN_THUMBNAIL_URL,
-    YGM_THUMBNAIL_URL,
-    YPM_THUMBNAIL_URL,
-    SAMZ_THUMBNAIL_URL,
-    SAMPLEMAP_THUMBNAIL_URL
+    DEFAULT_THUMBNAIL_WORKERS,
+    DEFAULT_COVERAGE_WORKERS,
+    DEFAULT_COVERAGE_PAGE_SIZE,
+    DEFAULT_COVERAGE_REQUESTS_PER_SECOND
 )
+from geosys.bridge_api.concurrency import shared_executor
 from geosys.bridge_api.definitions import (
     SAMZ,
     ELEVATION,
     COLOR_COMPOSITION,
-    INSEASON_S2REP,
     REFLECTANCE,
     INSEASON_NDVI,
     SOIL,
-    INSEASONFIELD_AVERAGE_NDVI,
-    INSEASONFIELD_AVERAGE_LAI,
-    INSEASONFIELD_AVERAGE_REVERSE_NDVI,
-    INSEASONFIELD_AVERAGE_REVERSE_LAI,
-    INSEASON_CVIN,
-    YGM,
-    YVM,
     SAMPLE_MAP
 )
+from geosys.bridge_api.registry import (
+    CATALOG_IMAGERY_MAP_KEYS, THUMBNAIL_URL_TEMPLATES)
 from geosys.bridge_api_wrapper import BridgeAPI
-from geosys.utilities.downloader import fetch_data, extract_zip
+from geosys.utilities.downloader import (
+    fetch_data, fetch_group, extract_zip, ScratchWorkspace)
+from geosys.utilities.qgis import (
+    configure_coverage_cache, configure_retry_policy,
+    configure_thumbnail_store)
 from geosys.utilities.qgis_settings import QGISSettings
 from geosys.utilities.settings import setting
 from geosys.utilities.gui_utilities import create_hotspot_layer
+from geosys.utilities.thumbnail_cache import THUMBNAIL_STORE
 from geosys.utilities.utilities import check_if_file_exists
 
 __copyright__ = "Copyright 2019, Kartoza"
@@ -58,8 +59,14 @@ __license__ = "GPL version 3"
 __email__ = "rohmat@kartoza.com"
 __revision__ = "$Format:%H$"
 
+LOGGER = logging.getLogger('geosys')
+
 settings = QSettings()
 
+# Identifies each coverage search, so late signals of a previous search
+# can be told apart from the current one.
+_SEARCH_IDS = itertools.count(1)
+
 
 class CoverageSearchThread(QThread):
     """Thread object wrapper for coverage search."""
@@ -67,12 +74,14 @@ class CoverageSearchThread(QThread):
     search_started = pyqtSignal()
     search_finished = pyqtSignal()
     data_downloaded = pyqtSignal(object, QByteArray)
+    thumbnail_downloaded = pyqtSignal(int, int, str)
+    geometry_failed = pyqtSignal(int, object)
     error_occurred = pyqtSignal(object)
 
     def __init__(
             self, geometries, crop_type, sowing_date, map_product, sensor_type,
             weather_type, start_date, end_date, geometries_points, attributes_points, attribute_field,
-            mutex, n_planned_value=1.0, parent=None):
+            mutex, n_planned_value=1.0, force_refresh=False, parent=None):
         """Thread object wrapper for coverage search.
 
         :param geometries: List of geometry filter in WKT format.
@@ -102,6 +111,9 @@ class CoverageSearchThread(QThread):
         :param n_planned_value: Value used by the nitrogen map requests
         :type n_planned_value: Numeric
 
+        :param force_refresh: Skip cached coverage responses.
+        :type force_refresh: bool
+
         :param parent: Parent class.
         :type parent: QWidget
         """
@@ -119,7 +131,9 @@ class CoverageSearchThread(QThread):
         self.attribute_field = attribute_field
         self.mutex = mutex
         self.n_planned_value = n_planned_value
+        self.force_refresh = force_refresh
         self.parent = parent
+        self.search_id = next(_SEARCH_IDS)
 
         # setup coverage search filters
         date_filter = ''
@@ -204,13 +218,66 @@ class CoverageSearchThread(QThread):
                     })
 
         self.settings = QSettings()
+        self.thumbnail_workers = setting(
+            'thumbnail_workers', DEFAULT_THUMBNAIL_WORKERS,
+            expected_type=int, qsettings=self.settings)
+        self.coverage_workers = setting(
+            'coverage_workers', DEFAULT_COVERAGE_WORKERS,
+            expected_type=int, qsettings=self.settings)
+        self.coverage_requests_per_second = setting(
+            'coverage_requests_per_second',
+            DEFAULT_COVERAGE_REQUESTS_PER_SECOND,
+            expected_type=float, qsettings=self.settings)
+        try:
+            self.page_size = int(setting(
+                'bridge_api_page_limit', DEFAULT_COVERAGE_PAGE_SIZE,
+                expected_type=str, qsettings=self.settings))
+        except ValueError:
+            self.page_size = DEFAULT_COVERAGE_PAGE_SIZE
+
+        configure_coverage_cache(self.settings)
+        configure_retry_policy(self.settings)
+        configure_thumbnail_store(self.settings)
 
         self.need_stop = False
 
+    def _thumbnail_done(self, result_index, thumbnail_url, future):
+        """Announce a thumbnail once it is in the thumbnail store.
+
+        :param result_index: Index of the result the thumbnail belongs to,
+            in the order the results were emitted.
+        :type result_index: int
+
+        :param thumbnail_url: Url of the thumbnail.
+        :type thumbnail_url: str
+
+        :param future: Finished thumbnail download.
+        :type future: concurrent.futures.Future
+        """
+        if self.need_stop or future.cancelled():
+            return
+        try:
+            stored = future.result()
+        except Exception as e:
+            LOGGER.debug('Thumbnail download failed: %s' % e)
+            return
+        if stored:
+            self.thumbnail_downloaded.emit(
+                self.search_id, result_index, thumbnail_url)
+
     def run(self):
         """Start thread job."""
         self.search_started.emit()
 
+        # Thumbnails missing from the thumbnail store are downloaded by a
+        # bounded pool of workers while the results are emitted straight
+        # away with an empty placeholder.
+        thumbnail_executor = shared_executor(
+            'thumbnail', self.thumbnail_workers)
+        thumbnail_futures = []
+        coverage_results = None
+        result_index = 0
+
         # search
         try:
             self.mutex.lock()
@@ -219,37 +286,28 @@ class CoverageSearchThread(QThread):
                 *credentials_parameters_from_settings(),
                 proxies=QGISSettings.get_qgis_proxy())
 
-            catalog_imagery_api = [
-                INSEASON_S2REP['key'],
-                REFLECTANCE['key'],
-                INSEASON_CVIN['key'],
-                INSEASONFIELD_AVERAGE_NDVI['key'],
-                INSEASONFIELD_AVERAGE_LAI['key'],
-                INSEASONFIELD_AVERAGE_REVERSE_NDVI['key'],
-                INSEASONFIELD_AVERAGE_REVERSE_LAI['key'],
-                YGM['key'],
-                YVM['key'],
-                SAMZ['key'],
-                SAMPLE_MAP['key']
-            ]
-
-            collected_results = []
-            for geometry in self.geometries:
-                # Determines the approach required to do the coverage check
-                if self.map_product in catalog_imagery_api:
-                    results = searcher_client.get_catalog_imagery(
-                        geometry, self.crop_type, self.sowing_date,
-                        filters=self.filters
-                    )
-                else:
-                    # Makes use of the 'coverage' API calls
-                    results = searcher_client.get_coverage(
-                        geometry, self.crop_type, self.sowing_date,
-                        filters=self.filters)
-
-                if isinstance(results, dict) and results.get('message'):
+            # Geometries are searched concurrently in batches, every page of
+            # results of a geometry is fetched, and the results are handled
+            # in the order of the geometries as soon as they are complete.
+            coverage_results = searcher_client.iter_coverage(
+                self.geometries,
+                self.crop_type,
+                self.sowing_date,
+                filters=self.filters,
+                catalog_imagery=self.map_product in CATALOG_IMAGERY_MAP_KEYS,
+                page_size=self.page_size,
+                max_workers=self.coverage_workers,
+                requests_per_second=self.coverage_requests_per_second,
+                force_refresh=self.force_refresh,
+                should_stop=lambda: self.need_stop)
+
+            failures = []
+            for geometry_index, results, error in coverage_results:
+                if error:
                     # TODO handle model_validation_error
-                    raise Exception(results['message'])
+                    failures.append(str(error))
+                    self.geometry_failed.emit(geometry_index, str(error))
+                    continue
 
                 sample_map_ids = []
                 for result in results:
@@ -346,108 +404,19 @@ class CoverageSearchThread(QThread):
                     if not requested_map and self.map_product != SAMPLE_MAP['key']:
                         continue
 
-                    nitrogen_products = [
-                        INSEASONFIELD_AVERAGE_NDVI['key'],
-                        INSEASONFIELD_AVERAGE_LAI['key'],
-                        INSEASONFIELD_AVERAGE_REVERSE_NDVI['key'],
-                        INSEASONFIELD_AVERAGE_REVERSE_LAI['key']
-                    ]
-
-                    thumbnail_url = None
-                    if self.map_product == REFLECTANCE['key']:
-                        # Reflectance map type should make use of the INSEASON_NDVI thumbnail
-                        # This is a work-around provided by GeoSys
-                        thumbnail_url = (
-                                NDVI_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    date=result['image']['date']
-                                ))
-                    elif self.map_product == INSEASON_CVIN['key']:
-                        thumbnail_url = (
-                                CVIN_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    image=result['image']['id']
-                                ))
-                    elif self.map_product == INSEASON_S2REP['key']:
-                        thumbnail_url = (
-                            S2REP_THUMBNAIL_URL.format(
-                                bridge_url=searcher_client.bridge_server,
-                                id=result['seasonField']['id'],
-                                image=result['image']['id']
-                            ))
-                    elif self.map_product in nitrogen_products:
-                        # Nitrogen map type
-                        if self.map_product == INSEASONFIELD_AVERAGE_NDVI['key']:
-                            # INSEASON AVERAGE NDVI
-                            thumbnail_url = (
-                                NITROGEN_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    image=result['image']['id'],
-                                    nitrogen_map_type=INSEASONFIELD_AVERAGE_NDVI['key'],
-                                    n_value=str(self.n_planned_value)
-                                ))
-                        elif self.map_product == INSEASONFIELD_AVERAGE_LAI['key']:
-                            # INSEASON AVERAGE LAI
-                            thumbnail_url = (
-                                NITROGEN_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    image=result['image']['id'],
-                                    nitrogen_map_type=INSEASONFIELD_AVERAGE_LAI['key'],
-                                    n_value=str(self.n_planned_value)
-                                ))
-                        elif self.map_product == INSEASONFIELD_AVERAGE_REVERSE_NDVI['key']:
-                            # INSEASON AVERAGE REVERSE NDVI
-                            thumbnail_url = (
-                                NITROGEN_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    image=result['image']['id'],
-                                    nitrogen_map_type=INSEASONFIELD_AVERAGE_REVERSE_NDVI['key'],
-                                    n_value=str(self.n_planned_value)
-                                ))
-                        elif self.map_product == INSEASONFIELD_AVERAGE_REVERSE_LAI['key']:
-                            # INSEASON AVERAGE REVERSE LAI
-                            thumbnail_url = (
-                                NITROGEN_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    image=result['image']['id'],
-                                    nitrogen_map_type=INSEASONFIELD_AVERAGE_REVERSE_LAI['key'],
-                                    n_value=str(self.n_planned_value)
-                                ))
-                    elif self.map_product == YGM['key'] or self.map_product == YVM['key']:
-                        if self.map_product == YGM['key']:
-                            thumbnail_url = (
-                                YGM_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    image=result['image']['id']
-                                ))
-                        else:
-                            thumbnail_url = (
-                                YPM_THUMBNAIL_URL.format(
-                                    bridge_url=searcher_client.bridge_server,
-                                    id=result['seasonField']['id'],
-                                    image=result['image']['id']
-                                ))
-                    elif self.map_product == SAMZ['key']:
-                        thumbnail_url = (
-                            NDVI_THUMBNAIL_URL.format(
-                                bridge_url=searcher_client.bridge_server,
-                                id=result['seasonField']['id'],
-                                date=result['image']['date']
-                            ))
-                    elif self.map_product == SAMPLE_MAP['key']:
-                        # Sample maps
-                        thumbnail_url = (
-                            SAMPLEMAP_THUMBNAIL_URL.format(
-                                bridge_url=searcher_client.bridge_server,
-                                id=json_id
-                            ))
+                    thumbnail_template = THUMBNAIL_URL_TEMPLATES.get(
+                        self.map_product)
+                    if thumbnail_template:
+                        # Sample maps are identified by the created map
+                        thumbnail_url = thumbnail_template.format(
+                            bridge_url=searcher_client.bridge_server,
+                            id=(json_id
+                                if self.map_product == SAMPLE_MAP['key']
+                                else result['seasonField']['id']),
+                            date=result['image'].get('date'),
+                            image=result['image'].get('id'),
+                            nitrogen_map_type=self.map_product,
+                            n_value=str(self.n_planned_value))
                     else:  # All other map types
                         thumbnail_url = (
                             requested_map['_links'].get('thumbnail') or (
@@ -457,27 +426,34 @@ class CoverageSearchThread(QThread):
                                     date=result['image']['date']
                                 )))
 
-                    if thumbnail_url:
-                        thumbnail_content = searcher_client.get_content(
-                            thumbnail_url)
-                        thumbnail_ba = QByteArray(thumbnail_content)
-                    else:
-                        thumbnail_ba = bytes('', 'utf-8')
-
-                    collected_results.append({
-                        'data': result,
-                        'thumbnail': thumbnail_ba
-                    })
+                    self.data_downloaded.emit(result, QByteArray())
+                    if thumbnail_url and THUMBNAIL_STORE.contains(
+                            thumbnail_url):
+                        self.thumbnail_downloaded.emit(
+                            self.search_id, result_index, thumbnail_url)
+                    elif thumbnail_url:
+                        future = thumbnail_executor.submit(
+                            THUMBNAIL_STORE.fetch, thumbnail_url,
+                            searcher_client.get_content)
+                        future.add_done_callback(partial(
+                            self._thumbnail_done, result_index,
+                            thumbnail_url))
+                        thumbnail_futures.append(future)
+                    result_index += 1
 
                     if self.map_product == SAMPLE_MAP['key']:
                         # Only one sample needs to be shown
                         # One set created from the points
                         break
 
-            # Using this trick, rendering each list item will not be delayed
-            # by thumbnail request.
-            for result in collected_results:
-                self.data_downloaded.emit(result['data'], result['thumbnail'])
+            if failures and len(failures) == len(self.geometries):
+                # None of the geometries could be searched
+                raise Exception(failures[0])
+
+            # Wait for the remaining thumbnails unless the search is stopped.
+            while not self.need_stop and thumbnail_futures:
+                _, pending = wait(thumbnail_futures, timeout=0.5)
+                thumbnail_futures = list(pending)
 
             self.search_finished.emit()
         except:
@@ -487,6 +463,11 @@ class CoverageSearchThread(QThread):
                     sys.exc_info()[1]))
             self.error_occurred.emit(error_text)
         finally:
+            # Drop the requests which have not been started yet.
+            if coverage_results is not None:
+                coverage_results.close()
+            for future in thumbnail_futures:
+                future.cancel()
             self.mutex.unlock()
 
     def stop(self):
@@ -505,7 +486,10 @@ def create_map(
         max_yield_val,
         sample_map_id=None,
         data=None,
-        params=None):
+        params=None,
+        created_layers=None,
+        bridge_api=None,
+        open_in_place=False):
     """Create map based on given parameters.
 
     :param map_specification: Result of single map coverage specifications.
@@ -569,6 +553,18 @@ def create_map(
     
     :param params: Map creation parameters.
     :type params: dict
+
+    :param created_layers: Collects the extra layers (hotspots, segments)
+        instead of adding them to the project.
+    :type created_layers: list
+
+    :param bridge_api: Authenticated client shared by several maps, a new
+        one is created when it is not given.
+    :type bridge_api: BridgeAPI
+
+    :param open_in_place: Keep a zipped map as the downloaded archive
+        instead of extracting it.
+    :type open_in_place: bool
     """""
     # Construct map creation parameters
     map_specification.update(map_specification['maps'][0])
@@ -581,9 +577,10 @@ def create_map(
     params = params if params else {}
     data.update({'params': params})
 
-    bridge_api = BridgeAPI(
-        *credentials_parameters_from_settings(),
-        proxies=QGISSettings.get_qgis_proxy())
+    if bridge_api is None:
+        bridge_api = BridgeAPI(
+            *credentials_parameters_from_settings(),
+            proxies=QGISSettings.get_qgis_proxy())
     field_map_json = bridge_api.get_field_map(
         map_type_key,
         season_field_id,
@@ -607,7 +604,9 @@ def create_map(
         headers=bridge_api.headers,
         map_specification=map_specification,
         data=data,
-        image_id=image_id)
+        image_id=image_id,
+        created_layers=created_layers,
+        open_in_place=open_in_place)
 
 
 def create_difference_map(
@@ -616,7 +615,9 @@ def create_difference_map(
         filename,
         output_map_format,
         data=None,
-        params=None):
+        params=None,
+        created_layers=None,
+        open_in_place=False):
     """Create map based on given parameters.
 
     :param map_specifications: List of map coverage specification.
@@ -665,6 +666,14 @@ def create_difference_map(
 
     :param params: Map creation parameters.
     :type params: dict
+
+    :param created_layers: Collects the extra layers (hotspots, segments)
+        instead of adding them to the project.
+    :type created_layers: list
+
+    :param open_in_place: Keep a zipped map as the downloaded archive
+        instead of extracting it.
+    :type open_in_place: bool
     """""
     # Difference map only created from 2 map specifications.
     # Map type and season field id should always be the same between two map.
@@ -699,7 +708,9 @@ def create_difference_map(
         destination_base_path=destination_base_path,
         output_map_format=output_map_format,
         headers=bridge_api.headers,
-        data=data)
+        data=data,
+        created_layers=created_layers,
+        open_in_place=open_in_place)
 
 
 def create_samz_map(
@@ -710,7 +721,9 @@ def create_samz_map(
         filename,
         output_map_format,
         data=None,
-        params=None):
+        params=None,
+        created_layers=None,
+        open_in_place=False):
     """Create map based on given parameters.
 
     :param season_field_id: ID of the season field.
@@ -742,6 +755,14 @@ def create_samz_map(
 
     :param params: Map creation parameters.
     :type params: dict
+
+    :param created_layers: Collects the extra layers (hotspots, segments)
+        instead of adding them to the project.
+    :type created_layers: list
+
+    :param open_in_place: Keep a zipped map as the downloaded archive
+        instead of extracting it.
+    :type open_in_place: bool
     """""
     map_type_key = SAMZ['key']
     destination_base_path = os.path.join(output_dir, filename)
@@ -765,12 +786,15 @@ def create_samz_map(
         destination_base_path=destination_base_path,
         output_map_format=output_map_format,
         headers=bridge_api.headers,
-        data=data)
+        data=data,
+        created_layers=created_layers,
+        open_in_place=open_in_place)
 
 
 def download_field_map(
         field_map_json, map_type_key, destination_base_path,
-        output_map_format, headers, map_specification=None, data=None, image_id=''):
+        output_map_format, headers, map_specification=None, data=None,
+        image_id='', created_layers=None, open_in_place=False):
     """Download field map from requested field map json.
 
     :param field_map_json: JSON response from Bridge API field map request.
@@ -821,6 +845,15 @@ def download_field_map(
 
     :param image_id: Image ID used for the catalog-image requests
     :type image_id: str
+
+    :param created_layers: When given, the hotspot and segment layers are
+        appended to it as (path, name) instead of being added to the
+        project, so the caller can add them from the main thread.
+    :type created_layers: list
+
+    :param open_in_place: Keep a zipped map as the downloaded archive, to
+        be opened via /vsizip/, instead of extracting it.
+    :type open_in_place: bool
     """
     message = '{} map successfully created.'.format(map_type_key)
     if not field_map_json.get('seasonField'):
@@ -873,17 +906,26 @@ def download_field_map(
         return False, message
 
     try:
-        if output_map_format in ZIPPED_FORMAT:
-            zip_path = tempfile.mktemp('{}.zip'.format(map_extension))
-            fetch_data(url, zip_path, headers=headers)
-            extract_zip(zip_path, destination_base_path)
+        if output_map_format in ZIPPED_FORMAT and open_in_place:
+            # Keep the archive as the output, it is opened via /vsizip/.
+            fetch_data(
+                url, destination_base_path + map_extension + ZIP_EXT,
+                headers=headers)
+        elif output_map_format in ZIPPED_FORMAT:
+            with ScratchWorkspace() as workspace:
+                suffix = '{}.zip'.format(map_extension)
+                zip_path = workspace.file_path(url, suffix)
+                fetch_data(
+                    url, zip_path, headers=headers,
+                    partial_path=workspace.partial_path(url, suffix))
+                extract_zip(zip_path, destination_base_path, atomic=True)
         else:
             destination_filename = (
                     destination_base_path + output_map_format['extension'])
-            fetch_data(url, destination_filename, headers=headers)
+            downloads = [(url, destination_filename)]
             if output_map_format == PNG or output_map_format == PNG_KMZ:
                 # Download associated legend and world-file for geo-referencing
-                # the PNG file.
+                # the PNG file, together with the PNG file itself.
                 
                 # This step check if the map type is color composition
                 # If that is the case, legend will not be included to the items
@@ -911,7 +953,10 @@ def download_field_map(
 
                     destination_filename = '{}{}'.format(
                         destination_base_path, item['extension'])
-                    fetch_data(url, destination_filename, headers=headers)
+                    downloads.append((url, destination_filename))
+            # The map and its sidecar files are fetched concurrently, a
+            # failure of any of them removes the others.
+            fetch_group(downloads, headers=headers)
         # Get hotspots for zones if they have been requested by user.
         bridge_api = BridgeAPI(
             *credentials_parameters_from_settings(),
@@ -957,7 +1002,8 @@ def download_field_map(
                 create_hotspot_layer(
                     map_json.get('hotSpots'),
                     'hotspots',
-                    hotspot_filename
+                    hotspot_filename,
+                    created_layers=created_layers
                 )
 
             if map_json.get('zones'):
@@ -977,11 +1023,12 @@ def download_field_map(
                 create_hotspot_layer(
                     map_json.get('zones'),
                     'segments',
-                    segment_filename
+                    segment_filename,
+                    created_layers=created_layers
                 )
-    except:
-        # zip extraction error
-        message = 'Failed to download file.'
+    except Exception as e:
+        # download or zip extraction error
+        message = 'Failed to download file. {}'.format(e)
         return False, message
     return True, message
 
@@ -27,12 +27,13 @@ import sys
 
 from PyQt5 import QtGui, QtWidgets
 from PyQt5.QtCore import pyqtSignal, QSettings, QMutex, QDate
-from PyQt5.QtGui import QCursor
-from PyQt5.QtWidgets import QLabel, QListWidgetItem, QMessageBox, QApplication
+from PyQt5.QtWidgets import QLabel, QListWidgetItem, QMessageBox
 
 from qgis.core import (
+    Qgis,
     QgsProject,
     QgsFeatureRequest,
+    QgsMessageLog,
     QgsVectorLayer,
     QgsRasterLayer,
     QgsCoordinateReferenceSystem
@@ -45,34 +46,47 @@ from geosys.bridge_api.default import (
     ORGANIC_AVERAGE, POSITION, FILTER, SAMZ_ZONE, SAMZ_ZONING, HOTSPOT,
     ZONING_SEGMENTATION, MAX_FEATURE_NUMBERS, DEFAULT_ZONE_COUNT, GAIN,
     OFFSET, DEFAULT_N_PLANNED, DEFAULT_AVE_YIELD, DEFAULT_MIN_YIELD,
-    DEFAULT_MAX_YIELD, DEFAULT_ORGANIC_AVE, DEFAULT_GAIN, DEFAULT_OFFSET
+    DEFAULT_MAX_YIELD, DEFAULT_ORGANIC_AVE, DEFAULT_GAIN, DEFAULT_OFFSET,
+    ZIPPED_FORMAT, ZIP_EXT, DEFAULT_MAP_CREATION_JOBS,
+    DEFAULT_MAP_CREATION_RETRIES
 )
 from geosys.bridge_api.definitions import (
-    ARCHIVE_MAP_PRODUCTS, ALL_SENSORS, SENSORS, INSEASON_NDVI, INSEASON_EVI,
+    ARCHIVE_MAP_PRODUCTS, ALL_SENSORS, SENSORS,
     SAMZ, SOIL, ELEVATION, REFLECTANCE, LANDSAT_8, LANDSAT_9, SENTINEL_2,
     INSEASONFIELD_AVERAGE_NDVI, INSEASONFIELD_AVERAGE_REVERSE_NDVI,
     INSEASONFIELD_AVERAGE_LAI, INSEASONFIELD_AVERAGE_REVERSE_LAI,
     COLOR_COMPOSITION, SAMPLE_MAP, IGNORE_LAYER_FIELDS, WEATHER_TYPES,
     ALLOWED_FIELD_TYPES
 )
+from geosys.bridge_api.registry import (
+    DIFFERENCE_MAP_PAIRS, NITROGEN_MAP_KEYS, difference_map)
 from geosys.bridge_api.utilities import get_definition
 from geosys.ui.help.help_dialog import HelpDialog
 from geosys.ui.widgets.geosys_coverage_downloader import (
     CoverageSearchThread, create_map, create_difference_map, create_samz_map
 )
 from geosys.ui.widgets.geosys_itemwidget import CoverageSearchResultItemWidget
+from geosys.ui.widgets.geosys_map_creation_queue import (
+    MapCreationJob, MapCreationQueue)
 from geosys.utilities.gui_utilities import (
     add_ordered_combo_item, layer_icon, is_polygon_layer, layer_from_combo,
-    add_layer_to_canvas, reproject, item_data_from_combo,
+    add_layer_to_canvas, geometry_request, item_data_from_combo,
     wkt_geometries_from_feature_iterator, item_text_from_combo,
-    is_point_layer, attribute_from_feature_iterator
+    is_point_layer, attribute_from_feature_iterator,
+    geometries_from_feature_iterator
 )
+from geosys.utilities.downloader import vsizip_path
+from geosys.utilities.payload import optimize_geometries_from_settings
+from geosys.utilities.qgis import configure_retry_policy
 from geosys.utilities.resources import get_ui_class
 from geosys.utilities.settings import setting, set_setting
 from geosys.utilities.utilities import check_if_file_exists
 
 FORM_CLASS = get_ui_class('geosys_dockwidget_base.ui')
 
+# Number of geometry failures quoted in the coverage search summary.
+REPORTED_GEOMETRY_FAILURES = 3
+
 
 class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
     closingPlugin = pyqtSignal()
@@ -93,6 +107,14 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.settings = QSettings()
         self.one_process_work = QMutex()
         self.search_threads = None
+        self.map_creation_queue = MapCreationQueue(parent=self)
+        self.map_creation_queue.job_finished.connect(
+            self.map_creation_finished)
+        self.map_creation_queue.progress_changed.connect(
+            self.show_map_creation_progress)
+        self.map_creation_queue.queue_finished.connect(
+            self.map_creation_queue_finished)
+        self.map_creation_errors = []
         self.max_stacked_widget_index = self.stacked_widget.count() - 1
         self.current_stacked_widget_index = 0
 
@@ -149,6 +171,18 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         self.selected_coverage_results = []
 
+        # Coverage result list items and widgets, in the order the search
+        # thread emitted them. Used to fill in thumbnails as they arrive.
+        self.coverage_result_items = []
+
+        # Geometries whose coverage search failed, as (index, error) tuples,
+        # reported together when the search finishes.
+        self.geometry_failures = []
+
+        # Id of the running coverage search, thumbnails of older searches
+        # are dropped.
+        self.coverage_search_id = None
+
         # Stores the selected layer text for when a coverage search is done
         self.current_selected_layer = None
 
@@ -378,8 +412,7 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                         coverage_result['seasonField']['id'])
 
             if len(self.selected_coverage_results) == 2 and has_same_id and (
-                    self.map_product in [INSEASON_NDVI['key'],
-                                         INSEASON_EVI['key']]):
+                    self.map_product in DIFFERENCE_MAP_PAIRS):
                 self.difference_map_push_button.setVisible(True)
             else:
                 self.difference_map_push_button.setVisible(False)
@@ -401,14 +434,8 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             elif self.map_product == ELEVATION['key']:
                 # For elevation map type
                 item_json['maps'][0]['type'] = ELEVATION['key']
-            elif self.map_product == INSEASONFIELD_AVERAGE_NDVI['key']:
-                item_json['maps'][0]['type'] = INSEASONFIELD_AVERAGE_NDVI['key']
-            elif self.map_product == INSEASONFIELD_AVERAGE_LAI['key']:
-                item_json['maps'][0]['type'] = INSEASONFIELD_AVERAGE_LAI['key']
-            elif self.map_product == INSEASONFIELD_AVERAGE_REVERSE_NDVI['key']:
-                item_json['maps'][0]['type'] = INSEASONFIELD_AVERAGE_REVERSE_NDVI['key']
-            elif self.map_product == INSEASONFIELD_AVERAGE_REVERSE_LAI['key']:
-                item_json['maps'][0]['type'] = INSEASONFIELD_AVERAGE_REVERSE_LAI['key']
+            elif self.map_product in NITROGEN_MAP_KEYS:
+                item_json['maps'][0]['type'] = self.map_product
             elif self.map_product == SAMPLE_MAP['key']:
                 item_json['maps'][0]['type'] = SAMPLE_MAP['key']
 
@@ -537,14 +564,17 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         """
         if self.output_map_format in VALID_QGIS_FORMAT:
             filename = os.path.basename(base_path)
+            extension = self.output_map_format['extension']
+            layer_path = base_path + extension
+            archive_path = layer_path + ZIP_EXT
+            if self.output_map_format in ZIPPED_FORMAT and (
+                    os.path.exists(archive_path)):
+                # Zipped map kept as downloaded, open it from the archive.
+                layer_path = vsizip_path(archive_path, extension)
             if self.output_map_format in VECTOR_FORMAT:
-                map_layer = QgsVectorLayer(
-                    base_path + self.output_map_format['extension'],
-                    filename)
+                map_layer = QgsVectorLayer(layer_path, filename)
             else:
-                map_layer = QgsRasterLayer(
-                    base_path + self.output_map_format['extension'],
-                    filename)
+                map_layer = QgsRasterLayer(layer_path, filename)
             add_layer_to_canvas(map_layer, filename)
 
     def save_parameter_values_as_setting(self):
@@ -641,22 +671,24 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                 layer.selectedFeatureCount() > 0))
         use_single_geometry = self.single_geometry_checkbox.isChecked()
 
-        # Reproject layer to EPSG:4326
-        if layer.crs().authid() != 'EPSG:4326':
-            layer = reproject(
-                layer, QgsCoordinateReferenceSystem('EPSG:4326'))
-
-        feature_iterator = layer.getFeatures()
+        # Only the features which are sent are reprojected to EPSG:4326.
+        feature_ids = None
         if use_selected_features:
-            request = QgsFeatureRequest()
-            request.setFilterFids(layer.selectedFeatureIds())
-            feature_iterator = layer.getFeatures(request)
+            feature_ids = layer.selectedFeatureIds()
+        feature_iterator = layer.getFeatures(geometry_request(
+            QgsCoordinateReferenceSystem('EPSG:4326'), feature_ids))
 
         # Handle multi features
         # Merge features into multi-part polygon
         # TODO use Collect Geometries processing algorithm
-        self.wkt_geometries = wkt_geometries_from_feature_iterator(
+        geometries = geometries_from_feature_iterator(
             feature_iterator, MAX_FEATURE_NUMBERS, use_single_geometry)
+        # Send the smallest geometries giving the same coverage answer.
+        self.wkt_geometries, payload_report = (
+            optimize_geometries_from_settings(
+                geometries, qsettings=self.settings))
+        QgsMessageLog.logMessage(
+            payload_report.message(), 'GEOSYS', Qgis.Info)
 
         if not self.wkt_geometries:
             # geometry is not valid
@@ -829,23 +861,25 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             filename = check_if_file_exists(
                 self.output_directory,
                 filename,
-                self.output_map_format['extension']
+                self.output_map_format['extension'],
+                reserved=self.map_creation_queue.job_names()
             )
 
-            is_success, message = create_samz_map(
-                season_field_id, image_ids, image_dates, self.output_directory, filename,
-                output_map_format=self.output_map_format, params=data)
-
-            if not is_success:
-                QMessageBox.critical(
-                    self,
-                    'Map Creation Status',
-                    'Error creating map. {}'.format(message))
-                return
-
-            # Add map to qgis canvas
-            self.load_layer(os.path.join(self.output_directory, filename))
+            jobs = [MapCreationJob(
+                filename,
+                os.path.join(self.output_directory, filename),
+                create_samz_map,
+                season_field_id=season_field_id,
+                list_of_image_ids=image_ids,
+                list_of_image_date=image_dates,
+                output_dir=self.output_directory,
+                filename=filename,
+                output_map_format=self.output_map_format,
+                params=data)]
         else:
+            jobs = []
+            # Maps of queued jobs are not written yet, avoid their names.
+            reserved_filenames = self.map_creation_queue.job_names()
             for map_specification in map_specifications:
                 filename = '{}_{}_zones_{}_{}'.format(
                     self.map_product,  # map_specification['maps'][0]['type'],
@@ -856,38 +890,122 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                 filename = check_if_file_exists(
                     self.output_directory,
                     filename,
-                    self.output_map_format['extension']
+                    self.output_map_format['extension'],
+                    reserved=reserved_filenames
                 )
+                reserved_filenames.add(filename)
 
                 sample_map_id = None
                 if self.map_product == SAMPLE_MAP['key']:
                     sample_map_id = map_specification['id']
 
-                is_success, message = create_map(
-                    map_specification, self.output_directory, filename,
-                    data=data, output_map_format=self.output_map_format,
+                # Each job gets its own copy of the data, jobs run
+                # concurrently and the map creation updates it.
+                jobs.append(MapCreationJob(
+                    filename,
+                    os.path.join(self.output_directory, filename),
+                    create_map,
+                    map_specification=dict(map_specification),
+                    output_dir=self.output_directory,
+                    filename=filename,
+                    data=dict(data),
+                    output_map_format=self.output_map_format,
                     n_planned_value=self.n_planned_value,
                     yield_val=self.yield_average_form.value(),
                     min_yield_val=self.yield_minimum_form.value(),
                     max_yield_val=self.yield_maximum_form.value(),
-                    sample_map_id=sample_map_id
-                )
-                if not is_success:
-                    QMessageBox.critical(
-                        self,
-                        'Map Creation Status',
-                        'Error creating map. {}'.format(message))
-                    return
+                    sample_map_id=sample_map_id))
+
+        self.queue_map_creation_jobs(jobs)
+
+    def queue_map_creation_jobs(self, jobs):
+        """Create maps in the background, at most a few at a time.
+
+        Each map is added to the project as soon as it is created, a failed
+        map does not stop the others.
+
+        :param jobs: Map creation jobs.
+        :type jobs: list
+        """
+        self.map_creation_queue.max_jobs = max(1, setting(
+            'map_creation_jobs', DEFAULT_MAP_CREATION_JOBS,
+            expected_type=int, qsettings=self.settings))
+        self.map_creation_queue.retries = setting(
+            'map_creation_retries', DEFAULT_MAP_CREATION_RETRIES,
+            expected_type=int, qsettings=self.settings)
+        configure_retry_policy(self.settings)
+        # Zipped maps can be kept as downloaded and opened via /vsizip/.
+        open_in_place = setting(
+            'open_zipped_in_place', False,
+            expected_type=bool, qsettings=self.settings)
+        for job in jobs:
+            job.kwargs['open_in_place'] = open_in_place
+            self.map_creation_queue.add(job)
+
+    def map_creation_finished(self, job):
+        """Add a created map to the project, or remember why it failed.
+
+        :param job: The finished job.
+        :type job: MapCreationJob
+        """
+        if not job.is_success:
+            self.map_creation_errors.append(
+                '{}: {}'.format(job.name, job.message))
+            return
+
+        # Add map to qgis canvas
+        self.load_layer(job.base_path)
+        for layer_path, layer_name in job.created_layers:
+            add_layer_to_canvas(
+                QgsVectorLayer(layer_path, layer_name, 'ogr'), layer_name)
+
+    def show_map_creation_progress(self, done, total):
+        """Show the progress of the map creation batch in the status bar.
+
+        :param done: Number of finished jobs.
+        :type done: int
+
+        :param total: Number of jobs in the batch.
+        :type total: int
+        """
+        if self.iface is None:
+            return
+        self.iface.mainWindow().statusBar().showMessage(
+            self.tr('Map creation: {} of {} done').format(done, total), 5000)
 
-                # Add map to qgis canvas
-                self.load_layer(os.path.join(self.output_directory, filename))
+    def map_creation_queue_finished(self, succeeded, failed):
+        """Report the map creation batch once all its jobs are done.
+
+        :param succeeded: Number of maps created.
+        :type succeeded: int
+
+        :param failed: Number of maps which failed or were cancelled.
+        :type failed: int
+        """
+        errors, self.map_creation_errors = self.map_creation_errors, []
+        if self.map_creation_queue.cancelled:
+            # Cancelled when the dock is closed, do not block with a dialog.
+            if self.iface is not None:
+                self.iface.messageBar().pushInfo(
+                    self.tr('Map creation'),
+                    self.tr('Map creation cancelled, {} of {} maps '
+                            'created.').format(succeeded, succeeded + failed))
+        elif failed:
+            QMessageBox.critical(
+                self,
+                'Map Creation Status',
+                'Error creating {} of {} maps.\n{}'.format(
+                    failed, succeeded + failed, '\n'.join(errors)))
+        elif self.iface is not None:
+            self.iface.messageBar().pushSuccess(
+                self.tr('Map creation'),
+                self.tr('{} maps created.').format(succeeded))
 
     def start_map_creation(self):
         """Map creation starts here."""
         # validate map creation parameters before creating the map
         message_title = 'Map Creation Status'
         try:
-            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
             is_success, message = self.validate_map_creation_parameters()
             if not is_success:
                 QMessageBox.critical(
@@ -907,23 +1025,18 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
                 unicode(sys.exc_info()[0].__name__),
                 unicode(sys.exc_info()[1]))
             QMessageBox.critical(self, message_title, error_text)
-        finally:
-            QApplication.restoreOverrideCursor()
 
     def start_difference_map_creation(self):
         """Difference Map creation starts here."""
         message_title = 'Difference Map Creation Status'
         try:
-            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-
             # Validate map creation parameters
             self.validate_map_creation_parameters()
 
             # Construct filename
             map_specifications = self.selected_coverage_results
-            map_type_definition = get_definition(
+            difference_map_definition = difference_map(
                 map_specifications[0]['maps'][0]['type'])
-            difference_map_definition = map_type_definition['difference_map']
             filename = '{}_{}_{}_{}'.format(
                 difference_map_definition['key'],
                 map_specifications[0]['seasonField']['id'],
@@ -932,26 +1045,21 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             )
 
             # Run difference map creation
-            is_success, message = create_difference_map(
-                map_specifications, self.output_directory,
-                filename, output_map_format=self.output_map_format)
-
-            if not is_success:
-                QMessageBox.critical(
-                    self,
-                    'Map Creation Status',
-                    'Error creating map. {}'.format(message))
-                return
-
-            # Add map to qgis canvas
-            self.load_layer(os.path.join(self.output_directory, filename))
+            self.queue_map_creation_jobs([MapCreationJob(
+                filename,
+                os.path.join(self.output_directory, filename),
+                create_difference_map,
+                map_specifications=[
+                    dict(specification)
+                    for specification in map_specifications],
+                output_dir=self.output_directory,
+                filename=filename,
+                output_map_format=self.output_map_format)])
         except:
             error_text = "{0}: {1}".format(
                 unicode(sys.exc_info()[0].__name__),
                 unicode(sys.exc_info()[1]))
             QMessageBox.critical(self, message_title, error_text)
-        finally:
-            QApplication.restoreOverrideCursor()
 
     def start_coverage_search(self):
         """Coverage search starts here."""
@@ -964,10 +1072,13 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
 
         if self.search_threads:
             self.search_threads.data_downloaded.disconnect()
+            self.search_threads.thumbnail_downloaded.disconnect()
+            self.search_threads.geometry_failed.disconnect()
             self.search_threads.search_finished.disconnect()
             self.search_threads.stop()
             self.search_threads.wait()
             self.coverage_result_list.clear()
+            self.coverage_result_items = []
 
         # start search thread
         searcher = CoverageSearchThread(
@@ -984,21 +1095,28 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             attribute_field=self.sample_map_field,
             mutex=self.one_process_work,
             n_planned_value=self.n_planned_value,
+            force_refresh=self.force_refresh_checkbox.isChecked(),
             parent=self.iface.mainWindow())
         searcher.search_started.connect(self.coverage_search_started)
         searcher.search_finished.connect(self.coverage_search_finished)
         searcher.data_downloaded.connect(self.show_coverage_result)
+        searcher.thumbnail_downloaded.connect(self.show_coverage_thumbnail)
+        searcher.geometry_failed.connect(self.show_geometry_failure)
         searcher.error_occurred.connect(self.show_error)
         self.search_threads = searcher
+        self.coverage_search_id = searcher.search_id
         searcher.start()
 
     def coverage_search_started(self):
         """Action after search thread started."""
         self.coverage_result_list.clear()
+        self.coverage_result_items = []
+        self.geometry_failures = []
         self.coverage_result_list.insertItem(0, self.tr('Searching...'))
 
     def coverage_search_finished(self):
         """Action after search thread finished."""
+        self.report_geometry_failures()
         self.coverage_result_list.takeItem(0)
         coverage_result_empty = self.coverage_result_list.count() == 0
         self.next_push_button.setEnabled(not coverage_result_empty)
@@ -1075,13 +1193,73 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             new_item.setData(Qt.UserRole, coverage_map_json)
             self.coverage_result_list.addItem(new_item)
             self.coverage_result_list.setItemWidget(new_item, custom_widget)
+            self.coverage_result_items.append((new_item, custom_widget))
         else:
             new_item = QListWidgetItem()
             new_item.setText(self.tr('No results!'))
             new_item.setData(Qt.UserRole, None)
             self.coverage_result_list.addItem(new_item)
+            self.coverage_result_items.append((new_item, None))
         self.coverage_result_list.update()
 
+    def show_coverage_thumbnail(self, search_id, result_index, thumbnail_url):
+        """Fill in the thumbnail of an already listed coverage result.
+
+        :param search_id: Id of the coverage search the result belongs to.
+        :type search_id: int
+
+        :param result_index: Index of the coverage result, in the order the
+            results were emitted by the search thread.
+        :type result_index: int
+
+        :param thumbnail_url: Url of the thumbnail, available in the
+            thumbnail store.
+        :type thumbnail_url: str
+        """
+        if search_id != self.coverage_search_id:
+            return
+        if result_index >= len(self.coverage_result_items):
+            return
+        item, custom_widget = self.coverage_result_items[result_index]
+        if custom_widget is None:
+            return
+        custom_widget.show_stored_thumbnail(thumbnail_url)
+        item.setSizeHint(custom_widget.sizeHint())
+
+    def show_geometry_failure(self, geometry_index, error_message):
+        """Record a coverage search failure of a single geometry.
+
+        The results of the other geometries are still listed. Failures are
+        logged as they happen and summarized when the search finishes.
+
+        :param geometry_index: Index of the geometry which failed.
+        :type geometry_index: int
+
+        :param error_message: Error message.
+        :type error_message: str
+        """
+        self.geometry_failures.append((geometry_index, error_message))
+        QgsMessageLog.logMessage(
+            'Coverage search of geometry {} failed: {}'.format(
+                geometry_index + 1, error_message),
+            'GEOSYS', Qgis.Warning)
+
+    def report_geometry_failures(self):
+        """Show a single message summarizing the failed geometries."""
+        failures = self.geometry_failures
+        self.geometry_failures = []
+        if not failures or self.iface is None:
+            return
+        details = '; '.join(
+            self.tr('geometry {}: {}').format(index + 1, error_message)
+            for index, error_message in failures[:REPORTED_GEOMETRY_FAILURES])
+        if len(failures) > REPORTED_GEOMETRY_FAILURES:
+            details += self.tr('; ... see the GEOSYS log for the others')
+        self.iface.messageBar().pushWarning(
+            self.tr('Coverage search'),
+            self.tr('{} geometries failed ({})').format(
+                len(failures), details))
+
     def show_error(self, error_message):
         """Show error message as widget item.
 
@@ -1089,6 +1267,7 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         :type error_message: str
         """
         self.coverage_result_list.clear()
+        self.coverage_result_items = []
         new_widget = QLabel()
         new_widget.setTextFormat(Qt.RichText)
         new_widget.setOpenExternalLinks(True)
@@ -1299,5 +1478,6 @@ class GeosysPluginDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.geometry_combo_box.blockSignals(True)
 
     def closeEvent(self, event):
+        self.map_creation_queue.cancel()
         self.closingPlugin.emit()
         event.accept()
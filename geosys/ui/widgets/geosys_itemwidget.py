@@ -7,6 +7,7 @@ from PyQt5.QtWidgets import (
 
 from qgis.PyQt.QtCore import Qt
 from geosys.bridge_api.definitions import SAMPLE_MAP
+from geosys.utilities.thumbnail_cache import THUMBNAIL_STORE
 
 __copyright__ = "Copyright 2019, Kartoza"
 __license__ = "GPL version 3"
@@ -67,9 +68,7 @@ class CoverageSearchResultItemWidget(QWidget):
         self.map_thumbnail.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
         self.map_thumbnail.resize(24, 24)
 
-        qimg = QImage.fromData(thumbnail_ba)
-        pixmap = QPixmap.fromImage(qimg)
-        self.map_thumbnail.setPixmap(pixmap)
+        self.set_thumbnail(thumbnail_ba)
         self.layout.addWidget(self.map_thumbnail)
 
         self.map_description_layout = QGridLayout(self)
@@ -124,3 +123,31 @@ class CoverageSearchResultItemWidget(QWidget):
 
         self.coverage_map_json = coverage_map_json
         self.thumbnail_ba = thumbnail_ba
+        self.thumbnail_url = None
+
+    def set_thumbnail(self, thumbnail_ba):
+        """Show the thumbnail of the coverage result.
+
+        :param thumbnail_ba: Thumbnail image data in byte array format.
+        :type thumbnail_ba: QByteArray
+        """
+        qimg = QImage.fromData(thumbnail_ba)
+        pixmap = QPixmap.fromImage(qimg)
+        self.map_thumbnail.setPixmap(pixmap)
+        self.thumbnail_ba = thumbnail_ba
+
+    def show_stored_thumbnail(self, thumbnail_url):
+        """Show a thumbnail from the thumbnail store.
+
+        :param thumbnail_url: Url of the thumbnail.
+        :type thumbnail_url: str
+
+        :return: Whether the thumbnail was found in the store.
+        :rtype: bool
+        """
+        image = THUMBNAIL_STORE.image(thumbnail_url)
+        if image is None:
+            return False
+        self.map_thumbnail.setPixmap(QPixmap.fromImage(image))
+        self.thumbnail_url = thumbnail_url
+        return True
@@ -0,0 +1,232 @@
+# coding=utf-8
+"""Background queue of map creation jobs run as QGIS tasks.
+"""
+import logging
+from collections import deque
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from qgis.core import QgsApplication, QgsTask
+
+from geosys.bridge_api.default import (
+    DEFAULT_MAP_CREATION_JOBS, DEFAULT_MAP_CREATION_RETRIES)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+
+class MapCreationJob(object):
+    """A single map to create in the background."""
+
+    def __init__(self, name, base_path, create, **kwargs):
+        """Map creation job.
+
+        :param name: Name of the map, shown in the task manager.
+        :type name: str
+
+        :param base_path: Output base path of the map, without extension.
+        :type base_path: str
+
+        :param create: Map creation function, e.g. create_map. It is called
+            with kwargs and a created_layers list and returns a
+            (is_success, message) tuple.
+        :type create: callable
+
+        :param kwargs: Arguments of the map creation function.
+        :type kwargs: dict
+        """
+        self.name = name
+        self.base_path = base_path
+        self.create = create
+        self.kwargs = kwargs
+        # Extra layers (path, name) created next to the map.
+        self.created_layers = []
+        self.attempts = 0
+        self.is_success = False
+        self.message = 'Map creation was cancelled.'
+
+    def run(self):
+        """Create the map.
+
+        :return: Tuple of map creation status and message.
+        :rtype: tuple
+        """
+        del self.created_layers[:]
+        return self.create(created_layers=self.created_layers, **self.kwargs)
+
+
+class MapCreationTask(QgsTask):
+    """QGIS task creating one map, retried when it fails."""
+
+    def __init__(self, job, retries, on_finished):
+        """Map creation task.
+
+        :param job: The job to run.
+        :type job: MapCreationJob
+
+        :param retries: Number of times the job is retried after a failure.
+        :type retries: int
+
+        :param on_finished: Called with the task on the main thread once
+            the task has finished, failed or been cancelled.
+        :type on_finished: callable
+        """
+        super(MapCreationTask, self).__init__(
+            'Creating map {}'.format(job.name), QgsTask.CanCancel)
+        self.job = job
+        self.retries = max(0, retries)
+        self.on_finished = on_finished
+
+    def run(self):
+        """Run the job in a background thread. Do not touch the GUI here.
+
+        :return: Whether the map has been created.
+        :rtype: bool
+        """
+        attempts = self.retries + 1
+        for attempt in range(attempts):
+            if self.isCanceled():
+                return False
+            self.job.attempts = attempt + 1
+            self.setProgress(100.0 * attempt / attempts)
+            try:
+                is_success, message = self.job.run()
+            except Exception as e:
+                is_success = False
+                message = '{}: {}'.format(type(e).__name__, e)
+            self.job.is_success = is_success
+            self.job.message = message
+            if is_success:
+                self.setProgress(100)
+                return True
+            LOGGER.warning('Map {} failed (attempt {} of {}): {}'.format(
+                self.job.name, attempt + 1, attempts, message))
+        return False
+
+    def finished(self, result):
+        """Called by the task manager on the main thread.
+
+        :param result: Value returned by run.
+        :type result: bool
+        """
+        self.on_finished(self)
+
+
+class MapCreationQueue(QObject):
+    """Run map creation jobs as QGIS tasks with bounded parallelism.
+
+    At most max_jobs tasks are handed to the QGIS task manager at once,
+    the next job starts as soon as one finishes. A failed job does not stop
+    the others. Results are reported through signals on the main thread,
+    so layers can be added to the project as each job finishes.
+    """
+
+    job_finished = pyqtSignal(object)
+    progress_changed = pyqtSignal(int, int)
+    queue_finished = pyqtSignal(int, int)
+
+    def __init__(
+            self,
+            max_jobs=DEFAULT_MAP_CREATION_JOBS,
+            retries=DEFAULT_MAP_CREATION_RETRIES,
+            task_manager=None,
+            parent=None):
+        """Map creation queue.
+
+        :param max_jobs: Maximum number of maps created concurrently.
+        :type max_jobs: int
+
+        :param retries: Number of times a failed job is retried.
+        :type retries: int
+
+        :param task_manager: Task manager running the jobs, defaults to the
+            QGIS application task manager.
+        :type task_manager: QgsTaskManager
+
+        :param parent: Parent object.
+        :type parent: QObject
+        """
+        super(MapCreationQueue, self).__init__(parent)
+        self.max_jobs = max(1, max_jobs)
+        self.retries = retries
+        self.task_manager = task_manager or QgsApplication.taskManager()
+        self._pending = deque()
+        # References to the running tasks keep their wrappers alive.
+        self._running = []
+        # Whether the current batch has been cancelled, until queue_finished
+        # has been emitted for it.
+        self.cancelled = False
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def is_running(self):
+        """Whether some jobs are pending or running.
+
+        :rtype: bool
+        """
+        return bool(self._pending or self._running)
+
+    def job_names(self):
+        """Names of the pending and running jobs, their outputs are not
+        written yet.
+
+        :rtype: set
+        """
+        return set(job.name for job in self._pending) | set(
+            task.job.name for task in self._running)
+
+    def add(self, job):
+        """Queue a job, it starts when a slot is free.
+
+        :param job: Map creation job.
+        :type job: MapCreationJob
+        """
+        self._pending.append(job)
+        self.total += 1
+        self._start_next()
+
+    def cancel(self):
+        """Drop the pending jobs and cancel the running ones."""
+        if self.is_running():
+            self.cancelled = True
+        while self._pending:
+            self._job_done(self._pending.popleft())
+        for task in list(self._running):
+            task.cancel()
+        self._check_finished()
+
+    def _start_next(self):
+        while self._pending and len(self._running) < self.max_jobs:
+            task = MapCreationTask(
+                self._pending.popleft(), self.retries, self._task_finished)
+            self._running.append(task)
+            self.task_manager.addTask(task)
+
+    def _task_finished(self, task):
+        if task in self._running:
+            self._running.remove(task)
+        self._job_done(task.job)
+        self._start_next()
+        self._check_finished()
+
+    def _job_done(self, job):
+        if job.is_success:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.job_finished.emit(job)
+        self.progress_changed.emit(self.succeeded + self.failed, self.total)
+
+    def _check_finished(self):
+        if self.total and not self.is_running():
+            succeeded, failed = self.succeeded, self.failed
+            self._reset_counts()
+            self.queue_finished.emit(succeeded, failed)
+            self.cancelled = False
@@ -52,7 +52,8 @@ class GeosysOptionsDialog(QtWidgets.QDialog, FORM_CLASS):
         self.boolean_settings = {
             'geosys_region_na': self.us_radio_button,
             'geosys_region_eu': self.eu_radio_button,
-            'use_testing_service': self.testing_service_checkbox
+            'use_testing_service': self.testing_service_checkbox,
+            'open_zipped_in_place': self.open_zipped_in_place_checkbox
         }
         self.credentials_settings = {
             'bridge_api_username': self.username_form,
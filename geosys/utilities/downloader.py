@@ -1,15 +1,27 @@
 # coding=utf-8
 """Helpers for QGIS related functionality."""
+import hashlib
+import json
 import logging
 import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
 import zipfile
 
-from qgis.core import QgsApplication, QgsNetworkAccessManager
+from qgis.core import QgsNetworkAccessManager
 # noinspection PyPackageRequirements
-from qgis.PyQt.QtCore import QByteArray, QFile, QUrl
+from qgis.PyQt.QtCore import QEventLoop, QFile, QTimer, QUrl
 # noinspection PyPackageRequirements
 from qgis.PyQt.QtNetwork import QNetworkReply, QNetworkRequest
 
+from geosys.bridge_api.metrics import METRICS
+from geosys.bridge_api.retry import RETRY_POLICY, parse_retry_after
+from geosys.bridge_api.transport import current_transport
+
 __copyright__ = "Copyright 2019, Kartoza"
 __license__ = "GPL version 3"
 __email__ = "rohmat@kartoza.com"
@@ -17,10 +29,71 @@ __revision__ = "$Format:%H$"
 
 LOGGER = logging.getLogger('geosys')
 
+# Extension of a file being downloaded, until it is complete.
+PARTIAL_EXT = '.part'
+# Extension of the resume state stored next to a partial file.
+STATE_EXT = '.json'
+# Number of times an interrupted download is resumed by fetch_data.
+RESUME_ATTEMPTS = 3
+
+# Buffer size used to extract zip members.
+EXTRACT_BUFFER_SIZE = 1024 * 1024
+# Maximum total size of the scratch workspace for downloaded archives.
+SCRATCH_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# Shared partial files being downloaded by a workspace of this process.
+_CLAIMED_PARTIALS = set()
+_CLAIMED_PARTIALS_LOCK = threading.Lock()
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+# Network errors which may go away when the download is retried.
+TRANSIENT_NETWORK_ERRORS = (
+    QNetworkReply.ConnectionRefusedError,
+    QNetworkReply.RemoteHostClosedError,
+    QNetworkReply.TimeoutError,
+    QNetworkReply.TemporaryNetworkFailureError,
+    QNetworkReply.NetworkSessionFailedError,
+    QNetworkReply.ProxyConnectionClosedError,
+    QNetworkReply.ProxyTimeoutError,
+    QNetworkReply.ServiceUnavailableError,
+    QNetworkReply.UnknownNetworkError,
+)
+
+
+def wait(seconds):
+    """Wait without blocking the event loop of the calling thread.
+
+    :param seconds: Seconds to wait.
+    :type seconds: float
+    """
+    loop = QEventLoop()
+    QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec_()
+
 
-def fetch_data(url, output_path, headers=None, progress_dialog=None):
+def url_digest(url):
+    """Get a file name safe digest of an url.
+
+    :param url: URL of the file.
+    :type url: str
+
+    :rtype: str
+    """
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def fetch_data(
+        url, output_path, headers=None, progress_dialog=None, timeout=None,
+        resume_attempts=RESUME_ATTEMPTS, retry_policy=None,
+        partial_path=None):
     """Download data from url and write to output_path.
 
+    An interrupted download is resumed where it stopped, as long as the
+    server supports range requests. A download failing for a transient
+    reason (server busy, network failure) is retried following the retry
+    policy.
+
     :param url: URL of the zip bundle.
     :type url: str
 
@@ -33,6 +106,22 @@ def fetch_data(url, output_path, headers=None, progress_dialog=None):
     :param progress_dialog: A progress dialog.
     :type progress_dialog: QProgressDialog
 
+    :param timeout: Seconds without receiving any data after which the
+        download is aborted. None waits indefinitely.
+    :type timeout: float
+
+    :param resume_attempts: Number of times an interrupted download is
+        resumed before giving up.
+    :type resume_attempts: int
+
+    :param retry_policy: Retry policy of the download, defaults to the
+        shared Bridge API retry policy.
+    :type retry_policy: RetryPolicy
+
+    :param partial_path: Path of the file being downloaded, defaults to the
+        output path with a .part extension.
+    :type partial_path: str
+
     :raises: ImportDialogError - when network error occurred
     """
 
@@ -52,18 +141,192 @@ def fetch_data(url, output_path, headers=None, progress_dialog=None):
         progress_dialog.setLabelText(label_text)
 
     # Download Process
-    downloader = FileDownloader(url, output_path, headers, progress_dialog)
-    try:
-        result = downloader.download()
-    except IOError as ex:
-        raise IOError(ex)
+    retry_policy = retry_policy or RETRY_POLICY
+    started = time.monotonic()
+    resumes = 0
+    retries = 0
+    while True:
+        downloader = FileDownloader(
+            url, output_path, headers, progress_dialog,
+            is_retry=resumes + retries > 0, partial_path=partial_path)
+        try:
+            result = downloader.download(timeout=timeout)
+        except IOError as ex:
+            raise IOError(ex)
+        if result[0] is True:
+            break
+        if downloader.can_resume and resumes < resume_attempts:
+            resumes += 1
+            LOGGER.debug('Resuming download of %s (attempt %s)' % (
+                url, resumes))
+            continue
+        delay = None
+        if downloader.transient_failure:
+            delay = retry_policy.delay(
+                retries, time.monotonic() - started, downloader.retry_after)
+        if delay is None:
+            break
+        retries += 1
+        LOGGER.debug('Retrying download of %s in %.1fs (attempt %s)' % (
+            url, delay, retries))
+        wait(delay)
 
     if result[0] is not True:
         _, error_message = result
         raise Exception(error_message)
 
 
-def extract_zip(zip_path, destination_base_path):
+def fetch_group(
+        downloads, headers=None, timeout=None,
+        resume_attempts=RESUME_ATTEMPTS, retry_policy=None):
+    """Download several files concurrently, all or nothing.
+
+    Every download of the group is started at once and shares one event
+    loop, so the group takes about as long as its slowest file. When one
+    download fails the others are aborted and the files already written by
+    the group are removed.
+
+    :param downloads: List of (url, output_path) tuples.
+    :type downloads: list
+
+    :param headers: Request headers, used for every download.
+    :type headers: dict
+
+    :param timeout: Seconds without receiving any data on any download of
+        the group after which the group is aborted. None waits indefinitely.
+    :type timeout: float
+
+    :param resume_attempts: Number of times each interrupted download is
+        resumed before giving up.
+    :type resume_attempts: int
+
+    :param retry_policy: Retry policy of each download, defaults to the
+        shared Bridge API retry policy.
+    :type retry_policy: RetryPolicy
+
+    :raises: Exception - when a download of the group failed
+    """
+    retry_policy = retry_policy or RETRY_POLICY
+    started = time.monotonic()
+    loop = QEventLoop()
+    downloaders = {}
+    attempts = dict((index, 0) for index in range(len(downloads)))
+    retries = dict((index, 0) for index in range(len(downloads)))
+    results = {}
+    # Downloads aborted by the group after another one failed.
+    aborted = set()
+    # Downloads waiting for their retry.
+    waiting = set()
+    timer = None
+    if timeout:
+        timer = QTimer()
+        timer.setSingleShot(True)
+        timer.setInterval(int(timeout * 1000))
+
+    def failed():
+        return any(result[0] is not True for result in results.values())
+
+    def start(index):
+        url, output_path = downloads[index]
+        LOGGER.debug('Downloading file from URL: %s' % url)
+        downloader = FileDownloader(
+            url, output_path, headers,
+            is_retry=attempts[index] + retries[index] > 0)
+        downloaders[index] = downloader
+        downloader.start(lambda result: finished(index, result))
+        if timer and not downloader.reply.isFinished():
+            downloader.reply.downloadProgress.connect(timer.start)
+
+    def retry_later(index, delay):
+        def restart():
+            waiting.discard(index)
+            if index not in results:
+                start(index)
+
+        waiting.add(index)
+        QTimer.singleShot(int(delay * 1000), restart)
+
+    def abort_running(timed_out=False):
+        for index in list(waiting):
+            aborted.add(index)
+            results[index] = (False, 'Cancelled.')
+        waiting.clear()
+        for index, downloader in list(downloaders.items()):
+            if index in results:
+                continue
+            aborted.add(index)
+            downloader.cancelled = True
+            downloader.timed_out = timed_out
+            downloader.reply.abort()
+        if len(results) == len(downloads):
+            loop.quit()
+
+    def finished(index, result):
+        downloader = downloaders[index]
+        if result[0] is not True and downloader.can_resume and (
+                attempts[index] < resume_attempts) and not failed():
+            attempts[index] += 1
+            LOGGER.debug('Resuming download of %s (attempt %s)' % (
+                downloads[index][0], attempts[index]))
+            start(index)
+            return
+        delay = None
+        if result[0] is not True and downloader.transient_failure and (
+                not failed()):
+            delay = retry_policy.delay(
+                retries[index], time.monotonic() - started,
+                downloader.retry_after)
+        if delay is not None:
+            retries[index] += 1
+            LOGGER.debug('Retrying download of %s in %.1fs (attempt %s)' % (
+                downloads[index][0], delay, retries[index]))
+            retry_later(index, delay)
+            return
+        results[index] = result
+        if result[0] is not True:
+            abort_running()
+        if len(results) == len(downloads):
+            loop.quit()
+
+    if timer:
+        timer.timeout.connect(lambda: abort_running(timed_out=True))
+        timer.start()
+    try:
+        for index in range(len(downloads)):
+            if failed():
+                break
+            start(index)
+        # Downloads which have not been started count as aborted.
+        for index in range(len(downloads)):
+            if index not in downloaders:
+                aborted.add(index)
+                results[index] = (False, 'Cancelled.')
+        if len(results) < len(downloads):
+            loop.exec_()
+    except BaseException:
+        abort_running()
+        raise
+    finally:
+        if timer:
+            timer.stop()
+
+    if failed():
+        for index, result in results.items():
+            output_path = downloads[index][1]
+            if result[0] is True and os.path.exists(output_path):
+                os.remove(output_path)
+        # Report the error which failed the group rather than an aborted
+        # sibling, a timeout aborts every download.
+        errors = [
+            results[index][1] for index in sorted(results)
+            if results[index][0] is not True]
+        first_errors = [
+            results[index][1] for index in sorted(results)
+            if results[index][0] is not True and index not in aborted]
+        raise Exception((first_errors or errors)[0])
+
+
+def extract_zip(zip_path, destination_base_path, atomic=False):
     """Extract different extensions to the destination base path.
 
     Example : test.zip contains a.shp, a.dbf, a.prj
@@ -76,6 +339,9 @@ def extract_zip(zip_path, destination_base_path):
     If two files in the zip with the same extension, only one will be
     copied.
 
+    Members are copied with a fixed size buffer, so memory use does not
+    depend on the size of the extracted files.
+
     :param zip_path: The path of the .zip file
     :type zip_path: str
 
@@ -83,29 +349,218 @@ def extract_zip(zip_path, destination_base_path):
         will be written to.
     :type destination_base_path: str
 
+    :param atomic: Write each member to a partial file first and rename it
+        once complete, so an interrupted extraction never leaves a
+        truncated file at the destination.
+    :type atomic: bool
+
     :raises: IOError - when not able to open path or output_dir does not
         exist.
     """
-    handle = open(zip_path, 'rb')
-    zip_file = zipfile.ZipFile(handle)
-    for name in zip_file.namelist():
-        extension = os.path.splitext(name)[1]
-        _, requested_extension = os.path.splitext(destination_base_path)
-        if requested_extension:
-            output_final_path = destination_base_path
-        else:
-            output_final_path = '%s%s' % (destination_base_path, extension)
-        output_file = open(output_final_path, 'wb')
-        output_file.write(zip_file.read(name))
-        output_file.close()
+    _, requested_extension = os.path.splitext(destination_base_path)
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for name in zip_file.namelist():
+            extension = os.path.splitext(name)[1]
+            if requested_extension:
+                output_final_path = destination_base_path
+            else:
+                output_final_path = '%s%s' % (
+                    destination_base_path, extension)
+            output_path = (
+                output_final_path + PARTIAL_EXT if atomic
+                else output_final_path)
+            try:
+                with zip_file.open(name) as member, \
+                        open(output_path, 'wb') as output_file:
+                    shutil.copyfileobj(
+                        member, output_file, EXTRACT_BUFFER_SIZE)
+            except BaseException:
+                if atomic:
+                    try:
+                        os.remove(output_path)
+                    except OSError:
+                        pass
+                raise
+            if atomic:
+                os.replace(output_path, output_final_path)
+
+
+def vsizip_path(zip_path, extension):
+    """Get the GDAL virtual file system path of a member of a zip archive.
+
+    Layers can be opened from this path directly, without extracting the
+    archive.
+
+    :param zip_path: The path of the .zip file
+    :type zip_path: str
+
+    :param extension: Extension of the member, e.g. '.tif'.
+    :type extension: str
+
+    :returns: The /vsizip/ path of the first member with the extension, or
+        None when the archive has no such member.
+    :rtype: str
+    """
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for name in zip_file.namelist():
+            if name.lower().endswith(extension.lower()):
+                return '/vsizip/{}/{}'.format(
+                    zip_path.replace(os.sep, '/'), name)
+    return None
+
+
+class ScratchWorkspace(object):
+    """Managed directory for downloaded archives.
+
+    Used as a context manager around a download: the files handed out by
+    file_path are removed when the block exits, whether it succeeded or
+    failed. Partial downloads are kept so they can be resumed, and the
+    oldest files are removed whenever the directory grows over its size
+    cap, so the directory stays bounded across long batch sessions.
+
+    Each workspace hands out its own file names, so concurrent downloads
+    of the same url do not overwrite each other's output. The partial file
+    of a download is named after its url only, so a later attempt resumes
+    the partial download left by an interrupted one. Only one workspace at
+    a time downloads to that shared partial file, the others use a partial
+    file of their own.
+    """
+
+    def __init__(self, directory=None, max_size=SCRATCH_MAX_SIZE):
+        """Managed directory for downloaded archives.
+
+        :param directory: Workspace directory. Defaults to a geosys
+            directory in the system temporary directory.
+        :type directory: str
+
+        :param max_size: Maximum total size of the workspace in bytes.
+        :type max_size: int
+        """
+        self.directory = directory or os.path.join(
+            tempfile.gettempdir(), 'geosys', 'downloads')
+        self.max_size = max_size
+        self.files = []
+        # Shared partial files this workspace is downloading to.
+        self.claimed = set()
+        # Distinguishes the files of this workspace from the others.
+        self.prefix = uuid.uuid4().hex
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.enforce_size_cap()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+        self.enforce_size_cap()
+        return False
+
+    def file_path(self, url, suffix=''):
+        """Get the path to download an url to.
+
+        :param url: URL of the file.
+        :type url: str
+
+        :param suffix: Suffix of the file name, e.g. '.tif.zip'.
+        :type suffix: str
+
+        :returns: Path of the download.
+        :rtype: str
+        """
+        path = os.path.join(self.directory, '{}-{}{}'.format(
+            self.prefix, url_digest(url), suffix))
+        self.files.append(path)
+        return path
+
+    def partial_path(self, url, suffix=''):
+        """Get the path of the partial download of an url.
+
+        Unlike file_path, the path is the same in every workspace, so an
+        interrupted download is resumed by the next workspace. While
+        another workspace is downloading the url, a partial file of this
+        workspace is returned instead, removed with the other files.
+
+        :param url: URL of the file.
+        :type url: str
+
+        :param suffix: Suffix of the file name, e.g. '.tif.zip'.
+        :type suffix: str
 
-    handle.close()
+        :returns: Path of the partial download.
+        :rtype: str
+        """
+        name = url_digest(url) + suffix + PARTIAL_EXT
+        path = os.path.join(self.directory, name)
+        with _CLAIMED_PARTIALS_LOCK:
+            if path in self.claimed or path not in _CLAIMED_PARTIALS:
+                _CLAIMED_PARTIALS.add(path)
+                self.claimed.add(path)
+                return path
+        path = os.path.join(self.directory, '{}-{}'.format(self.prefix, name))
+        self.files.extend([path, path + STATE_EXT])
+        return path
+
+    def cleanup(self):
+        """Remove the files handed out by this workspace.
+
+        The shared partial files are kept to be resumed, and released for
+        the other workspaces.
+        """
+        for path in self.files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.files = []
+        with _CLAIMED_PARTIALS_LOCK:
+            _CLAIMED_PARTIALS.difference_update(self.claimed)
+        self.claimed = set()
+
+    def enforce_size_cap(self):
+        """Remove the oldest files while the workspace is over its cap."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
 
 
 class FileDownloader:
-    """The blueprint for downloading file from url."""
+    """The blueprint for downloading file from url.
+
+    Received data is written chunk by chunk to a partial file next to the
+    output path, which is renamed to the output path once the download has
+    succeeded. Memory use therefore does not depend on the size of the file.
+
+    When the server supports range requests, the partial file of an
+    interrupted download is kept with a small resume state (url, ETag,
+    Last-Modified and size) and the next download of the same url continues
+    from its last byte. Otherwise the partial file is removed.
+
+    Downloads go through the Bridge API transport, so they are recorded and
+    replayed along with the API requests.
+    """
 
-    def __init__(self, url, output_path, headers=None, progress_dialog=None):
+    def __init__(
+            self, url, output_path, headers=None, progress_dialog=None,
+            is_retry=False, partial_path=None):
         """Constructor of the class.
 
         :param url: URL of file.
@@ -116,35 +571,137 @@ class FileDownloader:
 
         :param progress_dialog: Progress dialog widget.
         :type progress_dialog: QWidget
+
+        :param is_retry: Whether the download retries or resumes a failed
+            one, for the request metrics.
+        :type is_retry: bool
+
+        :param partial_path: Path of the file being downloaded, defaults to
+            the output path with a .part extension.
+        :type partial_path: str
         """
         # noinspection PyArgumentList
         self.manager = QgsNetworkAccessManager.instance()
-        self.url = QUrl(url)
+        # A replayed download is read from its recording instead.
+        self.transport = current_transport()
+        self.source_url = url
+        self.url = QUrl(self.transport.download_url(url))
         self.output_path = output_path
         self.headers = headers if headers else {}
         self.progress_dialog = progress_dialog
         if self.progress_dialog:
             self.prefix_text = self.progress_dialog.labelText()
+        self.partial_path = partial_path or output_path + PARTIAL_EXT
+        self.state_path = self.partial_path + STATE_EXT
         self.output_file = None
         self.reply = None
-        self.downloaded_file_buffer = None
+        # Slot connected to the progress dialog cancel button.
+        self.cancel_action = None
+        self.write_error = None
+        self.timed_out = False
         self.finished_flag = False
+        # Resume state
+        self.offset = 0
+        self.state = {}
+        self.expected_size = None
+        self.resumable = False
+        self.can_resume = False
+        self.cancelled = False
+        # Request metrics
+        self.is_retry = is_retry
+        self.started_at = None
+        self.bytes_received = 0
+        # Result of the reply, used to decide whether to retry
+        self.http_code = None
+        self.network_error = None
+        self.retry_after = None
+
+    def download(self, timeout=None):
+        """Download the file, blocking until it is finished.
+
+        The wait runs a local QEventLoop, so the thread sleeps until the
+        network reply signals progress instead of spinning.
 
-    def download(self):
-        """Downloading the file.
+        :param timeout: Seconds without receiving any data after which the
+            download is aborted. None waits indefinitely.
+        :type timeout: float
 
         :returns: True if success, otherwise returns a tuple with format like
             this (QNetworkReply.NetworkError, error_message)
 
         :raises: IOError - when cannot create output_path
         """
-        # Prepare output path
-        self.output_file = QFile(self.output_path)
-        if not self.output_file.open(QFile.WriteOnly):
-            raise IOError(self.output_file.errorString())
+        self._start_request()
+
+        loop = QEventLoop()
+        self.reply.finished.connect(loop.quit)
 
-        # Prepare downloaded buffer
-        self.downloaded_file_buffer = QByteArray()
+        timer = None
+        if timeout:
+            timer = QTimer()
+            timer.setSingleShot(True)
+            timer.setInterval(int(timeout * 1000))
+            timer.timeout.connect(self._abort_on_timeout)
+            # Any received data restarts the inactivity timer.
+            self.reply.downloadProgress.connect(timer.start)
+            timer.start()
+
+        # On Windows 32bit AND QGIS 2.2, self.reply.isFinished() always
+        # returns False even after finished slot is called. So, that's why we
+        # are adding self.finished_flag (see #864)
+        try:
+            if not self.reply.isFinished() and not self.finished_flag:
+                loop.exec_()
+        except BaseException:
+            self.reply.abort()
+            self.output_file.close()
+            self.remove_partial_file()
+            raise
+        finally:
+            if timer:
+                timer.stop()
+
+        return self._finish()
+
+    def start(self, callback=None):
+        """Start the download without waiting for it.
+
+        The calling thread needs a running event loop for the download to
+        progress, e.g. the QGIS main thread.
+
+        :param callback: Called with the download result, see download,
+            once the download has finished.
+        :type callback: callable
+
+        :raises: IOError - when cannot create output_path
+        """
+        self._start_request()
+
+        def finished():
+            result = self._finish()
+            if callback:
+                callback(result)
+
+        if self.reply.isFinished():
+            finished()
+        else:
+            self.reply.finished.connect(finished)
+
+    def _start_request(self):
+        """Open the partial output file and send the request.
+
+        :raises: IOError - when cannot create output_path
+        """
+        # Prepare the partial output file, continuing a previous partial
+        # download of the same url if there is one.
+        self.state = self.load_state()
+        self.offset = 0
+        if self.state and os.path.exists(self.partial_path):
+            self.offset = os.path.getsize(self.partial_path)
+        self.output_file = QFile(self.partial_path)
+        open_mode = QFile.Append if self.offset else QFile.WriteOnly
+        if not self.output_file.open(open_mode):
+            raise IOError(self.output_file.errorString())
 
         # Request the url
         request = QNetworkRequest(self.url)
@@ -160,8 +717,22 @@ class FileDownloader:
             #   request.setRawHeader(b'user-agent', userAgent)
             request.setRawHeader(
                 bytes(header_name, 'utf-8'), bytes(header_value, 'utf-8'))
+        if self.offset:
+            LOGGER.debug('Resuming %s from byte %s' % (
+                self.url.toString(), self.offset))
+            request.setRawHeader(
+                b'Range', bytes('bytes=%s-' % self.offset, 'utf-8'))
+            # The server answers with the whole file if it has changed.
+            validator = self.state.get('etag') or self.state.get(
+                'last_modified')
+            request.setRawHeader(b'If-Range', bytes(validator, 'utf-8'))
+        delay = self.transport.download_delay(self.source_url)
+        if delay:
+            wait(delay)
+        self.started_at = time.monotonic()
         self.reply = self.manager.get(request)
-        self.reply.readyRead.connect(self.get_buffer)
+        self.reply.metaDataChanged.connect(self.check_response_headers)
+        self.reply.readyRead.connect(self.write_chunk)
         self.reply.finished.connect(self.write_data)
         self.manager.requestTimedOut.connect(self.request_timeout)
 
@@ -176,9 +747,6 @@ class FileDownloader:
                 :param total: Total expected data.
                 :type total: int
                 """
-                # noinspection PyArgumentList
-                QgsApplication.processEvents()
-
                 self.progress_dialog.adjustSize()
 
                 label_text = (
@@ -191,20 +759,25 @@ class FileDownloader:
             # cancel
             def cancel_action():
                 """Cancel download."""
+                self.cancelled = True
                 self.reply.abort()
-                self.reply.deleteLater()
 
             self.reply.downloadProgress.connect(progress_event)
             self.progress_dialog.canceled.connect(cancel_action)
+            self.cancel_action = cancel_action
 
-        # Wait until finished
-        # On Windows 32bit AND QGIS 2.2, self.reply.isFinished() always
-        # returns False even after finished slot is called. So, that's why we
-        # are adding self.finished_flag (see #864)
-        while not self.reply.isFinished() and not self.finished_flag:
-            # noinspection PyArgumentList
-            QgsApplication.processEvents()
+    def _abort_on_timeout(self):
+        """Abort a download which has not received data in time."""
+        LOGGER.debug('Download timed out: %s' % self.url.toString())
+        self.timed_out = True
+        self.reply.abort()
+
+    def _finish(self):
+        """Move the partial file in place and translate the reply result.
 
+        :returns: True if success, otherwise returns a tuple with format like
+            this (QNetworkReply.NetworkError, error_message)
+        """
         result = self.reply.error()
         try:
             http_code = int(self.reply.attribute(
@@ -212,13 +785,64 @@ class FileDownloader:
         except TypeError:
             # If the user cancels the request, the HTTP response will be None.
             http_code = None
+        error_string = self.reply.errorString()
+        self.http_code = http_code
+        self.network_error = result
+        self.retry_after = parse_retry_after(self.raw_header('Retry-After'))
+        headers = dict(
+            (bytes(name).decode('latin-1'), bytes(value).decode('latin-1'))
+            for name, value in self.reply.rawHeaderPairs())
+        METRICS.record(
+            'GET', self.source_url, http_code,
+            time.monotonic() - self.started_at,
+            bytes_in=self.bytes_received, retry=self.is_retry)
 
         self.reply.abort()
         self.reply.deleteLater()
+        if self.cancel_action:
+            # The next attempt of fetch_data connects its own request.
+            self.progress_dialog.canceled.disconnect(self.cancel_action)
+            self.cancel_action = None
 
-        if result == QNetworkReply.NoError:
+        if self.output_file.isOpen():
+            self.output_file.close()
+        if result == QNetworkReply.NoError and not self.write_error:
+            size = os.path.getsize(self.partial_path)
+            if self.expected_size is not None and (
+                    size != self.expected_size):
+                self.remove_partial_file()
+                return False, (
+                    'Sorry, the downloaded file is incomplete ({} of {} '
+                    'bytes). Please try again.'.format(
+                        size, self.expected_size))
+            # Only a complete file ever appears at the output path.
+            os.replace(self.partial_path, self.output_path)
+            self.remove_state()
+            self.transport.record_download(
+                self.source_url, http_code, headers, self.output_path)
             return True, None
 
+        # Keep what has been received of an interrupted transfer so it can
+        # be resumed, unless the server refused the request.
+        self.can_resume = (
+            self.resumable and not self.write_error
+            and (http_code is None or http_code < 400)
+            and os.path.exists(self.partial_path)
+            and os.path.getsize(self.partial_path) > 0)
+        if not self.can_resume:
+            self.remove_partial_file()
+        if http_code == 416:
+            # The stored part does not fit the file anymore, start over.
+            self.can_resume = True
+        if self.cancelled:
+            self.can_resume = False
+        if self.write_error:
+            return False, self.write_error
+
+        elif self.timed_out:
+            return False, (
+                'Sorry, the download timed out. Please try again later.')
+
         elif result == QNetworkReply.UnknownNetworkError:
             return False, (
                 'The network is unreachable. Please check your internet '
@@ -251,20 +875,156 @@ class FileDownloader:
             return False, 'Sorry, the content was not found on the server.'
 
         else:
-            return result, self.reply.errorString()
+            return result, error_string
+
+    @property
+    def transient_failure(self):
+        """Whether the failure of the download may go away on a retry.
 
-    def get_buffer(self):
-        """Get buffer from self.reply and store it to our buffer container."""
-        buffer_size = self.reply.size()
-        data = self.reply.read(buffer_size)
-        self.downloaded_file_buffer.append(data)
+        :rtype: bool
+        """
+        if self.cancelled or self.write_error:
+            return False
+        if self.timed_out or self.network_error in TRANSIENT_NETWORK_ERRORS:
+            return True
+        return self.http_code is not None and (
+            RETRY_POLICY.retry_status(self.http_code))
+
+    def write_chunk(self):
+        """Write the data available in self.reply to the partial file."""
+        if self.write_error:
+            return
+        data = self.reply.readAll()
+        self.bytes_received += len(data)
+        if data and self.output_file.write(data) == -1:
+            self.write_error = self.output_file.errorString()
+            LOGGER.debug('Could not write %s: %s' % (
+                self.partial_path, self.write_error))
+            self.reply.abort()
 
     def write_data(self):
-        """Write data to a file."""
-        self.output_file.write(self.downloaded_file_buffer)
+        """Write the remaining data and close the partial file."""
+        self.write_chunk()
         self.output_file.close()
         self.finished_flag = True
 
+    def raw_header(self, name):
+        """Get a header of the reply.
+
+        :param name: Header name.
+        :type name: str
+
+        :returns: The header value, or None when the header is missing.
+        :rtype: str
+        """
+        name = bytes(name, 'utf-8')
+        if not self.reply.hasRawHeader(name):
+            return None
+        return bytes(self.reply.rawHeader(name)).decode('latin-1')
+
+    def check_response_headers(self):
+        """Check the response matches the requested range.
+
+        Records the expected size and the resume state of the download, and
+        starts again from the first byte when the server sends the whole
+        file instead of the requested range.
+        """
+        status = self.reply.attribute(
+            QNetworkRequest.HttpStatusCodeAttribute)
+        if status is None:
+            return
+        status = int(status)
+        etag = self.raw_header('ETag')
+        last_modified = self.raw_header('Last-Modified')
+        content_length = self.raw_header('Content-Length')
+
+        if status == 206:
+            match = CONTENT_RANGE_PATTERN.match(
+                self.raw_header('Content-Range') or '')
+            stored_etag = self.state.get('etag')
+            if not match or int(match.group(1)) != self.offset or (
+                    etag and stored_etag and etag != stored_etag):
+                # Not the range we asked for, do not append it.
+                self.write_error = (
+                    'Sorry, the server returned an unexpected part of the '
+                    'file. Please try again.')
+                self.resumable = False
+                self.reply.abort()
+                return
+            if match.group(3) != '*':
+                self.expected_size = int(match.group(3))
+            self.resumable = True
+        elif status == 200:
+            if self.offset:
+                # Range not honoured or the file has changed, restart.
+                LOGGER.debug('Restarting download of %s' % (
+                    self.url.toString()))
+                self.output_file.close()
+                self.output_file.open(QFile.WriteOnly)
+                self.offset = 0
+            if content_length:
+                self.expected_size = int(content_length)
+            self.resumable = (
+                (self.raw_header('Accept-Ranges') or '').lower() == 'bytes')
+        else:
+            return
+
+        if self.resumable and (etag or last_modified):
+            self.save_state({
+                'url': self.url.toString(),
+                'etag': etag,
+                'last_modified': last_modified,
+                'size': self.expected_size
+            })
+        else:
+            self.resumable = False
+
+    def load_state(self):
+        """Load the resume state of a previous partial download.
+
+        :returns: The resume state, or an empty dict when there is no
+            usable partial download of this url.
+        :rtype: dict
+        """
+        try:
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+        if state.get('url') != self.url.toString() or not (
+                state.get('etag') or state.get('last_modified')):
+            self.remove_partial_file()
+            return {}
+        return state
+
+    def save_state(self, state):
+        """Save the resume state of the download.
+
+        :param state: Url, validators and size of the downloaded file.
+        :type state: dict
+        """
+        try:
+            with open(self.state_path, 'w') as state_file:
+                json.dump(state, state_file)
+        except OSError as e:
+            LOGGER.debug('Could not save download state: %s' % e)
+            self.resumable = False
+
+    def remove_state(self):
+        """Remove the resume state of the download."""
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    def remove_partial_file(self):
+        """Remove the partial file of a failed download."""
+        try:
+            os.remove(self.partial_path)
+        except OSError:
+            pass
+        self.remove_state()
+
     def request_timeout(self):
         """The request timed out."""
         if self.progress_dialog:
@@ -8,8 +8,8 @@ from qgis.core import (
     QgsMapLayer,
     QgsLayerItem,
     QgsWkbTypes,
-    QgsCoordinateTransform,
     QgsFeature,
+    QgsFeatureRequest,
     QgsMemoryProviderUtils,
     QgsFields,
     QgsCoordinateReferenceSystem,
@@ -297,82 +297,139 @@ def create_memory_layer(
     return memory_layer
 
 
-def reproject(layer, output_crs):
-    """Reproject a vector layer to a specific CRS.
+def geometry_request(
+        output_crs, feature_ids=None, max_features=None,
+        transform_context=None, attributes=None):
+    """Feature request streaming only the geometries, in a specific CRS.
 
-    :param layer: The layer to reproject.
-    :type layer: QgsVectorLayer
+    Geometries are transformed one by one while they are read, so only the
+    requested features are ever reprojected and no intermediate layer is
+    created. Attributes are not fetched, unless requested.
 
     :param output_crs: The destination CRS.
     :type output_crs: QgsCoordinateReferenceSystem
 
-    :return: Reprojected memory layer.
-    :rtype: QgsVectorLayer
-    """
-    output_layer_name = '{}_reprojected'.format(layer.name())
-
-    input_crs = layer.crs()
-    input_fields = layer.fields()
+    :param feature_ids: Ids of the features to fetch, None for every
+        feature.
+    :type feature_ids: list
 
-    reprojected = create_memory_layer(
-        output_layer_name, layer.geometryType(), output_crs, input_fields)
-    reprojected.startEditing()
-
-    crs_transform = QgsCoordinateTransform(
-        input_crs, output_crs, QgsProject.instance())
+    :param max_features: Maximum number of features, None for no limit.
+    :type max_features: int
 
-    out_feature = QgsFeature()
+    :param transform_context: Coordinate transform context, defaults to
+        the one of the current project.
+    :type transform_context: QgsCoordinateTransformContext
 
-    for i, feature in enumerate(layer.getFeatures()):
-        geom = feature.geometry()
-        geom.transform(crs_transform)
-        out_feature.setGeometry(geom)
-        out_feature.setAttributes(feature.attributes())
-        reprojected.addFeature(out_feature)
+    :param attributes: Indexes of the attributes to fetch, None for none.
+    :type attributes: list
 
-    reprojected.commitChanges()
-    return reprojected
+    :return: The feature request.
+    :rtype: QgsFeatureRequest
+    """
+    request = QgsFeatureRequest()
+    request.setDestinationCrs(
+        output_crs,
+        transform_context or QgsProject.instance().transformContext())
+    if attributes:
+        request.setSubsetOfAttributes(list(attributes))
+    else:
+        request.setNoAttributes()
+    if feature_ids is not None:
+        request.setFilterFids(list(feature_ids))
+    if max_features is not None:
+        request.setLimit(max_features)
+    return request
 
 
-def wkt_geometries_from_feature_iterator(
+def geometries_from_feature_iterator(
         feature_iterator, max_features=None, as_single_geometry=False):
-    """Get list of wkt geometries from a QgsMapLayer feature iterator.
+    """Get list of geometries from a QgsMapLayer feature iterator.
 
     :param feature_iterator: QGIS layer feature iterator.
         *retrieved from QgsMapLayer.getFeatures()
     :type feature_iterator: QgsFeatureIterator
 
-    :param max_features: Number of maximum features iteration.
+    :param max_features: Number of maximum features iteration, None to
+        iterate every feature.
     :type max_features: int
 
     :param as_single_geometry: Flag indicating whether to squash the features
         into single geometry or not.
     :type as_single_geometry: bool
 
-    :return: List of wkt geometries.
+    :return: List of geometries.
     :rtype: list
     """
-    geom = None
     geoms = []
     for index, feature in enumerate(feature_iterator):
-        if index >= max_features:
+        if max_features is not None and index >= max_features:
             break
         if not feature.hasGeometry():
             continue
-        if as_single_geometry:
-            if not geom:
-                geom = feature.geometry()
-            else:
-                geom = geom.combine(feature.geometry())
-        else:
-            geoms.append(feature.geometry())
-
-    if geom:
-        return [geom.asWkt()]
-    elif geoms:
-        return [geom.asWkt() for geom in geoms]
+        geoms.append(feature.geometry())
+
+    if as_single_geometry:
+        geom = merge_geometries(geoms)
+        return [geom] if geom else []
+    return geoms
+
+
+def merge_geometries(geometries):
+    """Merge geometries into a single geometry.
+
+    Every geometry is merged in a single unary union, instead of combining
+    them one by one which gets slower with every merged geometry. Invalid
+    geometries are only repaired when the union fails because of them.
+
+    :param geometries: Geometries to merge.
+    :type geometries: list
+
+    :return: The merged geometry, None when there is nothing to merge or
+        the geometries can not be merged.
+    :rtype: QgsGeometry
+    """
+    geometries = [
+        geometry for geometry in geometries
+        if geometry and not geometry.isNull()]
+    if not geometries:
+        return None
+    if len(geometries) == 1:
+        merged = geometries[0]
+        if not merged.isGeosValid():
+            merged = merged.makeValid()
     else:
-        return []
+        merged = QgsGeometry.unaryUnion(geometries)
+        if merged.isNull() or merged.isEmpty():
+            # GEOS fails on some invalid inputs, repair them and try again.
+            merged = QgsGeometry.unaryUnion(
+                [geometry.makeValid() for geometry in geometries])
+    if merged.isNull() or merged.isEmpty():
+        return None
+    return merged
+
+
+def wkt_geometries_from_feature_iterator(
+        feature_iterator, max_features=None, as_single_geometry=False):
+    """Get list of wkt geometries from a QgsMapLayer feature iterator.
+
+    :param feature_iterator: QGIS layer feature iterator.
+        *retrieved from QgsMapLayer.getFeatures()
+    :type feature_iterator: QgsFeatureIterator
+
+    :param max_features: Number of maximum features iteration, None to
+        iterate every feature.
+    :type max_features: int
+
+    :param as_single_geometry: Flag indicating whether to squash the features
+        into single geometry or not.
+    :type as_single_geometry: bool
+
+    :return: List of wkt geometries.
+    :rtype: list
+    """
+    return [
+        geom.asWkt() for geom in geometries_from_feature_iterator(
+            feature_iterator, max_features, as_single_geometry)]
 
 def attribute_from_feature_iterator(
         feature_iterator, attribute):
@@ -397,7 +454,8 @@ def attribute_from_feature_iterator(
 
     return attr_vals
 
-def create_hotspot_layer(source, source_type, source_filename):
+def create_hotspot_layer(
+        source, source_type, source_filename, created_layers=None):
     """Creates layer from wkt text in the source.
 
         :param source: Array with json objects containing WKT text.
@@ -439,6 +497,11 @@ def create_hotspot_layer(source, source_type, source_filename):
 
         :param source_filename: Filename of the result layer
         :type source_filename: string
+
+        :param created_layers: When given, the (path, name) of the saved
+            layer is appended to it instead of adding the layer to the
+            project, e.g. when the layer is created outside the main thread.
+        :type created_layers: list
     """
     crs = QgsCoordinateReferenceSystem()
     fields = QgsFields()
@@ -505,5 +568,8 @@ def create_hotspot_layer(source, source_type, source_filename):
         "ESRI Shapefile")
 
     if error == QgsVectorFileWriter.NoError:
+        if created_layers is not None:
+            created_layers.append((file_name, source_filename))
+            return
         saved_layer = QgsVectorLayer(file_name, source_filename, "ogr")
         add_layer_to_canvas(saved_layer, source_filename)
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Record how long the plugin takes to load.
+
+The plugin only registers its actions and its processing provider when
+QGIS starts; the dock, the dialogs and the Bridge API client are imported
+and built the first time they are used. The load report records the cost
+of each of these steps, telling apart what is paid on every QGIS start
+from what is paid on first use.
+"""
+import importlib
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+IMPORT = 'import'
+CONSTRUCTION = 'construction'
+
+
+class LoadReport(object):
+    """Import and construction cost of the plugin modules."""
+
+    def __init__(self, clock=time.perf_counter):
+        """Constructor.
+
+        :param clock: Function returning the current time in seconds.
+        :type clock: callable
+        """
+        self.clock = clock
+        self.entries = []
+        self.started = False
+
+    def startup_finished(self):
+        """Mark the end of the plugin startup.
+
+        Steps measured afterwards are reported as first use.
+        """
+        self.started = True
+
+    @contextmanager
+    def measure(self, kind, name):
+        """Measure a loading step.
+
+        :param kind: IMPORT or CONSTRUCTION.
+        :type kind: str
+
+        :param name: Module or object name.
+        :type name: str
+        """
+        modules = len(sys.modules)
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.entries.append({
+                'phase': 'first use' if self.started else 'startup',
+                'kind': kind,
+                'name': name,
+                'seconds': self.clock() - start,
+                'modules': len(sys.modules) - modules
+            })
+
+    def import_module(self, name):
+        """Import a module, measuring the import unless already imported.
+
+        :param name: Absolute module name.
+        :type name: str
+
+        :return: The module.
+        :rtype: module
+        """
+        if name in sys.modules:
+            return sys.modules[name]
+        with self.measure(IMPORT, name):
+            return importlib.import_module(name)
+
+    def total(self, phase):
+        """Total time spent in a phase.
+
+        :param phase: 'startup' or 'first use'.
+        :type phase: str
+
+        :return: Time in seconds.
+        :rtype: float
+        """
+        return sum(
+            entry['seconds'] for entry in self.entries
+            if entry['phase'] == phase)
+
+    def message(self):
+        """Human readable report.
+
+        :rtype: str
+        """
+        lines = [
+            'GEOSYS load report: {:.1f} ms at startup, {:.1f} ms on first '
+            'use.'.format(
+                1000 * self.total('startup'),
+                1000 * self.total('first use'))]
+        for entry in self.entries:
+            lines.append(
+                '  {phase:<9} {kind:<12} {name}: {ms:.1f} ms, {modules} new '
+                'modules'.format(ms=1000 * entry['seconds'], **entry))
+        return '\n'.join(lines)
+
+
+LOAD_REPORT = LoadReport()
@@ -0,0 +1,210 @@
+# coding=utf-8
+"""Reduce the size of the geometries sent in coverage searches.
+
+Digitized field boundaries can have thousands of vertices written with
+full double precision, which makes coverage and catalog-imagery requests
+large and slow to parse. Coordinates are snapped to a grid matching the
+requested precision and polygons are simplified with a topology
+preserving algorithm, as long as the result stays close enough to the
+original for the coverage answer to be the same.
+"""
+import logging
+
+from qgis.core import QgsGeometry, QgsWkbTypes
+
+from geosys.bridge_api.default import (
+    DEFAULT_PAYLOAD_PRECISION,
+    DEFAULT_PAYLOAD_TOLERANCE,
+    DEFAULT_PAYLOAD_MAX_AREA_CHANGE)
+from geosys.utilities.settings import setting
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+
+class PayloadReport(object):
+    """Size of the geometries before and after optimization."""
+
+    def __init__(self):
+        self.geometries = 0
+        self.simplified = 0
+        self.original_bytes = 0
+        self.optimized_bytes = 0
+
+    def add(self, original_wkt, optimized_wkt, simplified=False):
+        """Account for an optimized geometry.
+
+        :param original_wkt: Geometry at full precision.
+        :type original_wkt: str
+
+        :param optimized_wkt: Geometry sent to the API.
+        :type optimized_wkt: str
+
+        :param simplified: Whether the geometry was simplified.
+        :type simplified: bool
+        """
+        self.geometries += 1
+        self.simplified += int(simplified)
+        self.original_bytes += len(original_wkt.encode('utf-8'))
+        self.optimized_bytes += len(optimized_wkt.encode('utf-8'))
+
+    @property
+    def saved_bytes(self):
+        """Number of bytes saved.
+
+        :rtype: int
+        """
+        return self.original_bytes - self.optimized_bytes
+
+    def message(self):
+        """Human readable summary of the optimization.
+
+        :rtype: str
+        """
+        ratio = 0.0
+        if self.original_bytes:
+            ratio = 100.0 * self.saved_bytes / self.original_bytes
+        return (
+            'Coverage payload: {} geometries ({} simplified), {} bytes '
+            'instead of {}, {} bytes saved ({:.1f}%).'.format(
+                self.geometries, self.simplified, self.optimized_bytes,
+                self.original_bytes, self.saved_bytes, ratio))
+
+
+def _equivalent(original, candidate, max_area_change):
+    """Whether an optimized polygon can replace the original one.
+
+    :param original: Original geometry.
+    :type original: QgsGeometry
+
+    :param candidate: Optimized geometry.
+    :type candidate: QgsGeometry
+
+    :param max_area_change: Maximum relative area change.
+    :type max_area_change: float
+
+    :rtype: bool
+    """
+    if candidate is None or candidate.isNull() or candidate.isEmpty():
+        return False
+    if original.isGeosValid() and not candidate.isGeosValid():
+        return False
+    if original.type() != QgsWkbTypes.PolygonGeometry:
+        return True
+    area = original.area()
+    if not area:
+        return False
+    return abs(candidate.area() - area) / area <= max_area_change
+
+
+def optimize_geometry(
+        geometry,
+        precision=DEFAULT_PAYLOAD_PRECISION,
+        tolerance=DEFAULT_PAYLOAD_TOLERANCE,
+        max_area_change=DEFAULT_PAYLOAD_MAX_AREA_CHANGE):
+    """Smallest WKT of a geometry giving the same coverage answer.
+
+    Polygons are simplified with GEOS topology preserving simplification,
+    so rings keep their topology and parts do not overlap. Coordinates are
+    then snapped to a grid of 10 ** -precision, which also drops the
+    vertices collapsing onto their neighbour. A step is skipped when its
+    result is not valid or changes the area more than max_area_change.
+
+    :param geometry: Geometry in EPSG:4326.
+    :type geometry: QgsGeometry
+
+    :param precision: Number of decimals of the coordinates, a negative
+        value keeps the full precision.
+    :type precision: int
+
+    :param tolerance: Simplification tolerance in degrees, 0 disables it.
+    :type tolerance: float
+
+    :param max_area_change: Maximum relative area change of a polygon.
+    :type max_area_change: float
+
+    :return: Tuple of the WKT and whether the geometry was simplified.
+    :rtype: (str, bool)
+    """
+    if precision is None or precision < 0:
+        return geometry.asWkt(), False
+
+    optimized = geometry
+    simplified = False
+    if tolerance and geometry.type() == QgsWkbTypes.PolygonGeometry:
+        candidate = geometry.simplify(tolerance)
+        if _equivalent(geometry, candidate, max_area_change):
+            optimized = candidate
+            simplified = True
+
+    spacing = 10 ** -precision
+    snapped = optimized.snappedToGrid(spacing, spacing)
+    if not _equivalent(geometry, snapped, max_area_change):
+        if optimized is geometry:
+            return geometry.asWkt(), False
+        # Snapping the original does not collapse as many vertices.
+        snapped = QgsGeometry(geometry).snappedToGrid(spacing, spacing)
+        simplified = False
+        if not _equivalent(geometry, snapped, max_area_change):
+            return geometry.asWkt(), False
+    return snapped.asWkt(precision), simplified
+
+
+def optimize_geometries(
+        geometries,
+        precision=DEFAULT_PAYLOAD_PRECISION,
+        tolerance=DEFAULT_PAYLOAD_TOLERANCE,
+        max_area_change=DEFAULT_PAYLOAD_MAX_AREA_CHANGE):
+    """Smallest WKT of several geometries, see optimize_geometry.
+
+    :param geometries: Geometries in EPSG:4326.
+    :type geometries: list
+
+    :param precision: Number of decimals of the coordinates.
+    :type precision: int
+
+    :param tolerance: Simplification tolerance in degrees.
+    :type tolerance: float
+
+    :param max_area_change: Maximum relative area change of a polygon.
+    :type max_area_change: float
+
+    :return: Tuple of the WKT geometries and the payload report.
+    :rtype: (list, PayloadReport)
+    """
+    report = PayloadReport()
+    wkt_geometries = []
+    for geometry in geometries:
+        wkt, simplified = optimize_geometry(
+            geometry, precision, tolerance, max_area_change)
+        report.add(geometry.asWkt(), wkt, simplified)
+        wkt_geometries.append(wkt)
+    LOGGER.debug(report.message())
+    return wkt_geometries, report
+
+
+def optimize_geometries_from_settings(geometries, qsettings=None):
+    """Optimize geometries with the payload settings of the plugin.
+
+    :param geometries: Geometries in EPSG:4326.
+    :type geometries: list
+
+    :param qsettings: A custom QSettings to use. If it's not defined, it will
+        use the default one.
+    :type qsettings: qgis.PyQt.QtCore.QSettings
+
+    :return: Tuple of the WKT geometries and the payload report.
+    :rtype: (list, PayloadReport)
+    """
+    return optimize_geometries(
+        geometries,
+        precision=setting(
+            'payload_precision', DEFAULT_PAYLOAD_PRECISION,
+            expected_type=int, qsettings=qsettings),
+        tolerance=setting(
+            'payload_tolerance', DEFAULT_PAYLOAD_TOLERANCE,
+            expected_type=float, qsettings=qsettings))
@@ -1,7 +1,20 @@
 # coding=utf-8
 """Helpers for QGIS related functionality."""
+import os
 
-from qgis.core import Qgis
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
+
+from geosys.bridge_api.cache import COVERAGE_CACHE
+from geosys.bridge_api.default import (
+    DEFAULT_COVERAGE_CACHE_TTL,
+    DEFAULT_COVERAGE_CACHE_SIZE,
+    DEFAULT_THUMBNAIL_CACHE_SIZE,
+    DEFAULT_RETRY_ATTEMPTS,
+    DEFAULT_RETRY_BUDGET)
+from geosys.bridge_api.metrics import METRICS
+from geosys.bridge_api.retry import RETRY_POLICY
+from geosys.utilities.settings import setting
+from geosys.utilities.thumbnail_cache import THUMBNAIL_STORE
 
 __copyright__ = "Copyright 2019, Kartoza"
 __license__ = "GPL version 3"
@@ -28,3 +41,69 @@ def qgis_version():
     version = str(Qgis.QGIS_VERSION_INT)
     version = int(version)
     return version
+
+
+def cache_directory(name):
+    """Get a cache directory inside the QGIS profile.
+
+    :param name: Name of the cache, e.g. 'coverage'.
+    :type name: str
+
+    :returns: Path of the cache directory.
+    :rtype: str
+    """
+    return os.path.join(
+        QgsApplication.qgisSettingsDirPath(), 'geosys', 'cache', name)
+
+
+def configure_coverage_cache(qsettings=None):
+    """Apply the coverage cache settings to the shared coverage cache.
+
+    :param qsettings: A custom QSettings to use. If it's not defined, it will
+        use the default one.
+    :type qsettings: qgis.PyQt.QtCore.QSettings
+    """
+    COVERAGE_CACHE.configure(
+        directory=cache_directory('coverage'),
+        ttl=setting(
+            'coverage_cache_ttl', DEFAULT_COVERAGE_CACHE_TTL,
+            expected_type=int, qsettings=qsettings),
+        max_size=setting(
+            'coverage_cache_size', DEFAULT_COVERAGE_CACHE_SIZE,
+            expected_type=int, qsettings=qsettings))
+
+
+def configure_thumbnail_store(qsettings=None):
+    """Apply the thumbnail store settings to the shared thumbnail store.
+
+    :param qsettings: A custom QSettings to use. If it's not defined, it will
+        use the default one.
+    :type qsettings: qgis.PyQt.QtCore.QSettings
+    """
+    THUMBNAIL_STORE.disk_cache.configure(
+        directory=cache_directory('thumbnail'),
+        max_size=setting(
+            'thumbnail_cache_size', DEFAULT_THUMBNAIL_CACHE_SIZE,
+            expected_type=int, qsettings=qsettings))
+
+
+def configure_retry_policy(qsettings=None):
+    """Apply the retry settings to the shared Bridge API retry policy.
+
+    :param qsettings: A custom QSettings to use. If it's not defined, it will
+        use the default one.
+    :type qsettings: qgis.PyQt.QtCore.QSettings
+    """
+    RETRY_POLICY.configure(
+        max_attempts=setting(
+            'retry_attempts', DEFAULT_RETRY_ATTEMPTS,
+            expected_type=int, qsettings=qsettings),
+        budget=setting(
+            'retry_budget', DEFAULT_RETRY_BUDGET,
+            expected_type=float, qsettings=qsettings))
+
+
+def log_request_metrics():
+    """Write the summary of the request metrics to the QGIS message log."""
+    QgsMessageLog.logMessage(
+        METRICS.format_summary(), 'GEOSYS', Qgis.Info)
@@ -0,0 +1,162 @@
+# coding=utf-8
+"""Store of coverage thumbnails shared by the dock and its result widgets.
+"""
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from PyQt5.QtGui import QImage
+
+from geosys.bridge_api.cache import BlobCache, request_key
+from geosys.bridge_api.default import (
+    DEFAULT_THUMBNAIL_CACHE_SIZE, DEFAULT_THUMBNAIL_MEMORY_ITEMS)
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+# Query parameters which carry credentials rather than select content.
+AUTH_PARAMETERS = ('access_token', 'token', 'signature', 'key')
+
+
+def thumbnail_key(url):
+    """Key of a thumbnail in the store.
+
+    Credentials in the url (user info and token query parameters) are
+    dropped, so the key only depends on the content the url points to.
+
+    :param url: Thumbnail url.
+    :type url: str
+
+    :return: Store key.
+    :rtype: str
+    """
+    parts = urlsplit(url)
+    netloc = parts.netloc.rsplit('@', 1)[-1]
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parts.query)
+        if name.lower() not in AUTH_PARAMETERS))
+    return request_key(
+        urlunsplit((parts.scheme, netloc, parts.path, query, '')))
+
+
+class ThumbnailStore(object):
+    """Disk-backed thumbnail store with an in-memory LRU of decoded images.
+
+    Raw thumbnail files are kept on disk in a size-bounded BlobCache. The
+    most recently used thumbnails are also kept decoded as QImage, so
+    showing them again does not touch the disk or decode the png again.
+    """
+
+    def __init__(
+            self,
+            disk_cache=None,
+            memory_items=DEFAULT_THUMBNAIL_MEMORY_ITEMS):
+        """Disk-backed thumbnail store.
+
+        :param disk_cache: Store of the raw thumbnail files.
+        :type disk_cache: BlobCache
+
+        :param memory_items: Number of decoded images kept in memory.
+        :type memory_items: int
+        """
+        self.disk_cache = disk_cache or BlobCache(
+            max_size=DEFAULT_THUMBNAIL_CACHE_SIZE)
+        self.memory_items = memory_items
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, image):
+        """Put a decoded image in the in-memory LRU."""
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.memory_items:
+                self._images.popitem(last=False)
+
+    def contains(self, url):
+        """Whether the thumbnail of an url is stored.
+
+        :param url: Thumbnail url.
+        :type url: str
+
+        :rtype: bool
+        """
+        key = thumbnail_key(url)
+        with self._lock:
+            if key in self._images:
+                return True
+        return self.disk_cache.contains(key)
+
+    def image(self, url):
+        """Get the decoded thumbnail of an url.
+
+        :param url: Thumbnail url.
+        :type url: str
+
+        :return: The thumbnail, or None when it is not stored.
+        :rtype: QImage
+        """
+        key = thumbnail_key(url)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                return image
+
+        content = self.disk_cache.get(key)
+        if not content:
+            return None
+        image = QImage.fromData(content)
+        if image.isNull():
+            self.disk_cache.invalidate(key)
+            return None
+        self._remember(key, image)
+        return image
+
+    def put(self, url, content):
+        """Store the thumbnail of an url.
+
+        :param url: Thumbnail url.
+        :type url: str
+
+        :param content: Raw thumbnail file content.
+        :type content: bytes
+
+        :return: Whether the content is a valid image and has been stored.
+        :rtype: bool
+        """
+        image = QImage.fromData(content)
+        if image.isNull():
+            return False
+        key = thumbnail_key(url)
+        self.disk_cache.set(key, bytes(content))
+        self._remember(key, image)
+        return True
+
+    def fetch(self, url, download):
+        """Make sure the thumbnail of an url is stored.
+
+        :param url: Thumbnail url.
+        :type url: str
+
+        :param download: Callable downloading the url content, called only
+            when the thumbnail is not stored yet.
+        :type download: callable
+
+        :return: Whether the thumbnail is available in the store.
+        :rtype: bool
+        """
+        if self.contains(url):
+            return True
+        return self.put(url, download(url))
+
+    def clear(self):
+        """Remove every stored thumbnail."""
+        with self._lock:
+            self._images.clear()
+        self.disk_cache.clear()
+
+
+THUMBNAIL_STORE = ThumbnailStore()
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Date-indexed collections of maps.
+
+The maps of a field downloaded over a period are stacked in a single
+raster, one band per image date, and listed in a manifest table.
+"""
+import csv
+import logging
+import uuid
+
+from osgeo import gdal
+
+from geosys.bridge_api.default import VRT_EXT
+
+__copyright__ = "Copyright 2019, Kartoza"
+__license__ = "GPL version 3"
+__email__ = "rohmat@kartoza.com"
+__revision__ = "$Format:%H$"
+
+LOGGER = logging.getLogger('geosys')
+
+MANIFEST_FIELDS = [
+    'field', 'date', 'image_id', 'sensor', 'band', 'path', 'status']
+
+
+def build_stack(paths, dates, destination):
+    """Stack the maps of a field in one raster, a band per date.
+
+    The stack is a VRT referencing the maps when the destination ends
+    with .vrt, otherwise a GeoTIFF holding a copy of the pixels. Only the
+    first band of each map is stacked. Band descriptions and the DATE
+    band metadata give the date of each band.
+
+    :param paths: Paths of the maps, sorted by date.
+    :type paths: list
+
+    :param dates: Image date of each map, YYYY-MM-DD.
+    :type dates: list
+
+    :param destination: Path of the stack.
+    :type destination: str
+
+    :raises: IOError - when the stack can not be created.
+
+    :return: Path of the stack.
+    :rtype: str
+    """
+    as_vrt = destination.lower().endswith(VRT_EXT)
+    vrt_path = destination if as_vrt else '/vsimem/{}{}'.format(
+        uuid.uuid4().hex, VRT_EXT)
+    dataset = gdal.BuildVRT(vrt_path, list(paths), separate=True)
+    if dataset is None:
+        raise IOError('Unable to stack the maps of {}: {}'.format(
+            destination, gdal.GetLastErrorMsg()))
+    try:
+        for band_number, date in enumerate(dates, 1):
+            band = dataset.GetRasterBand(band_number)
+            band.SetDescription(date)
+            band.SetMetadataItem('DATE', date)
+        if not as_vrt:
+            output = gdal.Translate(
+                destination, dataset, format='GTiff',
+                creationOptions=[
+                    'COMPRESS=DEFLATE', 'TILED=YES', 'BIGTIFF=IF_SAFER'])
+            if output is None:
+                raise IOError('Unable to write {}: {}'.format(
+                    destination, gdal.GetLastErrorMsg()))
+            # Closing the dataset flushes it to disk.
+            output = None
+    finally:
+        dataset = None
+        if not as_vrt:
+            gdal.Unlink(vrt_path)
+    return destination
+
+
+def write_manifest(path, rows):
+    """Write the manifest table of the downloaded maps.
+
+    :param path: Path of the CSV file.
+    :type path: str
+
+    :param rows: Rows with the MANIFEST_FIELDS keys.
+    :type rows: list
+    """
+    with open(path, 'w', newline='') as manifest:
+        writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    LOGGER.debug('{} maps listed in {}'.format(len(rows), path))
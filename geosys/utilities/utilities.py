@@ -313,7 +313,7 @@ def readable_os_version():
         return platform.platform()
 
 
-def check_if_file_exists(output_dir, file_name, extension):
+def check_if_file_exists(output_dir, file_name, extension, reserved=None):
     """The method checks if a file exists, and if it does, then it adds an increment to the filename.
     This is done until there are no longer a clash with the filename.
 
@@ -326,17 +326,27 @@ def check_if_file_exists(output_dir, file_name, extension):
     :param extension: The output file extension.
     :type extension: str
 
+    :param reserved: Names already given to outputs which are not written
+        yet, e.g. maps queued in the same batch. They count as clashes.
+    :type reserved: set
+
     :returns: Returns the updated name for the output file which will have no clashes with existing files.
     :rtype: str
     """
+    def file_exists(name):
+        if reserved and name in reserved:
+            return True
+        # Zipped products may be kept as an archive next to the outputs.
+        file_full_dir = os.path.join(output_dir, name + extension)
+        return os.path.exists(file_full_dir) or (
+            os.path.exists(file_full_dir + '.zip'))
+
     cur_file_name = file_name
-    file_full_dir = '{}\\{}{}'.format(output_dir, cur_file_name, extension)
 
     i = 1
     while True:  # Will break out of the loop if no clash is found
-        if os.path.exists(file_full_dir):  # Filename exists, add counter value
+        if file_exists(cur_file_name):  # Filename exists, add counter value
             cur_file_name = '{}_{}'.format(file_name, str(i))
-            file_full_dir = '{}\\{}{}'.format(output_dir, cur_file_name, extension)
             i = i + 1
         else:  # Filename does not exist, use current filename
             break